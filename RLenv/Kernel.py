@@ -1,3 +1,4 @@
+import heapq
 import logging
 import os
 import datetime
@@ -11,7 +12,8 @@ from RLenv.Messages.Message import *
 from RLenv.Messages.AgentMessages import *
 from RLenv.Messages.ExchangeMessages import *
 from RLenv.Exceptions import *
-from typing import Any, Dict, List, Optional, Tuple
+from simulation.Profiler import Profiler
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 logger=logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -34,15 +36,27 @@ class Kernel:
         wall_time_limit: stop the simulation in wall-time  (in seconds)
         log_to_file: Boolean flag to store record of log
         parameters: simulation parameters, to be implemented
+        profiler: optional Profiler recording enqueue, dispatch and per message type handler times (handler.<MessageType>), None to disable
+        debug: validate the sender and recipient of every message on send, otherwise unknown IDs only fail on delivery
     
     Note that the simulation timefloor is in microseconds
+
+    Messages are delivered through a dispatch table from message class to handler, built when the entities are registered
+    (a subclass gets the handler of its first class in HANDLERS), so that delivering a message is a dict lookup and a call.
     
     """
-    def __init__(self, agents: List[TradingAgent], exchange: Exchange, seed: int=1, kernel_name: str="Alpha", stop_time: int=100, wall_time_limit: int=600, log_to_file: bool=True, parameters: Dict[str, any]=None) -> None:
+    #Handler of each message class, resolved along the MRO for subclasses
+    HANDLERS: Dict[type, str]={PartialOrderFill: "_onpartialfill", OrderAutoCancelledMsg: "_onautocancelled", OrderExecutedMsg: "_onorderexecuted",
+                               WakeAgentMsg: "_onwakeagent", LimitOrderMsg: "_onagentorder", MarketOrderMsg: "_onagentorder",
+                               CancelOrderMsg: "_onagentorder", DoNothing: "_ondonothing"}
+    #Expected (sender, recipient) entity types of each message family, only checked in debug mode
+    ROUTES: Dict[type, Tuple[type, type]]={AgentMsg: (TradingAgent, Exchange), ExchangeMsg: (Exchange, TradingAgent)}
+
+    def __init__(self, agents: List[TradingAgent], exchange: Exchange, seed: int=1, kernel_name: str="Alpha", stop_time: int=100, wall_time_limit: int=600, log_to_file: bool=True, parameters: Dict[str, any]=None, profiler: Optional[Profiler]=None, debug: bool=False) -> None:
         self.kernel_name=kernel_name
         self.agents: List[TradingAgent]=agents
         self.gymagents= [agent for agent in self.agents if isinstance(agent, RLAgent)]
-        assert len(self.gymagents==1), f"This Kernel is currently incompatible with more than one Gym RLAgent"
+        assert len(self.gymagents)<=1, f"This Kernel is currently incompatible with more than one Gym RLAgent"
         assert len(agents)>0, f"Number of agents must be more than 0" 
         self.exchange: Exchange=exchange
         assert exchange, f"Expected a valid exchange but received None"
@@ -51,6 +65,11 @@ class Kernel:
         self.entity_registry[exchange.id]=self.exchange
         for value in self.entity_registry.values():
             value.kernel=self
+        #Dispatch table of the message classes and the (message, sender, recipient) types already validated in debug mode
+        self.debug: bool=debug
+        self.dispatch: Dict[type, Callable]={}
+        self.validroutes: Set[Tuple[type, type, type]]=set()
+        self.builddispatch()
         #Global seed:
         self.seed: Optional[int]=seed
         
@@ -68,10 +87,10 @@ class Kernel:
         self.agents_current_times: Dict[int, any] ={j.id: self.start_time for j in self.agents}
         self.exchange_time: int=self.start_time
         self.agents_action_freq: Dict[int, float]={j.id: j.action_freq for j in self.agents}
-        #Implementation of message queue
-        #An item in the queue takes the form of (time, (senderID, recipientID, Message))
-        self.queue: List[Tuple[int, Tuple[Optional[int], int, Message]]] =[]
-        self.head=0
+        #Implementation of message queue: a binary heap ordered by delivery time, ties broken by message ID (send order)
+        #An item in the queue takes the form of (time, messageID, (senderID, recipientID, Message)) and is released once delivered
+        self.queue: List[Tuple[int, int, Tuple[Optional[int], int, Message]]] =[]
+        self.profiler: Optional[Profiler]=profiler
         
         if parameters:
             for key, value in parameters.items():
@@ -111,16 +130,24 @@ class Kernel:
         """
         
         #While there are still items in the queue or time limit is not up yet and simulation has started, process a message.
-        while (self.head < len(self.queue)) and (self.current_time<=self.stop_time):  
-            item=self.queue[self.head]
+        prof=self.profiler
+        while self.queue and (self.current_time<=self.stop_time):  
+            if prof is not None: t0=prof.clock()
+            item=heapq.heappop(self.queue)
             if self.isbatchmessage(item=item):
+                if prof is not None: t1=prof.clock()
                 self.processbatchmessage(item=item)
             else:
+                if prof is not None: t1=prof.clock()
                 self.processmessage(item=item)
+            if prof is not None:
+                t2=prof.clock()
+                prof.add("dispatch", t1-t0)
+                prof.add("handler."+type(item[2][2]).__name__, t2-t1)
             
             #update new current_time
         
-        if self.head==len(self.queue):
+        if not self.queue:
             logger.debug("---Kernel Message queue empty. Terminating now ---")
         if self.current_time and (self.current_time > self.stop_time):
             logger.debug("---Kernel Stop Time surpassed---")
@@ -145,6 +172,8 @@ class Kernel:
         Returns: object that contains all relevant information from simulation
         """
         logger.debug("---Kernel Terminating---")
+        if self.profiler is not None:
+            logger.info("Kernel profile:\n"+self.profiler.report())
         for entity in self.entity_registry.values():
             entity.kernel_terminate()
         
@@ -168,166 +197,132 @@ class Kernel:
             recipientID: ID of recipient Entity
             message: The '''Message''' class instance to send
             delay: is in microseconds
+        The sender and recipient are only validated in debug mode
         """
-        
-        if senderID in self.entity_registry.keys() and recipientID in self.entity_registry.keys():
-            sender=self.entity_registry[senderID]
-            recipient=self.entity_registry[recipientID]
-            pass
-        elif senderID not in self.entity_registry.keys():
-            if senderID==-1:
-                #Exception for the kernelID
-                pass
-            else:
-                raise KeyError(f"{senderID} is not a valid entity")
-        elif recipientID not in self.entity_registry.keys():
-            raise KeyError(f"{recipientID} is not a valid entity")
-        else:
-            pass
-        
-        #Perform compatibility checks for messages
-        if type(message).__name__=="AgentMsg":
-            #It is a message from a trader agent to the exchange
-            if isinstance(sender, TradingAgent) and isinstance(recipient, Exchange):
-                #Typecheck compatible
-                pass
-            elif not isinstance(sender, TradingAgent):
-                raise AssertionError(f"Expects Sender with Entity ID {senderID} to be a Trading Agent. Received '{type(sender).__name__}' instead")
-            elif not isinstance(recipient, Exchange):
-                raise AssertionError(f"Expects Recipient with Entity ID {senderID} to be an Exchange. Received '{type(recipient).__name__}' instead ")
-            else:
-                pass
-        elif type(message).__name__=="ExchangeMsg": 
-            #It is a message from an exchange to a trader agent
-            if isinstance(sender, Exchange) and isinstance(recipient, TradingAgent):
-                #Typecheck compatible
-                pass
-            elif not isinstance(recipient, TradingAgent):
-                raise AssertionError(f"Expects Recipient with Entity ID {senderID} to be a Trading Agent. Received '{type(recipient).__name__}' instead")
-            elif not isinstance(sender, Exchange):
-                raise AssertionError(f"Expects Sender with Entity ID {senderID} to be an Exchange. Received '{type(sender).__name__}' instead ")
-            else:
-                pass
-        
-        
-        item: Tuple[int, Tuple[int, int, Message]]= (self.current_time+delay, (senderID, recipientID, message))
-        self.queue.append(item)
+        if self.profiler is not None: t0=self.profiler.clock()
+        if self.debug: self.validateroute(senderID, recipientID, message)
+        item: Tuple[int, int, Tuple[int, int, Message]]= (self.current_time+delay, message.message_id, (senderID, recipientID, message))
+        heapq.heappush(self.queue, item)
+        if self.profiler is not None: self.profiler.add("enqueue", self.profiler.clock()-t0)
     
-    def sendbatchmessage(self, senderID: int , recipientIDs: int, message: Message, delay: int=0):
+    def sendbatchmessage(self, senderID: int , recipientIDs: List[int], message: Message, delay: int=0):
+        if self.profiler is not None: t0=self.profiler.clock()
+        if self.debug:
+            for recipientID in recipientIDs:
+                self.validateroute(senderID, recipientID, message)
+        item: Tuple[int, int, Tuple[int, List[int], Message]]=(self.current_time+delay, message.message_id, (senderID, recipientIDs, message))
+        heapq.heappush(self.queue, item)
+        if self.profiler is not None: self.profiler.add("enqueue", self.profiler.clock()-t0)
         
-        if senderID in self.entity_registry.keys():
-            sender=self.entity_registry[senderID]
-        elif senderID==-1:
-            pass
-        else:
+    def processmessage(self, item: Tuple[int, int, Tuple[int, int, Message]]):
+        senderID, recipientID, message=item[2]
+        logger.debug("Processing message with ID %s", message.message_id)
+        handler=self.dispatch.get(type(message))
+        if handler is None:
+            handler=self.resolvehandler(type(message))
+        handler(item[0], senderID, recipientID, message)
+
+    #Message handlers, called with (timesent, senderID, recipientID, message)
+    def _onpartialfill(self, timesent: int, senderID: int, recipientID: int, message: PartialOrderFill):
+        #pass the message back onto the agent
+        self.current_time=timesent
+        agentID=message.order.agent_id
+        if agentID==-1:
+            raise UnexpectedMessageType("Partial Order Fills Messages should not be generated for random non-agent orders")
+        self.agents[agentID].receivemessage(current_time=self.current_time, senderID=senderID, message=message)
+
+    def _onautocancelled(self, timesent: int, senderID: int, recipientID: int, message: OrderAutoCancelledMsg):
+        #pass message onto agent
+        self.current_time=timesent
+        agentID=message.order.agent_id
+        if agentID==-1:
+            raise UnexpectedMessageType("Order Auto Cancelled Messages should not be generated for random non-agent orders")
+        self.agents[agentID].receivemessage(current_time=self.current_time, senderID=senderID, message=message)
+
+    def _onorderexecuted(self, timesent: int, senderID: int, recipientID: int, message: OrderExecutedMsg):
+        #tells an agent that a previously placed limit order has been executed
+        self.current_time=timesent
+        if(message.order.fill_time !=timesent):
+            raise Exception("Time processing era. Order fill time does not match timestamp of notification message")
+        agent: TradingAgent=self.entity_registry[recipientID]
+        self.agents_current_times[recipientID]=timesent
+        agent.receivemessage(message=message)
+
+    def _onwakeagent(self, timesent: int, senderID: int, recipientID: int, message: WakeAgentMsg):
+        #Message sent to agents to tell them to start trading
+        self.current_time=timesent
+        self.agents_current_times[recipientID]=timesent
+        logger.debug("Kernel sending wake up message to agent %s.", recipientID)
+        self.wakeup(agentID=recipientID)
+
+    def _onagentorder(self, timesent: int, senderID: int, recipientID: int, message: AgentMsg):
+        #Process orders from agents and set their wake-ups
+        order: Order=message.order
+        if timesent!=order.time_placed:
+            raise TimeSyncError(f"Message time of message {message.message_id} expected to be the same as order placement time{order.time_placed} but is different")
+        self.current_time=timesent
+        logger.debug("Agent %s sent a %s with order ID %s", senderID, type(message).__name__, order.order_id)
+        self.exchange.processorder(order=order)
+        wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
+        self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
+
+    def _ondonothing(self, timesent: int, senderID: int, recipientID: int, message: DoNothing):
+        self.current_time=timesent
+        logger.debug("Agent %s chose to do nothing at time %s", senderID, self.current_time)
+        wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
+        self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
+
+    def _onunexpected(self, timesent: int, senderID: int, recipientID: int, message: Message):
+        #SHOULD NEVER HAPPEN
+        raise UnexpectedMessageType(f"Unexpected message type {type(message).__name__} received")
+
+    #Dispatch table and debug mode validation
+    def builddispatch(self) -> None:
+        """Fills the dispatch table with every message class defined so far, classes defined later are resolved on first delivery"""
+        pending=[Message]
+        while pending:
+            cls=pending.pop()
+            self.resolvehandler(cls)
+            pending.extend(cls.__subclasses__())
+
+    def resolvehandler(self, cls: type) -> Callable:
+        """Handler of the message class cls, the one of its first class in HANDLERS or _onunexpected, cached in the dispatch table"""
+        name=next((self.HANDLERS[base] for base in cls.__mro__ if base in self.HANDLERS), "_onunexpected")
+        handler=self.dispatch[cls]=getattr(self, name)
+        return handler
+
+    def validateentities(self, senderID: int, recipientID: int) -> None:
+        if senderID not in self.entity_registry and senderID!=-1: #-1 is the kernelID
             raise KeyError(f"{senderID} is not a valid entity")
-            
-        recipients=[]   
+        if recipientID not in self.entity_registry:
+            raise KeyError(f"{recipientID} is not a valid entity")
+
+    def validateroute(self, senderID: int, recipientID: int, message: Message) -> None:
+        """Checks the sender (unless it is the kernel) and recipient of a message against ROUTES, each (message, sender, recipient) types only once"""
+        self.validateentities(senderID, recipientID)
+        sender=self.entity_registry.get(senderID)
+        recipient=self.entity_registry[recipientID]
+        key=(type(message), type(sender), type(recipient))
+        if key in self.validroutes:
+            return
+        route=next((self.ROUTES[base] for base in type(message).__mro__ if base in self.ROUTES), None)
+        if route is not None:
+            senderType, recipientType=route
+            if senderID!=-1 and not isinstance(sender, senderType): #the kernel may send any message
+                raise AssertionError(f"Expects Sender with Entity ID {senderID} to be a {senderType.__name__}. Received '{type(sender).__name__}' instead")
+            if not isinstance(recipient, recipientType):
+                raise AssertionError(f"Expects Recipient with Entity ID {recipientID} to be a {recipientType.__name__}. Received '{type(recipient).__name__}' instead")
+        self.validroutes.add(key)
+
+    def processbatchmessage(self, item: Tuple[int, int, Tuple[int, List[int], Message]]):
+        """Delivers a batch message to each of its recipients in turn, through the same handler as a single message"""
+        senderID, recipientIDs, message=item[2]
+        logger.debug("Processing batch message with ID %s", message.message_id)
+        handler=self.dispatch.get(type(message))
+        if handler is None:
+            handler=self.resolvehandler(type(message))
         for recipientID in recipientIDs:
-            if  recipientID in self.entity_registry.keys():
-                recipients.append(self.entity_registry[recipientID])
-            elif recipientID not in self.entity_registry.keys():
-                raise KeyError(f"{recipientID} is not a valid entity")
-            else:
-                pass
-        item: Tuple[int, Tuple[int, List[int], Message]]=(self.current_time+delay, (senderID, recipientIDs, message))
-        self.queue.append(item)
-        
-    def processmessage(self, item: Tuple[int, Tuple[int, int, Message]]):
-        message=item[1][2]
-        recipientID=item[1][1]
-        senderID=item[1][0]
-        timesent=item[0]
-        logger.debug(f"Processing message with ID {message.message_id}")
-        if isinstance(message, ExchangeMsg):
-            self.current_time=timesent
-            if isinstance(message, PartialOrderFill):
-                #pass the message back onto the agent
-                agentID=message.order.agent_id
-                if agentID==-1:
-                    raise UnexpectedMessageType("Partial Order Fills Messages should not be generated for random non-agent orders")
-                else:
-                    self.agents[agentID].receivemessage(current_time=self.current_time, senderID=senderID, message=message)
-            elif isinstance(message, OrderAutoCancelledMsg):
-                #pass message onto agent
-                if agentID==-1:
-                    raise UnexpectedMessageType("Partial Order Fills Messages should not be generated for random non-agent orders")
-                else:
-                    self.agents[agentID].receivemessage(current_time=self.self.current_time, senderID=senderID, message=message)
-            elif isinstance(message, OrderExecutedMsg):
-                #tells an agent that a previously placed limit order has been executed
-                if(message.order.fill_time !=timesent):
-                    raise Exception("Time processing era. Order fill time does not match timestamp of notification message")
-                agent: TradingAgent=self.entity_registry[recipientID]
-                self.agents_current_times[recipientID]=timesent
-                agent.receivemessage(message=message)
-                
-            elif isinstance(message, WakeAgentMsg):
-                #Message sent to agents to tell them to start trading
-                self.agents_current_times[recipientID]=timesent
-                logger.debug(f"Kernel sending wake up message to agent {recipientID}.")
-                self.wakeup(agentID=recipientID)
-            else:
-                #SHOULD NEVER HAPPEN
-                raise UnexpectedMessageType(f"Unexpected message type received")
-                pass
-                
-        elif isinstance(message, AgentMsg):
-            #Process orders from agents and set their wake-ups
-            if timesent!=order.time_placed:
-                raise TimeSyncError(f"Message time of message {message.message_id} expected to be the same as order placement time{order.time_placed} but is different")
-            self.current_time=timesent
-            if isinstance(message, LimitOrderMsg):
-                order: LimitOrder =message.order
-                logger.debug(f"Agent {senderID} placed a Limit Order with ID {order.order_id}")     
-                self.exchange.processorder(order=order)
-                wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
-                self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
-            elif isinstance(message, MarketOrder):
-                order: MarketOrder=message.order
-                logger.debug(f"Agent {senderID} placed a Market Order with ID {order.order_id}")  
-                self.exchange.processorder(order=order)
-                wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
-                self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
-            elif isinstance(message, CancelOrderMsg):
-                order: CancelOrder=message.order
-                logger.debug(f"Agent {senderID} cancelled previous order with ID {order.cancelID}")  
-                self.exchange.processorder(order=order)
-                wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
-                self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
-            elif isinstance(message, DoNothing):
-                logger.debug(f"Agent {senderID} chose to do nothing at time {self.current_time}")
-                wakeuptime=self.agents_current_times[senderID]+self.agents_action_freq[senderID]
-                self.set_wakeup(agentID=senderID, requested_time=wakeuptime)
-            else: 
-                #SHOULD NEVER HAPPEN
-                raise UnexpectedMessageType(f"Unexpected message type received")
-                pass
-        else:
-            #SHOULD NEVER HAPPEN
-            raise UnexpectedMessageType(f"Unexpected message type received")
-            pass
-        
-    def processbatchmessage(self, item=Tuple[int, Tuple[int, List[int], Message]]):
-        message: Message=item[1][2]
-        recipientIDs: List[int]=item[1][1]
-        senderID: int=item[1][0]
-        timesent: float=item[0]
-        if isinstance(message,ExchangeMsg):
-            if isinstance(OrderExecutedMsg):
-                #to be implemented
-                pass
-            elif isinstance(WakeAgentMsg):
-                #to be implemented
-                pass
-            else:
-                raise UnexpectedMessageType(f"Unexpected batch message type received")
-                pass
-                
-            
-        
-        
-        
+            handler(item[0], senderID, recipientID, message)
     
     def set_wakeup(self, agentID: int, requested_time: float=None) -> None:
         """
@@ -379,8 +374,8 @@ class Kernel:
         else:
             raise KeyError(f"No entity found with ID {senderID}")
 
-    def isbatchmessage(self, item: Tuple[int, Tuple[Optional[int], Any, Message]]):
-        return isinstance(item[1][1], list)
+    def isbatchmessage(self, item: Tuple[int, int, Tuple[Optional[int], Any, Message]]):
+        return isinstance(item[2][1], list)
             
     #Helper functions
     def istruncated(self):
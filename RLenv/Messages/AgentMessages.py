@@ -1,29 +1,36 @@
 from dataclasses import dataclass
 from RLenv.Messages.Message import Message
+from RLenv.Slots import slotted
 from RLenv.Orders import Order, LimitOrder,MarketOrder, CancelOrder
 
+@slotted()
 @dataclass
 class AgentMsg(Message):
     pass
 
 #These are agents issuing an order to an exchange
+@slotted()
 @dataclass
 class LimitOrderMsg(AgentMsg):
     order: LimitOrder
 
+@slotted()
 @dataclass
 class MarketOrderMsg(AgentMsg):
     order: MarketOrder
 
 
+@slotted()
 @dataclass
 class CancelOrderMsg(AgentMsg):
     order: CancelOrder
 
+@slotted()
 @dataclass
 class DoNothing(AgentMsg):
     pass
 
+@slotted()
 @dataclass
 class WakeUpRequestMsg(AgentMsg):
     agentID: int
@@ -1,31 +1,36 @@
 from dataclasses import dataclass
 from RLenv.Messages.Message import Message
+from RLenv.Slots import slotted
 from RLenv.Orders import Order
+@slotted()
 @dataclass
 class ExchangeMsg(Message):
     #Messages that an exchange sends to an agent or the kernel
     pass
 
+@slotted()
 @dataclass
 class PartialOrderFill(ExchangeMsg): #Exchange to agent
     order: Order
     newsize: int
     
+@slotted()
 @dataclass
 class OrderAutoCancelledMsg(ExchangeMsg):#exchange to agent 
     order: Order
 
+@slotted()
 @dataclass
 class OrderExecutedMsg(ExchangeMsg):#exchange to agent
     order: Order
     
 
 class WakeAgentMsg(ExchangeMsg):
-    pass
+    __slots__=()
 class TradeNotificationMsg(WakeAgentMsg):
-    pass
+    __slots__=()
 
 class SpreadNotificationMsg(WakeAgentMsg):
-    pass
+    __slots__=()
 class BeginTradingMsg(WakeAgentMsg):
-    pass
+    __slots__=()
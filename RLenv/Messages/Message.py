@@ -1,8 +1,10 @@
 from dataclasses import dataclass, field
 from typing import ClassVar, List
+from RLenv.Slots import slotted
+@slotted()
 @dataclass
 class Message:
-    """The base message class is responsible for delivering messages between the orderbook, trading agents, and the kernel. The post_init method here implements an autoincrementing counter of messages"""
+    """The base message class is responsible for delivering messages between the orderbook, trading agents, and the kernel. The post_init method here implements an autoincrementing counter of messages. Messages are slotted, subclasses should be decorated with @slotted() as well (or define __slots__=() if they add no field)"""
     __message_counter: ClassVar[int] =1 
     message_id: int=field(init=False)
     def __post_init__(self):
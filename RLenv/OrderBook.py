@@ -0,0 +1,274 @@
+import numpy as np
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from RLenv.Orders import LimitOrder
+from RLenv.Exceptions import *
+
+class OrderNode:
+    """Node of the FIFO queue of a price level, linking an order to its neighbours in the queue"""
+    __slots__=("order", "prev", "next", "level", "publicIndex")
+    def __init__(self, order: LimitOrder, level: "PriceLevel") -> None:
+        self.order: LimitOrder=order
+        self.prev: Optional[OrderNode]=None
+        self.next: Optional[OrderNode]=None
+        self.level: PriceLevel=level
+        self.publicIndex: int=-1 #position in level.publics, -1 for agent orders
+
+class PriceLevel:
+    """
+    FIFO queue of the orders resting at one price, as an intrusive doubly linked list of OrderNode.
+
+    Attributes:
+        price: price of the level
+        volume: total size of the orders in the queue
+        count: #of orders in the queue
+        publics: nodes of the public (agent_id==-1) orders in no particular order, for O(1) uniform sampling
+        cached: snapshot of the queue returned by snapshot() until the queue changes, None once it did
+    """
+    __slots__=("price", "head", "tail", "volume", "count", "publics", "cached")
+    def __init__(self, price: float) -> None:
+        self.price: float=price
+        self.head: Optional[OrderNode]=None
+        self.tail: Optional[OrderNode]=None
+        self.volume: int=0
+        self.count: int=0
+        self.publics: List[OrderNode]=[]
+        self.cached: Optional[Tuple[Tuple[int, int], ...]]=None
+
+    def append(self, node: OrderNode) -> None:
+        node.prev, node.next=self.tail, None
+        if self.tail is None:
+            self.head=node
+        else:
+            self.tail.next=node
+        self.tail=node
+        self.volume+=node.order.size
+        self.count+=1
+        self.cached=None
+        if node.order.agent_id==-1:
+            node.publicIndex=len(self.publics)
+            self.publics.append(node)
+
+    def unlink(self, node: OrderNode) -> None:
+        if node.prev is None:
+            self.head=node.next
+        else:
+            node.prev.next=node.next
+        if node.next is None:
+            self.tail=node.prev
+        else:
+            node.next.prev=node.prev
+        node.prev=node.next=None
+        self.volume-=node.order.size
+        self.count-=1
+        self.cached=None
+        if node.publicIndex>=0: #swap with the last public node
+            last=self.publics.pop()
+            if last is not node:
+                last.publicIndex=node.publicIndex
+                self.publics[node.publicIndex]=last
+            node.publicIndex=-1
+
+    @property
+    def publiccount(self) -> int:
+        return len(self.publics)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[LimitOrder]:
+        node=self.head
+        while node is not None:
+            yield node.order
+            node=node.next
+
+    def orders(self) -> List[LimitOrder]:
+        """The orders of the queue in FIFO order"""
+        return list(self)
+
+    def snapshot(self) -> Tuple[Tuple[int, int], ...]:
+        """Immutable (order ID, size) of the orders of the queue in FIFO order, shared by the snapshots taken while the queue is unchanged"""
+        if self.cached is None:
+            self.cached=tuple((order.order_id, order.size) for order in self)
+        return self.cached
+
+class OrderBook:
+    """
+    Price level indexed limit order book of the Exchange.
+
+    Each side is a deque of PriceLevel from the touch outwards (index 0 is the touch), with a map from the price in
+    ticks (round(price/ticksize), so that prices reached by different float arithmetic find the same level) to the
+    level, and every resting order is indexed by ID, so that inserting, cancelling by ID, filling at the touch, opening
+    a level at the touch and dropping one at either end are O(1). The levels keep their volume and count up to date,
+    so the L2 book costs O(levels).
+
+    Arguments:
+        ticksize: price increment between levels
+    """
+    SIDES=("Ask", "Bid")
+    def __init__(self, ticksize: float=0.01) -> None:
+        self.ticksize: float=ticksize
+        self.levels: Dict[str, Deque[PriceLevel]]={side: deque() for side in self.SIDES}
+        self.prices: Dict[str, Dict[int, PriceLevel]]={side: {} for side in self.SIDES} #keyed by tick
+        self.index: Dict[int, OrderNode]={}
+
+    def __contains__(self, orderID: int) -> bool:
+        return orderID in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def depth(self, side: str) -> int:
+        """#of price levels of the side"""
+        return len(self.levels[side])
+
+    def level(self, side: str, i: int=0) -> PriceLevel:
+        """Level i of the side, counted from the touch"""
+        return self.levels[side][i]
+
+    def tick(self, price: float) -> int:
+        """The price as an integer number of ticks"""
+        return int(round(price/self.ticksize))
+
+    def levelat(self, side: str, price: float) -> Optional[PriceLevel]:
+        return self.prices[side].get(self.tick(price))
+
+    def touch(self, side: str) -> float:
+        return self.levels[side][0].price
+
+    def get(self, orderID: int) -> Optional[LimitOrder]:
+        node=self.index.get(orderID)
+        return None if node is None else node.order
+
+    def add(self, order: LimitOrder) -> None:
+        """Adds the order at the back of the queue of its price, which must be a level of the book"""
+        level=self.prices[order.side].get(self.tick(order.price))
+        if level is None:
+            raise InvalidOrderType(f"Order {order.order_id} has price {order.price} which is not a level of the {order.side} book")
+        self._insert(level, order)
+
+    def cancel(self, orderID: int) -> LimitOrder:
+        """Removes the order from its queue and returns it. The level stays in the book, even if empty"""
+        node=self.index.pop(orderID, None)
+        if node is None:
+            raise KeyError(f"Order {orderID} is not in the book")
+        node.level.unlink(node)
+        return node.order
+
+    def popfront(self, side: str) -> LimitOrder:
+        """Removes and returns the order at the front of the touch queue"""
+        node=self.levels[side][0].head
+        if node is None:
+            raise LOBProcessingError(f"The {side} touch queue is empty")
+        del self.index[node.order.order_id]
+        node.level.unlink(node)
+        return node.order
+
+    def resize(self, orderID: int, size: int) -> None:
+        """Sets the size of a resting order (partial fill), keeping the volume of its level"""
+        node=self.index[orderID]
+        node.level.volume+=size-node.order.size
+        node.level.cached=None
+        node.order.size=size
+
+    def randompublic(self, side: str, price: float, rng) -> Optional[LimitOrder]:
+        """A uniformly chosen public order of the level at price, None if it only holds agent orders. rng has randrange"""
+        publics=self.prices[side][self.tick(price)].publics
+        if len(publics)==0:
+            return None
+        return publics[rng.randrange(0, len(publics))].order
+
+    def pushlevel(self, side: str, price: float, orders: List[LimitOrder], touch: bool=False) -> PriceLevel:
+        """Opens a level at price holding orders, as the new touch or past the deepest level"""
+        tick=self.tick(price)
+        if tick in self.prices[side]:
+            raise LOBProcessingError(f"{side} level at {price} already exists")
+        level=PriceLevel(price)
+        for order in orders:
+            self._insert(level, order)
+        if touch:
+            self.levels[side].appendleft(level)
+        else:
+            self.levels[side].append(level)
+        self.prices[side][tick]=level
+        return level
+
+    def poplevel(self, side: str, touch: bool=True) -> PriceLevel:
+        """Removes the touch (or deepest) level of the side and its orders from the book, and returns it"""
+        level=self.levels[side].popleft() if touch else self.levels[side].pop()
+        del self.prices[side][self.tick(level.price)]
+        node=level.head
+        while node is not None:
+            del self.index[node.order.order_id]
+            node=node.next
+        return level
+
+    def _insert(self, level: PriceLevel, order: LimitOrder) -> None:
+        if order.order_id in self.index:
+            raise InvalidOrderType(f"Order {order.order_id} is already in the book")
+        node=OrderNode(order, level)
+        level.append(node)
+        self.index[order.order_id]=node
+
+class LOBHistory:
+    """
+    Append-only history of the book of an Exchange: one row per update with the time, the price and volume of each
+    level (from the deepest ask to the deepest bid, as in Exchange.lob0) and the spread, in typed arrays grown by
+    doubling, so that recording an update costs O(levels).
+
+    Every l3Every rows an L3 snapshot is kept as well: the (order ID, size) tuples of each level, taken from
+    PriceLevel.snapshot, so that the levels unchanged between two snapshots share their tuples and no snapshot refers
+    to the live queues.
+
+    Arguments:
+        LOBlevels: #of levels per side
+        l3Every: #of rows between two L3 snapshots, 0 to keep none
+        capacity: initial #of rows
+    """
+    __slots__=("levels", "t", "price", "volume", "spread", "n", "l3Every", "l3")
+    def __init__(self, LOBlevels: int=2, l3Every: int=0, capacity: int=1024) -> None:
+        self.levels: List[str]=[f"Ask_L{i}" for i in range(LOBlevels, 0, -1)]+[f"Bid_L{i}" for i in range(1, LOBlevels+1)]
+        self.t=np.zeros(capacity)
+        self.price=np.zeros((capacity, len(self.levels)))
+        self.volume=np.zeros((capacity, len(self.levels)), dtype=np.int64)
+        self.spread=np.zeros(capacity)
+        self.n: int=0
+        self.l3Every: int=l3Every
+        self.l3: List[Tuple[int, Tuple[Tuple[Tuple[int, int], ...], ...]]]=[] #(row, snapshot of each level)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def append(self, t: float, book: OrderBook, spread: float) -> None:
+        i=self.n
+        if i==len(self.t):
+            self._grow()
+        levels=list(reversed(book.levels["Ask"]))+list(book.levels["Bid"])
+        self.t[i]=t
+        self.price[i]=[level.price for level in levels]
+        self.volume[i]=[level.volume for level in levels]
+        self.spread[i]=spread
+        if self.l3Every>0 and i%self.l3Every==0:
+            self.l3.append((i, tuple(level.snapshot() for level in levels)))
+        self.n+=1
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Copies of the recorded rows"""
+        return {"t": self.t[:self.n].copy(), "price": self.price[:self.n].copy(), "volume": self.volume[:self.n].copy(), "spread": self.spread[:self.n].copy()}
+
+    def lob0(self, i: int) -> Dict[str, Tuple[float, int]]:
+        """Row i as an Exchange.lob0 dictionary"""
+        return {level: (self.price[i, l], int(self.volume[i, l])) for l, level in enumerate(self.levels)}
+
+    def lobl3(self, k: int) -> Tuple[int, Dict[str, Tuple[float, Tuple[Tuple[int, int], ...]]]]:
+        """L3 snapshot k as (row, dictionary of (price, (order ID, size) tuples) keyed by level)"""
+        i, queues=self.l3[k]
+        return i, {level: (self.price[i, l], queues[l]) for l, level in enumerate(self.levels)}
+
+    def _grow(self) -> None:
+        capacity=2*len(self.t)
+        for name in ["t", "price", "volume", "spread"]:
+            old=getattr(self, name)
+            new=np.zeros((capacity,)+old.shape[1:], dtype=old.dtype)
+            new[:len(old)]=old
+            setattr(self, name, new)
@@ -1,7 +1,15 @@
+import weakref
 from dataclasses import dataclass, field
-from typing import ClassVar, Optional, Dict
+from typing import ClassVar, Optional
+from RLenv.Slots import slotted
+@slotted(weakref=True)
 @dataclass
 class Order:
+    """
+    Base order class. Orders are slotted, and the registry of orders by ID only holds weak references: an order leaves
+    it once nothing else (the book, a pending message or its agent) refers to it, so that the registry is bounded by the
+    live orders rather than by every order ever placed.
+    """
     time_placed: int
     order_id: int=field(init=False)
     side: str
@@ -13,26 +21,29 @@ class Order:
     fill_time: Optional[int] = None
     _level: str=None #private method for internal use
     _order_id_counter: ClassVar[int]=1
-    _orders: ClassVar[Dict[int, "Order"]]={}
+    _orders: ClassVar["weakref.WeakValueDictionary[int, Order]"]=weakref.WeakValueDictionary()
     def __post_init__(self):
         self.order_id: int=Order._order_id_counter
         Order._order_id_counter+=1
         Order._orders[self.order_id]=self
     def ordertype(self) -> str:
-        return self.__class.__name__
+        return self.__class__.__name__
     
     @classmethod
     def _get_order_by_id(cls, id: int) -> Optional['Order']:
         return cls._orders.get(id)
     
+@slotted()
 @dataclass
 class LimitOrder(Order):
     price: float=0
         
+@slotted()
 @dataclass
 class MarketOrder(Order):
     total_value: Optional[float] = None #The total price for market orders
     pass
+@slotted()
 @dataclass
 class CancelOrder(Order):
     cancelID: int=0
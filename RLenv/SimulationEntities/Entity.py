@@ -25,8 +25,9 @@ class Entity:
     _entity_counter: ClassVar[int]=1
     _registry={}
     def __init__(self, type: str = None, seed=1, log_events: bool = True, log_to_file: bool = False) -> None:
-        self.id=self.__class__._entity_counter
-        type(self)._entity_counter+=1
+        #IDs are unique over every entity (agents and exchanges share the kernel registry)
+        self.id=Entity._entity_counter
+        Entity._entity_counter+=1
         self.type=type
         self.name="Entity"+str(self.id)+"_"+str(self.type)
         self.log_events=log_events
@@ -68,7 +69,7 @@ class Entity:
         """
         assert self.kernel is not None
         if logger.isEnabledFor(logging.DEBUG):
-            logger.debug("At {}, entity {} sent: {} to entities {}".format(self.current_time, self.id, message))
+            logger.debug("At {}, entity {} sent: {} to entities {}".format(self.current_time, self.id, message, recipientIDs))
         self.kernel.sendbatchmessage(self.id, recipientIDs, message)
             
         
@@ -4,28 +4,30 @@ import pandas as pd
 import time
 import numpy as np
 import os 
-import random
 import logging
-from typing import Any, List, Optional, Tuple, ClassVar
+from typing import Any, Dict, List, Optional, Tuple, ClassVar
 from RLenv.SimulationEntities.Entity import Entity
 from RLenv.Exceptions import *
 from RLenv.SimulationEntities.TradingAgent import TradingAgent
 from RLenv.Stochastic_Processes.Arrival_Models import ArrivalModel, HawkesArrival
 from RLenv.Orders import *
+from RLenv.OrderBook import OrderBook, LOBHistory
 from RLenv.Messages.ExchangeMessages import *
+from simulation.RNGService import RNGService
 
 logger=logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 class Exchange(Entity):
-    def __init__(self, symbol: str ="AAPL", ticksize: float =0.01, LOBlevels: int=2, numOrdersPerLevel: int =10, Arrival_model: ArrivalModel=None, agents: List[TradingAgent]=None):
+    def __init__(self, symbol: str ="AAPL", ticksize: float =0.01, LOBlevels: int=2, numOrdersPerLevel: int =10, Arrival_model: ArrivalModel=None, agents: List[TradingAgent]=None, rng=None, l3Every: int=0):
         super().__init__(type="Exchange", seed=1, log_events=True, log_to_file=False)
+        self.rng=RNGService(self.seed) if rng is None else rng #picks the public orders hit by random cancels
         self.ticksize=ticksize
         self.LOBlevels=LOBlevels
         if Arrival_model is None:
             raise ValueError("Please specify Arrival_model for Exchange")
         else:
-            logger.debug(f"Arrival_model of Exchange specified as {self.Arrival_model.__class__.__name__}")
             self.Arrival_model=Arrival_model
+            logger.debug(f"Arrival_model of Exchange specified as {self.Arrival_model.__class__.__name__}")
         if not agents:
             raise ValueError("Please provide a list of Trading Agents")
         else:
@@ -38,7 +40,7 @@ class Exchange(Entity):
         self.symbol=symbol
         
         self.levels = [f"Ask_L{i}" for i in range(1, self.LOBlevels + 1)]+[f"Bid_L{i}" for i in range(1, self.LOBlevels + 1)]
-        self.LOBhistory=[] #History of an order book is an array of the form (t, LOB, spread)
+        self.LOBhistory=LOBHistory(LOBlevels=LOBlevels, l3Every=l3Every) #(t, prices, volumes, spread) per update, with an L3 snapshot every l3Every updates
         self.numOrdersPerLevel=numOrdersPerLevel
     
     def initialize_exchange(self, priceMid0: int=20, spread0: int =4): 
@@ -50,46 +52,47 @@ class Exchange(Entity):
         #Initialize prices
         self.priceMid=priceMid0
         self.spread=spread0
-
-        self.askprices={}
-        self.bidprices={}
+        self.book=OrderBook(ticksize=self.ticksize)
         for i in range(self.LOBlevels):
-            key="Ask_L"+str(i+1)
-            val=self.priceMid+np.floor(self.spread/2)*self.ticksize + i*self.ticksize
-            self.askprices[key]=val
-            key="Bid_L"+str(i+1)
-            val=self.priceMid-np.floor(self.spread/2)*self.ticksize - i*self.ticksize
-            self.bidprices[key]=val   
-        self.askprice=self.askprices["Ask_L1"]
-        self.bidprice=self.bidprices["Bid_L1"]
-        self.bids={} #holding list of pricelevels which are in the form of (key, value)=(price, [list of orders])
-        self.asks={} 
+            self.book.pushlevel("Ask", self.priceMid+np.floor(self.spread/2)*self.ticksize + i*self.ticksize, [])
+            self.book.pushlevel("Bid", self.priceMid-np.floor(self.spread/2)*self.ticksize - i*self.ticksize, [])
         #Initialize order sizes
         for k in self.levels:
-            queue=self.Arrival_model.generate_orders_in_queue(loblevel=k, numorders=self.numOrdersPerLevel)
-            if "Ask" in k:
-                self.asks[self.askprices[k]]=queue
-            elif "Bid" in k:
-                self.asks[self.bidprices[k]]=queue
-            else:
-                raise AssertionError(f"Level is not an ASK or BID string")
+            for order in self.generate_orders_in_queue(loblevel=k):
+                self.book.add(order)
         logger.debug("Stock Exchange initalized at time")
         #Send a message to agents to begin trading
-        message=BeginTradingMsg(time=self.current_time)
-        self.sendbatchmessage(recipientIDs=self.agentIDs, message=message, current_time=self.current_time)
+        message=BeginTradingMsg()
+        self.sendbatchmessage(recipientIDs=self.agentIDs, message=message)
+
+    #Prices of the levels, read from the book
+    @property
+    def askprices(self) -> Dict[str, float]:
+        return {f"Ask_L{i+1}": level.price for i, level in enumerate(self.book.levels["Ask"])}
+
+    @property
+    def bidprices(self) -> Dict[str, float]:
+        return {f"Bid_L{i+1}": level.price for i, level in enumerate(self.book.levels["Bid"])}
+
+    @property
+    def askprice(self) -> float:
+        return self.book.touch("Ask")
+
+    @property
+    def bidprice(self) -> float:
+        return self.book.touch("Bid")
         
-    def generate_orders_in_queue(self, loblevel) -> List[LimitOrder]:
+    def generate_orders_in_queue(self, loblevel, price: Optional[float]=None) -> List[LimitOrder]:
+        """Public limit orders of a new queue at loblevel, at price or the current price of loblevel"""
         assert self.Arrival_model is not None, "Arrival_model is not provided"
         queue=self.Arrival_model.generate_orders_in_queue(loblevel=loblevel, numorders=self.numOrdersPerLevel)
         side=loblevel[0:3]
-        price=0
-        if side=="Ask":
-            price=self.askprices[loblevel]
-        else:
-            price=self.bidprices[loblevel]
+        if price is None:
+            price=self.book.level(side, int(loblevel[5:])-1).price
         orderqueue=[]
         for size in queue:
-            order=LimitOrder(time_placed=self.current_time, side=side, size=size, symbol=self.symbol, agent_id=-1)
+            order=LimitOrder(time_placed=self.current_time, side=side, size=int(size), symbol=self.symbol, agent_id=-1, price=price)
+            order._level=loblevel
             orderqueue.append(order)
         return orderqueue
            
@@ -137,7 +140,7 @@ class Exchange(Entity):
                 price=self.askprices[level]
             else:
                 price=self.bidprices[level]
-            order=CancelOrder(time_placed=time, side=side, size=-1, symbol=self.symbol, agent_id=-1, loblevel=level)
+            order=CancelOrder(time_placed=time, side=side, size=-1, symbol=self.symbol, agent_id=-1)
         order._level=level
         self.processorder(order=order)
         
@@ -176,7 +179,7 @@ class Exchange(Entity):
         if order.agent_id==-1:
             pass
         else:
-            self.update_model_state(order)
+            self.update_model_state(order, order_type)
         
         #update spread and notify agents if a trade has happened:
         newspread=abs(self.askprice-self.bidprice)
@@ -199,293 +202,167 @@ class Exchange(Entity):
                 message=TradeNotificationMsg()
                 self.sendbatchmessage(recipientIDs=self.agentIDs, message=message)
         #log event:
-        self._logevent(event=[order.current_time, order.ordertype(), order.agent_id, order.order_id])
+        self._logevent(event=[order.time_placed, order.ordertype(), order.agent_id, order.order_id])
         self.updatehistory()
     
     
     def processLimitOrder(self, order: LimitOrder):
         #Limit_order
         side=order.side
-        price=order.price
+        if self.book.levelat(side, order.price) is not None:
+            self.book.add(order)
+            return
+        #Inspread: the order opens a new touch one tick inside the spread and the deepest level leaves the book
         if side=="Ask":
-            queue=self.asks.get(key=price)
+            inspread=self.askprice-self.ticksize
         else:
-            queue=self.bids.get(key=price)
-        if queue is not None:
-            queue.append(order)
-        else: #Inspread
-            #Need to implement auto order cancellation
-            lastlvl=side+"_L"+str(self.LOBlevels)
-            if side=="Ask":
-                if order.price==self.askprice-self.ticksize:
-                    pass
-                else:
-                    raise InvalidOrderType(f"Order {order.order_id} is an invalid inspread limit order")
-                
-                todelete=self.asks[self.askprices[lastlvl]]
-            else:
-                if order.price==self.bidprice+self.ticksize:
-                    pass
-                else:
-                    raise InvalidOrderType(f"Order {order.order_id} is an invalid inspread limit order")
-                todelete=self.bids[self.bidprices[lastlvl]]
-            agentorders=[order for order in todelete if order.agent_id!=-1]
-            logger.info(f"Autocancelling agent orders{[j.order_id for j in agentorders]} due to LOB inspread shift")
+            inspread=self.bidprice+self.ticksize
+        if self.book.tick(order.price)!=self.book.tick(inspread):
+            raise InvalidOrderType(f"Order {order.order_id} is an invalid inspread limit order")
+        agentorders=[j.order_id for j in self.book.level(side, -1) if j.agent_id!=-1]
+        if agentorders:
+            logger.info(f"Autocancelling agent orders{agentorders} due to LOB inspread shift")
             self.autocancel(agentorders)
-            if side=="Ask":
-                del self.asks[self.askprices[lastlvl]]
-                self.askprice=order.price
-                new_askprices = {}
-                new_asks = {}  
-                new_askprices["Ask_L1"]=self.askprice
-                new_asks[self.askprice]=order
-                for i in range(2, self.LOBlevels + 1):
-                    new_key= f"Ask_L{i}"
-                    old_key=f"Ask_L{i-1}"
-                    new_askprices[new_key]=self.askprices[old_key]
-                    new_asks[new_askprices[new_key]]=self.asks[new_askprices[new_key]]
-                self.askprices = new_askprices
-                self.asks = new_asks  
-            else:
-                del self.bids[self.bidprices[lastlvl]]
-                self.bidprice=order.price
-                new_bidprices = {}
-                new_bids = {}  
-                new_bidprices["Ask_L1"]=self.bidprice
-                new_bids[self.askprice]=order
-                for i in range(2, self.LOBlevels + 1):
-                    new_key= f"Ask_L{i}"
-                    old_key=f"Ask_L{i-1}"
-                    new_bidprices[new_key]=self.bidprices[old_key]
-                    new_bids[new_bidprices[new_key]]=self.bids[new_bidprices[new_key]]
-                self.bidprices = new_bidprices           
+        self.book.poplevel(side, touch=False)
+        self.book.pushlevel(side, order.price, [order], touch=True)
+
     def processMarketOrder(self, order: MarketOrder)-> int:
+        """Fills the market order against the queues of its side from the touch in FIFO order and returns its total value"""
         side=order.side
         remainingsize=order.size
         totalvalue=0
-        if side=="Ask":
-            level=1
-            while remainingsize>0:
-                pricelvl=self.bidprices[side+"_L"+str(level)]
-                while len(self.bids)>0:
-                    item: LimitOrder=self.bids[pricelvl][0]
-                    if remainingsize<item.size:
-                        totalvalue+=pricelvl*remainingsize
-                        newsize=item.size=remainingsize
-                        remainingsize=0
-                        order.fill_time=self.current_time
-                        order.filled=True
-                        if item.agent_id==-1:
-                            pass
-                        else:
-                            notif=PartialOrderFill(order=item, newsize=newsize)
-                            self.sendmessage(recipientID=item.agent_id, message=notif)
-                        return totalvalue
-                    else:
-                        filled_order: Order=self.bids[pricelvl].pop(0)
-                        remainingsize-=filled_order.size
-                        totalvalue+=filled_order.size*pricelvl
-                        filled_order.fill_time=self.current_time
-                        filled_order.filled=True
-                        notif=OrderExecutedMsg(order=filled_order)
-                        self.sendmessage(recipientID=filled_order.agent_id, message=notif)
-                #Touch level has been depleted
-                del self.bids[self.bidprices[pricelvl]]
-                new_bidprices = {}
-                new_bids = {}  
-                for i in range(1, self.LOBlevels):
-                    new_key= f"Bid_L{i}"
-                    old_key=f"Bid_L{i+1}"
-                    new_bidprices[new_key]=self.bidprices[old_key]
-                    new_bids[new_bidprices[new_key]]=self.bids[new_bidprices[new_key]]
-                new_bidprices[f"Bid_L{self.LOBlevels}"]=new_bidprices[f"Bid_L{self.LOBlevels-1}"] - self.ticksize
-                new_bids[new_bidprices[f"Bid_L{self.LOBlevels}"]]=self.generate_orders_in_queue(loblevel=f"Bid_L{self.LOBlevels}")
-                self.bidprices = new_bidprices
-                self.bids = new_bids  
-                self.bidprice=self.bidprices["Bid_L1"]
-        else:
-            level=1
-            while remainingsize>0:
-                pricelvl=self.askprices[side+"_L"+str(level)]
-                while len(self.asks)>0:
-                    item: LimitOrder=self.asks[pricelvl][0]
-                    if remainingsize<item.size:
-                        newsize=item.size-remainingsize
-                        totalvalue+=pricelvl*remainingsize
-                        remainingsize=0
-                        order.fill_time=self.current_time
-                        order.filled=True
-                        if item.agent_id==-1:
-                            pass
-                        else:
-                            notif=PartialOrderFill(order=item, newsize=newsize)
-                            self.sendmessage(recipientID=item.agent_id, message=notif)
-                        if order.agent_id==-1:
-                            pass
-                        else:
-                            notif=OrderExecutedMsg(order=order)
-                            self.sendmessage(recipientID=order.agent_id, message=notif)
-                    else:
-                        filled_order: Order=self.asks[pricelvl].pop(0)
-                        remainingsize-=filled_order.size
-                        totalvalue+=filled_order.size*pricelvl
-                        filled_order.fill_time=self.current_time
-                        filled_order.filled=True
-                        notif=OrderExecutedMsg(order=filled_order)
-                        self.sendmessage(recipientID=filled_order.agent_id, message=notif)
-                #Touch level has been depleted
-                del self.asks[self.askprices[pricelvl]]
-                new_askprices = {}
-                new_asks = {}  
-                for i in range(1, self.LOBlevels):
-                    new_key= f"Ask_L{i}"
-                    old_key=f"Ask_L{i+1}"
-                    new_askprices[new_key]=self.askprices[old_key]
-                    new_asks[new_askprices[new_key]]=self.asks[new_askprices[new_key]]
-                new_askprices[f"Ask_L{self.LOBlevels}"]=new_askprices[f"Ask_L{self.LOBlevels-1}"] + self.ticksize
-                new_asks[new_askprices[f"Ask_L{self.LOBlevels}"]]=self.generate_orders_in_queue(loblevel=f"Ask_L{self.LOBlevels}")
-                self.askprices = new_askprices
-                self.asks = new_asks  
-                self.askprice=self.askprices["Ask_L1"]
+        while remainingsize>0:
+            touch=self.book.level(side, 0)
+            item: LimitOrder=touch.head.order
+            if remainingsize<item.size:
+                newsize=item.size-remainingsize
+                totalvalue+=touch.price*remainingsize
+                remainingsize=0
+                self.book.resize(item.order_id, newsize)
+                if item.agent_id!=-1:
+                    notif=PartialOrderFill(order=item, newsize=newsize)
+                    self.sendmessage(recipientID=item.agent_id, message=notif)
+            else:
+                filled_order: LimitOrder=self.book.popfront(side)
+                remainingsize-=filled_order.size
+                totalvalue+=filled_order.size*touch.price
+                filled_order.fill_time=self.current_time
+                filled_order.filled=True
+                if filled_order.agent_id!=-1:
+                    notif=OrderExecutedMsg(order=filled_order)
+                    self.sendmessage(recipientID=filled_order.agent_id, message=notif)
+                if len(touch)==0:
+                    #Touch level has been depleted
+                    self.shiftdepleted(side)
+        order.fill_time=self.current_time
+        order.filled=True
         return totalvalue
+
     def processCancelOrder(self, order: CancelOrder):
-        cancelID=order.cancelID
-        tocancel: Order=Order._get_order_by_id(cancelID)
-        side=tocancel.side
-        price=tocancel.price 
-        public_cancel_flag=0   
-        tocancel.cancelled=True
-        if tocancel.agent_id==-1:
-            public_cancel_flag=True
-        else:
-            public_cancel_flag=False
-            #test if it's a valid agent_id
-            if tocancel.agent_id in self.agentIDs:
-                pass
+        """
+        Cancels an order: a public cancel order (agent_id==-1) cancels a uniformly chosen public order of its level, an agent
+        cancel order cancels the order cancelID of the same agent
+        """
+        if order.agent_id==-1:
+            price=self.askprices[order._level] if order.side=="Ask" else self.bidprices[order._level]
+            cancelled=self.book.randompublic(order.side, price, self.rng)
+            if cancelled is None:
+                logger.info(f"Random cancel order issued, but only existing orders in queue are private agent orders so cancel order at time {order.time_placed} ignored.")
             else:
-                raise AgentNotFoundError(f"Agent ID {order.agent_ID} is not listed in Exchange book")
+                self.book.cancel(cancelled.order_id)
+                cancelled.cancelled=True
+        else: #Cancel order from an agent
+            cancelID=order.cancelID
+            tocancel: Optional[LimitOrder]=self.book.get(cancelID)
+            if tocancel is None:
+                raise InvalidOrderType(f"Agent {order.agent_id} attempted to cancel order {cancelID} which is not in the book")
+            #test if it's a valid agent_id
+            if tocancel.agent_id not in self.agentIDs:
+                raise AgentNotFoundError(f"Agent ID {tocancel.agent_id} is not listed in Exchange book")
             #Check that the cancel order came from the same agent who placed the order
-            if tocancel.agent_id==order.agent_id:
-                pass
-            else:
+            if tocancel.agent_id!=order.agent_id:
                 raise InvalidOrderType(f"Agent {order.agent_id} wants to cancel order {order.cancelID} but order was placed by {tocancel.agent_id}")
-        queue=[]        
-        if side=="Ask":
-            queue=self.asks[price]
-        else:
-            queue=self.bids[price]
-        validcancels=[]
-        if public_cancel_flag==True:
-            validcancels=[item for item in queue if item.agent_id==-1]
-            if len(validcancels)==0:
-                logger.info(f"Random cancel order issued, but only existing orders in queue are private agent orders so cancel order at time {order.time_placed} ignored.")  
-            else:
-                cancelled=validcancels.pop(random.randrange(0, len(validcancels)))
-                queue=[item for item in queue if item.order_id != cancelled.order_id]
-        else: #Cancel order from an agent
-            queue=[item for item in queue if item.order_id!=cancelID]
-            assert len(queue)>0, f"Agent {order.agent_id} attemptd to place cancel orders wihout pre-existing limit orders in the book at the same price"
-        #non-empty queue for order cancellation, public and private           
-        if order.side=="Ask":
-            self.asks[price]=queue
-        else:
-            self.bids[price]=queue
-        tocancel.cancelled=True
-        if public_cancel_flag==False:
+            self.book.cancel(cancelID)
+            tocancel.cancelled=True
             notif=OrderExecutedMsg(order=order)
             self.sendmessage(recipientID=order.agent_id, message=notif)
         self.regeneratequeuedepletion()   
         
     def autocancel(self, orderIDs: List[int]):
         for orderID in orderIDs:
-            order=Order._get_order_by_id(orderID)
-            if isinstance(order, LimitOrder):
-                pass
-            else:
-                raise InvalidOrderType(f"Expected Limit Order for autocancelling, received {order.ordertype()}")
-            price=order.price
-            side=order.side
+            order=self.book.get(orderID)
+            if not isinstance(order, LimitOrder):
+                raise InvalidOrderType(f"Expected a resting Limit Order for autocancelling, received {type(order).__name__}")
+            self.book.cancel(orderID)
             order.cancelled=True
-            if side=="Ask":
-                oldqueue=order.asks[price]
-            else:
-                oldqueue=order.bids[price]
-            queue=[j for j in oldqueue if j.order_id!=orderID]
-            oldqueue=queue
             notif=OrderAutoCancelledMsg(order=order)
             self.sendmessage(recipientID=order.agent_id, message=notif)
-    def regeneratequeuedepletion(self): #to be implemented
+
+    def shiftdepleted(self, side: str) -> None:
+        """Removes the depleted touch of a side: the next level becomes the touch and a new level is generated one tick past the deepest"""
+        depleted=self.book.poplevel(side, touch=True)
+        deepest=self.book.level(side, -1).price if self.book.depth(side)>0 else depleted.price
+        price=deepest+self.ticksize if side=="Ask" else deepest-self.ticksize
+        self.book.pushlevel(side, price, self.generate_orders_in_queue(loblevel=f"{side}_L{self.LOBlevels}", price=price), touch=False)
+
+    def regeneratequeuedepletion(self):
         """
-        Regenerates LOB from queue depletion and updates prices as necessary
+        Regenerates LOB from queue depletion and updates prices as necessary: a depleted touch is shifted out and depleted deeper queues are refilled in place
         """
-        if len(self.asks[self.askprices["Ask_L1"]])==0:
-            del self.asks[self.askprices["Ask_L1"]]
-            self.askprices["Ask_L1"]=self.askprices["Ask_L2"]
-            self.askprices["Ask_L2"]=self.askprices["Ask_L1"]+self.ticksize
-            self.asks[self.askprices["Ask_L2"]]=self.generate_orders_in_queue(loblevel="Ask_L2")
-            
-            
-        elif len(self.bids[self.bidprices["Bid_L1"]])==0:
-            del self.bids[self.bidprices["Bid_L1"]]
-            self.bidprices["Ask_L1"]=self.bidprices["Bid_L2"]
-            self.bidprices["Bid_L2"]=self.bidprices["Bid_L1"]-self.ticksize
-            self.bids[self.bidprices["Bid_L2"]]=self.generate_orders_in_queue(loblevel="Bid_L2")
-        
-        elif len(self.asks[self.askprices["Ask_L2"]])==0:
-            del self.asks[self.askprices["Ask_L2"]]
-            self.askprices["Ask_L2"]=self.askprices["Ask_L1"]+self.ticksize
-            self.asks[self.askprices["Ask_L2"]]=self.generate_orders_in_queue(loblevel="Ask_L2")
-        
-        elif len(self.bids[self.bidprices["Bid_L2"]])==0:
-            del self.bids[self.bidprices["Bid_L2"]]
-            self.bidprices["Bid_L2"]=self.bidprices["Bid_L1"]-self.ticksize
-            self.bids[self.bidprices["Bid_L2"]]=self.generate_orders_in_queue(loblevel="Bid_L2")
-        else:
-            #queue is not depleted
-            pass
+        for side in OrderBook.SIDES:
+            if len(self.book.level(side, 0))==0:
+                self.shiftdepleted(side)
+            for i in range(1, self.book.depth(side)):
+                level=self.book.level(side, i)
+                if len(level)==0:
+                    for order in self.generate_orders_in_queue(loblevel=f"{side}_L{i+1}", price=level.price):
+                        self.book.add(order)
     
     def checkLOBValidity(self) -> bool:
-        condition1= self.askprice==self.askprices["Ask_L1"]
-        condition2=self.askprice==min(self.asks.keys())       
-        condition3=self.bidprice==self.bidprices["Bid_L1"]
-        condition4=self.bidprice==min(self.bids.keys())
+        askprices=[level.price for level in self.book.levels["Ask"]]
+        bidprices=[level.price for level in self.book.levels["Bid"]]
+        condition1=len(askprices)==self.LOBlevels and len(bidprices)==self.LOBlevels
+        condition2=all(a<b for a, b in zip(askprices, askprices[1:]))
+        condition3=all(a>b for a, b in zip(bidprices, bidprices[1:]))
+        condition4=askprices[0]>bidprices[0]
         return condition1 and condition2 and condition3 and condition4
         
         
     #information getters and setters
     def lob0(self)-> dict: 
-        rtn={
-            "Ask_L2": (self.askprices["Ask_L2"], sum(self.asks[self.askprices["Ask_L2"]])),
-            "Ask_L1": (self.askprices["Ask_L1"], sum(self.asks[self.askprices["Ask_L1"]])),
-            "Bid_L1": (self.bidprices["Bid_L1"], sum(self.bids[self.bidprices["Bid_L1"]])),
-            "Bid_L2": (self.bidprices["Bid_L1"], sum(self.bids[self.bidprices["Bid_L1"]]))
-        }
+        """L2 book: (price, volume) of each level, from the deepest ask to the deepest bid"""
+        rtn={}
+        for i in reversed(range(self.LOBlevels)):
+            level=self.book.level("Ask", i)
+            rtn[f"Ask_L{i+1}"]=(level.price, level.volume)
+        for i in range(self.LOBlevels):
+            level=self.book.level("Bid", i)
+            rtn[f"Bid_L{i+1}"]=(level.price, level.volume)
         return rtn
 
     def lobl3(self):
-        rtn={
-            "Ask_L2": (self.askprices["Ask_L2"], self.asks[self.askprices["Ask_L2"]]),
-            "Ask_L1": (self.askprices["Ask_L1"], self.asks[self.askprices["Ask_L1"]]),
-            "Bid_L1": (self.bidprices["Bid_L1"], self.bids[self.bidprices["Bid_L1"]]),
-            "Bid_L2": (self.bidprices["Bid_L1"], self.bids[self.bidprices["Bid_L1"]])
-        }
+        """L3 book: (price, list of orders) of each level, from the deepest ask to the deepest bid"""
+        rtn={}
+        for i in reversed(range(self.LOBlevels)):
+            level=self.book.level("Ask", i)
+            rtn[f"Ask_L{i+1}"]=(level.price, level.orders())
+        for i in range(self.LOBlevels):
+            level=self.book.level("Bid", i)
+            rtn[f"Bid_L{i+1}"]=(level.price, level.orders())
         return rtn
 
     def getlob(self):
-        return [[self.askprices["Ask_L2"], self.asks[self.askprices["Ask_L2"]]], [self.askprices["Ask_L1"], self.asks[self.askprices["Ask_L1"]]], [self.bidprices["Bid_L1"], self.bids[self.bidprices["Bid_L1"]]], [self.bidprices["Bid_L2"], self.bids[self.bidprices["Bid_L2"]]], self.spread]
+        return [[price, orders] for price, orders in self.lobl3().values()]+[self.spread]
         
     def updatehistory(self):
-        #data=[order book, spread]
-        data=(self.current_time, self.getlob(), self.spread)
-        self.LOBhistory.append(data)
+        self.LOBhistory.append(self.current_time, self.book, self.spread)
 
-    def update_model_state(self, order: Order):
+    def update_model_state(self, order: Order, order_type: str):
         """
-        Adds a point to the arrival model, updates the spread
+        Adds a point to the arrival model, order_type being one of lo, mo and co
         """
         time=order.time_placed
         side=order.side
-        order_type=order_type
         level=order._level
         size=order.size
         self.Arrival_model.update(time=time, side=side, order_type=order_type, level=level, size=size)
@@ -104,20 +104,24 @@ class TradingAgent(Entity):
             side="Bid"
         if self.actions[k][0:2]=="lo":
             if k==5: #inspread ask
-                price=lob["Ask_L1"][0]+self.exchange.ticksize
+                price=lob["Ask_L1"][0]-self.exchange.ticksize
+                level="Ask_inspread"
             elif k==6: #inspread bid
                 price=lob["Bid_L1"][0]+self.exchange.ticksize
+                level="Bid_inspread"
             else:    
                 level=self.actionsToLevels[self.actions[k]]
                 if side=="Ask":
                     price=lob[level][0]
                 else:
                     price=lob[level][0]
-            order=LimitOrder(time_placed=self.current_time, event_type=k, side=side, size=size, symbol=self.exchange.symbol, agent_id=self.id, event_type=k, price=price, loblevel=level)
+            order=LimitOrder(time_placed=self.current_time, side=side, size=size, symbol=self.exchange.symbol, agent_id=self.id, price=price)
+            order._level=level
             
         elif self.actions[k][0:2]=="mo":
             #marketorder
-            order=MarketOrder(time_placed=self.current_time, side=side,  event_type=k, size=size, symbol=symbol, agent_id=self.id, event_type=k, )
+            order=MarketOrder(time_placed=self.current_time, side=side, size=size, symbol=self.exchange.symbol, agent_id=self.id)
+            order._level=side+"_MO"
         else:
             #cancelorder
             assert cancelID is not None, f"CancelID not provided to agent {self.id}"
@@ -126,7 +130,8 @@ class TradingAgent(Entity):
                 price=lob[level][0]
             else:
                 price=lob[level][0]
-            order=CancelOrder(time_placed=self.current_time,  event_type=k, side=side, size=-1, symbol=self.exchange.symbol, agent_id=self.id,  event_type=k, cancelID=cancelID)
+            order=CancelOrder(time_placed=self.current_time, side=side, size=-1, symbol=self.exchange.symbol, agent_id=self.id, cancelID=cancelID)
+            order._level=level
         return order
     
     
@@ -0,0 +1,24 @@
+import dataclasses
+from typing import Callable
+
+def slotted(weakref: bool=False) -> Callable[[type], type]:
+    """
+    Class decorator, placed above @dataclass, that rebuilds the dataclass with __slots__ for the fields it adds to its
+    bases (what dataclass(slots=True) does from Python 3.10), so that its instances carry no per instance __dict__.
+    The bases must be slotted as well. weakref adds a __weakref__ slot, inherited by the subclasses.
+    """
+    def decorator(cls: type) -> type:
+        inherited=set()
+        for base in cls.__mro__[1:]:
+            inherited.update(getattr(base, "__slots__", ()))
+        slots=tuple(f.name for f in dataclasses.fields(cls) if f.name not in inherited)
+        if weakref and "__weakref__" not in inherited:
+            slots+=("__weakref__",)
+        namespace=dict(cls.__dict__)
+        for name in slots+("__dict__", "__weakref__"):
+            namespace.pop(name, None) #field defaults live in the generated __init__
+        namespace["__slots__"]=slots
+        new=type(cls)(cls.__name__, cls.__bases__, namespace)
+        new.__qualname__=cls.__qualname__
+        return new
+    return decorator
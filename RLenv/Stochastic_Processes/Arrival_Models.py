@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
 import numpy as np
 from RLenv.Stochastic_Processes.Stochastic_Models import StochasticModel
+from simulation.OrderSizeSampler import OrderSizeSampler
+from simulation.functions import kernelTables, historyKernelSum
+from simulation.TODTable import TODTable
+from simulation.RNGService import RNGService
 from typing import Any, List, Dict, Optional, Tuple, ClassVar
 import logging
 from RLenv import logging_config
@@ -8,8 +12,8 @@ logger = logging.getLogger(__name__)
 class ArrivalModel(StochasticModel):
     """ArrivalModel models the arrival of orders to the order book. It also generates an initial starting state for the limit order book.
     """
-    def __init__(self, params: Dict[str, Any]):
-        super().__init__(params=params)
+    def __init__(self, params: Dict[str, Any], seed=1):
+        super().__init__(params=params, seed=seed)
     
     @abstractmethod
     def get_nextarrival(self):
@@ -25,14 +29,15 @@ class ArrivalModel(StochasticModel):
     
     
 class HawkesArrival(ArrivalModel):
-    def __init__(self, params: Dict[str, Any], seed=1):
+    def __init__(self, params: Dict[str, Any], seed=1, rng=None):
         """
         T: Simulation time_limit, which should be passed on by the kernel
         Params Dictionary consists of all the necessary parameters for the Hawkes arrival model: 
             parameters:"kernelparams", "tod", "Pis", "beta", "avgSpread", "spread", "price0", "Pi_Q0"
-            
+        rng: RNGService (or np.random.Generator) every draw of the model is taken from, RNGService(seed) by default
         
         """
+        self.rng=RNGService(seed) if rng is None else rng
         self.cols= ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
             "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
         self.coltolevel={0: "Ask_L2",
@@ -57,7 +62,7 @@ class HawkesArrival(ArrivalModel):
         else:
             pass
         self.num_nodes=len(self.cols)  
-        super().__init__(params=params)
+        super().__init__(params=params, seed=seed)
         
         #Initializing storage variables for thinning simulation    
         self.todmult=None
@@ -69,6 +74,9 @@ class HawkesArrival(ArrivalModel):
         self.lamb = None
         self.left=None
         self.pointcount=0
+        self.samplers={} #OrderSizeSamplers built lazily per LOB level
+        self.tables=None #kernel tables of historyKernelSum, built on first use
+        self.todtable=None #TODTable of kernelparams and tod, built on first use
         
     def generatefakeparams(self):
         """
@@ -117,15 +125,15 @@ class HawkesArrival(ArrivalModel):
         for i in range(12):
             for j in range(12):
                 if i == j: continue
-                mat[i][j] = np.random.choice([1,-1])*mat[i][i]*np.exp(-.75*np.abs(j-i))
+                mat[i][j] = self.rng.choice([1,-1])*mat[i][i]*np.exp(-.75*np.abs(j-i))
                 
         kernelparamsfake = {}
         for i in range(12):
-            kernelparamsfake[self.cols[i]] = 0.1*np.random.choice([0.3,0.4,0.5,0.6,0.7])
+            kernelparamsfake[self.cols[i]] = 0.1*self.rng.choice([0.3,0.4,0.5,0.6,0.7])
             for j in range(12):
                 maxTOD = np.max(list(faketod[self.cols[j]].values()))
-                beta = np.random.choice([1.5,1.6,1.7,1.8,1.9])
-                gamma = (1+np.random.rand())*5e3
+                beta = self.rng.choice([1.5,1.6,1.7,1.8,1.9])
+                gamma = (1+self.rng.random())*5e3
                 alpha = np.abs(mat[i][j])*gamma*(beta-1)/maxTOD
                 kernelparamsfake[self.cols[i]+"->"+self.cols[j]] = (np.sign(mat[i][j]), np.array([alpha, beta, gamma]))
         
@@ -153,20 +161,15 @@ class HawkesArrival(ArrivalModel):
         loblevel: one of the 4 possible levels in the LOB
         Returns: qsize the size of the order
         """
-        try:
-            pi= self.Pi_Q0[loblevel]
-        except KeyError:
-            raise KeyError(f"LOB level {loblevel} not provided in PI_Q0s of arrival model")
-        p = pi[0]
-        dd = pi[1]
-        pi = np.array([p*(1-p)**k for k in range(1,100000)])
-        # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-        for i, p_i in dd:
-            pi[i-1] = p_i + pi[i-1]
-        pi = pi/sum(pi)
-        cdf = np.cumsum(pi)
-        a = np.random.uniform(0, 1)
-        qSize = np.argmax(cdf>=a) + 1
+        sampler=self.samplers.get(loblevel)
+        if sampler is None:
+            try:
+                pi= self.Pi_Q0[loblevel]
+            except KeyError:
+                raise KeyError(f"LOB level {loblevel} not provided in PI_Q0s of arrival model")
+            sampler=OrderSizeSampler(pi, maxSize=100000, rng=self.rng)
+            self.samplers[loblevel]=sampler
+        qSize = sampler.sample()
         return qSize
 
     def generate_orders_in_queue(self, loblevel, numorders=10) -> List[int]:
@@ -203,23 +206,17 @@ class HawkesArrival(ArrivalModel):
         if self.spread is None: self.spread = 1
         """Setting up thinningOgata params"""
         self.baselines =self.kernelparams[1].copy()
-        mat = np.zeros((self.num_nodes, self.num_nodes))
         if self.s is None: 
             self.s = 0
-        hourIndex = min(12,int(self.s//1800)) #1800 seconds in 30 minutes
-        self.todmult=self.tod[:, hourIndex].reshape((12, 1))
-        #todMult*kernelParams[0]*kernelParams[1][0]/((-1 + kernelParams[1][1])*kernelParams[1][2]) 
-        mat=self.todmult*self.kernelparams[0][0]*self.kernelparams[0][1]/((self.kernelparams[0][2]-1) *self.kernelparams[0][3])
+        if self.todtable is None: self.todtable = TODTable(self.kernelparams, self.tod, 'powerlaw') #spectral radii of every TOD bin, computed once
+        hourIndex = self.todtable.hourindex(self.s)
+        self.todmult=self.todtable.todmults[hourIndex]
         self.baselines[5] = ((self.spread/self.avgSpread)**self.beta)*self.baselines[5]
         self.baselines[6] = ((self.spread/self.avgSpread)**self.beta)*self.baselines[6]
-        specRad = np.max(np.linalg.eig(mat)[0])
-        #print("spectral radius = ", specRad)
-        specRad = np.max(np.linalg.eig(mat)[0]).real
-        if specRad < 1 : specRad = 0.99 #  # dont change actual specRad if already good
         
         """calculating initial values of lamb_bar"""
         if self.lamb is None:
-            decays=(0.99/specRad) * self.todmult * self.baselines
+            decays=self.todmult * self.baselines
             self.lamb=np.sum(decays) #3.04895025
         if self.left is None:
             self.left=0
@@ -233,15 +230,15 @@ class HawkesArrival(ArrivalModel):
             lamb_bar=self.lamb 
             #print("lamb_bar: ", lamb_bar)
             """generate random u"""
-            u=np.random.uniform(0, 1)
+            u=self.rng.uniform(0, 1)
             if lamb_bar==0:
                 s+=0.1  # wait for some time
             else:
                 w=max(1e-7, -1 * np.log(u)/lamb_bar) # floor at 0.1 microsec
                 s+=w  
             """Recalculating baseline lambdas sum with new candidate"""
-            hourIndex = min(12,int(self.s//1800))
-            self.todmult=self.tod[:, hourIndex].reshape((12, 1)) * (0.99/specRad)
+            hourIndex = self.todtable.hourindex(self.s)
+            self.todmult=self.todtable.todmults[hourIndex]
             decays=self.todmult * self.baselines
             """Summing cross excitations for previous points"""
             if self.timeseries==[]:
@@ -253,10 +250,11 @@ class HawkesArrival(ArrivalModel):
                         self.left+=1 
                     else:
                         break
-                for point in self.timeseries[self.left:]: #point is of the form(s, k)
-                    kern=powerLawCutoff(time=self.s-point[0], alpha=self.kernelparams[0][0][point[1]]*self.kernelparams[0][1][point[1]], beta=self.kernelparams[0][2][point[1]], gamma=self.kernelparams[0][3][point[1]])
-                    kern=kern.reshape((12, 1))
-                    decays+=self.todmult*kern
+                if self.left < len(self.timeseries):
+                    if self.tables is None: self.tables = kernelTables(self.kernelparams[0], 'powerlaw')
+                    window = np.array(self.timeseries[self.left:]) #points are of the form(s, k)
+                    kern=historyKernelSum(self.s-window[:, 0], window[:, 1].astype(int), *self.tables)
+                    decays+=self.todmult*kern.reshape((12, 1))
             #print(decays.shape) #should be (12, 1)
             decays=np.maximum(decays, 0)
             decays[5] = ((self.spread/self.avgSpread)**self.beta)*decays[5]
@@ -267,7 +265,7 @@ class HawkesArrival(ArrivalModel):
             #print("LAMBDA: ", lamb)
             
             """Testing candidate point"""
-            D=np.random.uniform(0, 1)
+            D=self.rng.uniform(0, 1)
             #print("Candidate D: ", D)
             if D*lamb_bar<=self.lamb:
                 pointcount+=1
@@ -430,7 +428,7 @@ class HawkesArrival(ArrivalModel):
     
     def reset(self, params={}):
         #Variables to reset
-        self.__init__(params=params)
+        self.__init__(params=params, seed=self.seed, rng=self.rng)
     
     def seed(self):
         return super().seed()
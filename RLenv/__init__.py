@@ -0,0 +1,8 @@
+import os
+import sys
+
+#RLenv uses the simulation package of src under the same name as the code in src (simulation.*), so that both share
+#the same module objects (and classes, e.g. for the isinstance checks of Checkpoint)
+_src=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if _src not in sys.path:
+    sys.path.append(_src)
@@ -4,7 +4,14 @@ import os
 import pickle
 import time
 import datetime as dt
+import sys
 from src.backup.hawkes import dataLoader
+#simulation.* is imported from src, as RLenv and run_parallel_simulations do, so that it is loaded only once
+_src = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _src not in sys.path:
+    sys.path.append(_src)
+from simulation.PathStore import PathReader
+from simulation.TODTable import TODTable
 import matplotlib.pyplot as plt
 import statsmodels.api as sm
 
@@ -20,6 +27,43 @@ def cleanMOs(data):
     dataMOBid = dataMOBid.loc[dataMOBid.Time.diff() != 0]
     return pd.concat([dataNoMO, dataMOBid, dataMOAsk])
 
+def loadSimulatedPath(path, tmin = None, tmax = None):
+    """
+    Loads a simulated path as a DataFrame with one row per LOB snapshot (the first one is the initial book, with event None):
+    Time, event, Ask, Bid, Mid, Spread.
+    PathStore directories are memory mapped and only the rows with tmin <= Time <= tmax are read; legacy (Ts, lob, lobL3) pickles are loaded whole.
+    """
+    if PathReader.ispath(path):
+        reader = PathReader(path)
+        data = reader.read(["t", "event", "price"], tmin = tmin, tmax = tmax)
+        times = data["t"]
+        events = np.array(reader.events + [None], dtype = object)[data["event"]] # event -1 -> None
+        ask = data["price"][:, reader.levels.index("Ask_touch")]
+        bid = data["price"][:, reader.levels.index("Bid_touch")]
+    else:
+        tryer= 0
+        while tryer < 5: # retry on pickle clashes
+            try:
+                with open(path, "rb") as f:
+                    results = pickle.load(f)
+                tryer = 6
+            except Exception as e:
+                print("problem w " + path + " " + str(e))
+                time.sleep(1)
+                tryer +=1
+        times = np.append([0], np.array(results[0][1:])[:,1]).astype(float)
+        events = np.array([None] + [r[0] for r in results[0][1:]], dtype = object)
+        ask = np.array([r['Ask_touch'][0] for r in results[1]])
+        bid = np.array([r['Bid_touch'][0] for r in results[1]])
+        idxs = np.ones(len(times), dtype = bool)
+        if tmin is not None: idxs &= times >= tmin
+        if tmax is not None: idxs &= times <= tmax
+        times, events, ask, bid = times[idxs], events[idxs], ask[idxs], bid[idxs]
+    simDf = pd.DataFrame({"Time" : times, "event" : events, "Ask" : ask, "Bid" : bid})
+    simDf['Mid'] = 0.5*(simDf['Ask'] + simDf['Bid'])
+    simDf['Spread'] = simDf['Ask'] - simDf['Bid']
+    return simDf
+
 def runQQInterArrival(ric, sDate, eDate, resultsPath, delta = 1e-1, inputDataPath = "/SAN/fca/Konark_PhD_Experiments/extracted/", avgSpread = 0.0169, spreadBeta =0.7479):
     paramsPath = inputDataPath +ric+"_ParamsInferredWCutoff_2019-01-02_2019-03-31_CLSLogLin_10"
     todPath = inputDataPath +ric+"_Params_2019-01-02_2019-03-29_dictTOD"
@@ -38,6 +82,7 @@ def runQQInterArrival(ric, sDate, eDate, resultsPath, delta = 1e-1, inputDataPat
             if kernelParams is None: continue
             paramsDict[cols[i] + "->" + cols[j]]  = (kernelParams[0]*kernelParams[1][0], kernelParams[1][1] , kernelParams[1][2])
         baselines[cols[i]] = params[cols[i]]
+    todTable = TODTable.fromdicts(params, tod, kernel = 'powerlaw') # spectral radius of every TOD bin, computed once
     datas = []
     # timesLinspace = np.linspace(0, 23400, int(23400/delta))
     rounder= -1*int(np.round(np.log(delta)/np.log(10)))
@@ -59,19 +104,7 @@ def runQQInterArrival(ric, sDate, eDate, resultsPath, delta = 1e-1, inputDataPat
             r_i = r_i[1]
             t = r_i.Time
             # print(t)
-            mat = np.zeros((num_nodes, num_nodes))
-            s = t
-            hourIndex = np.min([12,int(np.floor(s/1800))])
-            for i in range(num_nodes):
-                for j in range(num_nodes):
-                    kernelParams = params.get(cols[i] + "->" + cols[j], None)
-                    if kernelParams is None: continue
-                    todMult = tod[cols[j]][hourIndex]
-                    mat[i][j]  = todMult*kernelParams[0]*kernelParams[1][0]/((-1 + kernelParams[1][1])*kernelParams[1][2]) # alpha/(beta -1)*gamma
-            specRad = np.max(np.linalg.eig(mat)[0])
-            # print("spectral radius = ", specRad)
-            specRad = np.max(np.linalg.eig(mat)[0]).real
-            if specRad < 1 : specRad = 0.99 # dont change actual specRad if already good
+            specRad = todTable.specRads[todTable.hourindex(t)]
             df = data.loc[data.Time < t]
             hourIdx = np.min([12,int(np.floor(t/1800))])
             if len(df) == 0:
@@ -150,20 +183,11 @@ def runSignaturePlots(paths, resultsPath, ric, sDate, eDate, inputDataPath = "/S
     countSim = 0
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    data = pickle.load(f)
-                tryer = 6
-            except:
-                time.sleep(1)
-                tryer +=1
+        simDf = loadSimulatedPath(path)
 
         countSim += 1
-        times = np.append([0], np.array(data[0][1:])[:,1])
-        lob = data[1]
-        mid = np.array([0.5*(r['Ask_touch'][0] + r['Bid_touch'][0]) for r in lob])
+        times = simDf.Time.values
+        mid = simDf.Mid.values
         for t in range(1,2001):
             sample_x = np.linspace(0, 23400, int(23400/t))
             idxs = np.searchsorted(times, sample_x)[1:-1] - 1
@@ -191,23 +215,10 @@ def runDistribution(paths, resultsPath, sDate, eDate, ric, emp=False):
 
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer = 6
-            except:
-                time.sleep(1)
-                tryer +=1
-        simDf = pd.DataFrame(results[1])
-        simDf['Ask'] = simDf['Ask_touch'].apply(lambda x: x[0])
-        simDf['Bid'] =  simDf['Bid_touch'].apply(lambda x: x[0])
-        simDf['Mid'] = 0.5*(simDf['Ask'] + simDf['Bid'])
-        simDf['Spread'] = simDf['Ask'] - simDf['Bid']
+        simDf = loadSimulatedPath(path)
         mid = simDf.Mid.values
 
-        times = np.append([0], np.array(results[0][1:])[:,1]).astype(float)
+        times = simDf.Time.values
         sample_x = np.linspace(times[1], times[-1], int(23400/t))
         idxs = np.searchsorted(times, sample_x)[1:-1] - 1
         sample_y = mid[idxs]
@@ -298,22 +309,9 @@ def runACF(paths, resultsPath, sDate, eDate, ric, emp=False):
     sample_x = np.linspace(0, 23400, int(23400/t))
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer = 6
-            except:
-                time.sleep(1)
-                tryer +=1
-
-        simDf = pd.DataFrame(results[1])
-        simDf['Ask'] = simDf['Ask_touch'].apply(lambda x: x[0])
-        simDf['Bid'] =  simDf['Bid_touch'].apply(lambda x: x[0])
-        simDf['Mid'] = 0.5*(simDf['Ask'] + simDf['Bid'])
+        simDf = loadSimulatedPath(path)
         mid = simDf.Mid.values
-        times = np.append([0], np.array(results[0][1:])[:,1])
+        times = simDf.Time.values
 
         idxs = np.searchsorted(times, sample_x)[1:-1] - 1
         sample_y = mid[idxs]
@@ -356,23 +354,10 @@ def runPricePaths(paths, resultsPath, sDate, eDate, ric, emp = False):
     simTimes = []
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer =6
-            except:
-                time.sleep(1)
-                tryer +=1
-
-        simDf = pd.DataFrame(results[1])
-        simDf['Ask'] = simDf['Ask_touch'].apply(lambda x: x[0])
-        simDf['Bid'] =  simDf['Bid_touch'].apply(lambda x: x[0])
-        simDf['Mid'] = 0.5*(simDf['Ask'] + simDf['Bid'])
+        simDf = loadSimulatedPath(path)
         mid = simDf.Mid.values
         simMids.append(mid)
-        simTimes.append(np.append([0], np.array(results[0][1:])[:,1]).astype(float) + 9.5*3600)
+        simTimes.append(simDf.Time.values + 9.5*3600)
     empMids = []
     empTimes = []
     if emp:
@@ -423,17 +408,7 @@ def runTODCheck(paths, resultsPath, sDate, eDate,ric):
     res = None
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer  = 6
-            except:
-                time.sleep(1)
-                tryer +=1
-
-        df = pd.DataFrame(np.array(results[0][1:]), columns = ["event", "time", "x"])
+        df = loadSimulatedPath(path).iloc[1:][["event", "Time"]].rename(columns = {"Time" : "time"})
         df['tod'] = df.time.astype(float).apply(lambda x: np.min([12,int(np.floor(x/1800))]))
         n = df.groupby(["event","tod"]).count()
         if res is None:
@@ -468,6 +443,7 @@ def runQQInterArrivalTrapezoid(ric, sDate, eDate, resultsPath, delta = 1e-1, inp
             if kernelParams is None: continue
             paramsDict[cols[i] + "->" + cols[j]]  = (kernelParams[0]*kernelParams[1][0], kernelParams[1][1] , kernelParams[1][2])
         baselines[cols[i]] = params[cols[i]]
+    todTable = TODTable.fromdicts(params, tod, kernel = 'powerlaw') # spectral radius of every TOD bin, computed once
     datas = []
     # timesLinspace = np.linspace(0, 23400, int(23400/delta))
     rounder= -1*int(np.round(np.log(delta)/np.log(10)))
@@ -491,19 +467,7 @@ def runQQInterArrivalTrapezoid(ric, sDate, eDate, resultsPath, delta = 1e-1, inp
             r_i = r_i[1]
             t = r_i.Time
             # print(t)
-            mat = np.zeros((num_nodes, num_nodes))
-            s = t
-            hourIndex = np.min([12,int(np.floor(s/1800))])
-            for i in range(num_nodes):
-                for j in range(num_nodes):
-                    kernelParams = params.get(cols[i] + "->" + cols[j], None)
-                    if kernelParams is None: continue
-                    todMult = tod[cols[j]][hourIndex]
-                    mat[i][j]  = todMult*kernelParams[0]*kernelParams[1][0]/((-1 + kernelParams[1][1])*kernelParams[1][2]) # alpha/(beta -1)*gamma
-            specRad = np.max(np.linalg.eig(mat)[0])
-            # print("spectral radius = ", specRad)
-            specRad = np.max(np.linalg.eig(mat)[0]).real
-            if specRad < 1 : specRad = 0.99 # dont change actual specRad if already good
+            specRad = todTable.specRads[todTable.hourindex(t)]
             df = data.loc[data.Time < t]
             hourIdx = np.min([12,int(np.floor(t/1800))])
             bigResultArr[counter, 0] = np.argwhere(np.array(cols) == r_i.event)[0][0]
@@ -548,25 +512,9 @@ def runInterArrivalTimes(paths, resultsPath, sDate, eDate, ric, emp=False):
     simTimes = []
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer = 6
-            except Exception as e:
-                print("problem w " + path + " " + str(e))
-                time.sleep(1)
-                tryer +=1
-                if tryer ==6:
-                    continue
-
-        simDf = pd.DataFrame(results[1])
-        simDf['Ask'] = simDf['Ask_touch'].apply(lambda x: x[0])
-        simDf['Bid'] =  simDf['Bid_touch'].apply(lambda x: x[0])
-        simDf['Mid'] = 0.5*(simDf['Ask'] + simDf['Bid'])
+        simDf = loadSimulatedPath(path)
         mid = simDf.Mid.values
-        times = np.append([0], np.array(results[0][1:])[:,1]).astype(float)
+        times = simDf.Time.values
         simPriceChangeTimes += [np.log(np.diff(times[np.append([0], np.diff(mid)) !=0].astype(float)))/np.log(10)]
         simTimes += [times[np.append([0], np.diff(mid)) !=0].astype(float)]
     simTimeIds = np.hstack([(i[1:] - 34200)//(1800) for i in simTimes])
@@ -615,16 +563,7 @@ def runInterArrivalTimes(paths, resultsPath, sDate, eDate, ric, emp=False):
     times_Sim_wts = {}
     for path in paths:
         print(path)
-        tryer= 0
-        while tryer < 5: # retry on pickle clashes
-            try:
-                with open(path, "rb") as f:
-                    results = pickle.load(f)
-                tryer = 6
-            except:
-                time.sleep(1)
-                tryer +=1
-        data = pd.DataFrame(results[0][1:], columns = ["event", "Time", "tmp"])
+        data = loadSimulatedPath(path).iloc[1:][["event", "Time"]]
         # data.loc[(data.Time < 3*3600)&(data.Time > 2.5*3600)]
         data_times = data.groupby("event").Time.apply(lambda x: np.array(x)[1:]).to_dict()
         for k in data_times:
@@ -5,6 +5,12 @@ import pandas as pd
 import time
 import numpy as np
 import os
+import sys
+#simulation.* is imported from src, as RLenv and run_parallel_simulations do, so that it is loaded only once
+_src = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _src not in sys.path:
+    sys.path.append(_src)
+from simulation.functions import kernelTables, historyKernelSum
 
 def powerLawKernel(x, alpha = 1., t0 = 1., beta = -2.):
     if x < t0: return 0
@@ -107,6 +113,7 @@ def thinningOgataIS2(T, params, tod, kernel = 'powerlaw', num_nodes=12, maxJumps
         left=0
     if timeseries is None:
         timeseries=[]
+    tables = kernelTables(params[0], kernel)
         
     """simulation loop"""
     while s<=T:
@@ -134,15 +141,10 @@ def thinningOgataIS2(T, params, tod, kernel = 'powerlaw', num_nodes=12, maxJumps
                     left+=1 
                 else:
                     break
-            for point in timeseries[left:]: #point is of the form(s, k)
-                if kernel == 'powerlaw':
-                    kern=powerLawCutoff(time=s-point[0], alpha=params[0][0][point[1]]*params[0][1][point[1]], beta=params[0][2][point[1]], gamma=params[0][3][point[1]])
-                elif kernel == 'exp':
-                    kern=expKernel(s-point[0], params[0][0][point[1]], params[0][1][point[1]])
-                else:
-                    raise Exception("kernel must be either 'exp' or 'powerlaw'")
-                kern=kern.reshape((12, 1))
-                decays+=todmult*kern
+            if left < len(timeseries):
+                window = np.array(timeseries[left:]) #points are of the form(s, k)
+                kern=historyKernelSum(s-window[:, 0], window[:, 1].astype(int), *tables)
+                decays+=todmult*kern.reshape((12, 1))
         #print(decays.shape) #should be (12, 1)
         decays=np.maximum(decays, 0)
         decays[5] = ((spread/avgSpread)**beta)*decays[5]
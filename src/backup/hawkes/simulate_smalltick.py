@@ -1,6 +1,12 @@
+import os
 import sys
 sys.path.append("/home/konajain/code/lobSimulations")
+#simulation.* is imported from src, as RLenv and run_parallel_simulations do, so that it is loaded only once
+_src = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _src not in sys.path:
+    sys.path.append(_src)
 from src.backup.hawkes import simulate_optimized
+from simulation.OrderSizeSampler import OrderSizeSampler
 
 import pickle
 import pandas as pd
@@ -214,21 +220,7 @@ def simulate_smallTick(T , paramsPath , todPath, s0 = None, filePathName = None,
             if len(t) == 0: continue
 
             pi = Pis[col] #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
-            p = pi[0]
-            dd = pi[1]
-            pi = np.array([p*(1-p)**k for k in range(1,10000)])
-            # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-            for i, p_i in dd:
-                pi[i-1] = p_i + pi[i-1]
-            pi = pi/sum(pi)
-            cdf = np.cumsum(pi)
-            a = np.random.uniform(0, 1, size = len(t))
-            if type(a) != float:
-                size =[]
-                for i in a:
-                    size.append(np.argmax(cdf>=i)+1)
-            else:
-                size = np.argmax(cdf>=a)+1
+            size = _getSampler(pi[0], pi[1], 10000).sample(size = len(t))
             sizes[col]  = size
             dictTimestamps[col] = t
         if verbose: print("Sizes is: ", sizes)
@@ -244,24 +236,23 @@ def simulate_smallTick(T , paramsPath , todPath, s0 = None, filePathName = None,
                 pickle.dump((Ts, lob), f)
     return Ts, lob, thinningtime
 
+_samplers = {} # OrderSizeSamplers keyed by (p, diracdeltas, maxWidth), built on first use
+
+def _getSampler(p, dd, maxWidth):
+    key = (p, tuple(tuple(d) for d in dd), maxWidth)
+    sampler = _samplers.get(key)
+    if sampler is None:
+        sampler = OrderSizeSampler((p, dd), maxSize = maxWidth)
+        _samplers[key] = sampler
+    return sampler
+
 def sampleGeometric(pi, maxWidth = 100):
     #geometric
-    pi = np.array([pi*(1-pi)**k for k in range(1,maxWidth)])
-    pi = pi/sum(pi)
-    cdf = np.cumsum(pi)
-    a = np.random.uniform(0, 1)
-    width = np.argmax(cdf>=a) + 1
+    width = _getSampler(pi, [], maxWidth).sample()
     return width
 
 def sampleGeometricWithSpikes(p, dd, maxWidth = 100000):
-    pi = np.array([p*(1-p)**k for k in range(1,maxWidth)])
-    # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-    for i, p_i in dd:
-        pi[i-1] = p_i + pi[i-1]
-    pi = pi/sum(pi)
-    cdf = np.cumsum(pi)
-    a = np.random.uniform(0, 1)
-    qSize = np.argmax(cdf>=a) + 1
+    qSize = _getSampler(p, dd, maxWidth).sample()
     return qSize
 
 def partition(q, new_width, original_width):
@@ -4,7 +4,8 @@ import numpy as np
 import pickle
 import pandas as pd
 
-from simulation.Simulate import Simulate
+from run_parallel_simulations import runParallel
+from simulation.PathStore import PathReader
 
 file_source = os.path.dirname(__file__)
 parser = argparse.ArgumentParser()
@@ -13,19 +14,16 @@ parser.add_argument("--model_name", type=str, default="simulation-hawkes", help=
 parser.add_argument("--kernel_type", type=str, default="exp", help="Kernel type", choices=['powerlaw', 'exp'])
 parser.add_argument("--seed", type=int, default=2, help="Random seed")
 parser.add_argument("--n_sims", type=int, default=10, help="Number of simulations")
+parser.add_argument("--n_workers", type=int, default=None, help="Number of processes the simulations are spread over, all cores by default")
 parser.add_argument("--T", type=int, default=100, help="Time horizon")
 parser.add_argument("--inputs_path", type=str, default=os.path.join(file_source, 'data', 'inputs'), help="Inputs path")
 parser.add_argument("--outputs_path", type=str, default=os.path.join(file_source, 'data', 'outputs'), help="Outputs path")
 
-if __name__ == '__main__':
-
-    args = parser.parse_args()
-
-    model_name = args.model_name
-    seed = args.seed
-    n_sims = args.n_sims
-    T = args.T
-    kernel_type = args.kernel_type
+def fakeParams(kernel_type = "exp", seed = 2):
+    """
+    Fake kernel and TOD params in the dictionary format of the fitted ones (see Simulate.preprocessdata), drawn from the
+    global np.random seeded with seed. Returns paramsFake, faketod
+    """
     cols = [
         "lo_deep_Ask", "co_deep_Ask", "lo_top_Ask", "co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
         "lo_inspread_Bid", "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid"
@@ -48,14 +46,6 @@ if __name__ == '__main__':
         for k1 in np.arange(13):
             faketod[k][k1] = 1.0
 
-    # check if dir exists
-    if not os.path.exists(os.path.join(args.inputs_path, model_name)):
-        os.makedirs(os.path.join(args.inputs_path, model_name))
-
-    # save the fake data
-    with open(os.path.join(args.inputs_path, model_name, "fakeData_Params_sod_eod_dictTOD_constt"), "wb") as f:
-        pickle.dump(faketod, f)
-
     # Create fake power law kernel params from the above norm matrix
     paramsFake = {}
     if kernel_type == 'powerlaw':
@@ -77,6 +67,32 @@ if __name__ == '__main__':
                 paramsFake[cols[i]+"->"+cols[j]] = (np.sign(mat[i][j]), np.array([alpha, beta]))
     else:
         raise Exception('kernel_type must be one of exp or powerlaw')
+    return paramsFake, faketod
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    model_name = args.model_name
+    seed = args.seed
+    n_sims = args.n_sims
+    T = args.T
+    kernel_type = args.kernel_type
+    cols = [
+        "lo_deep_Ask", "co_deep_Ask", "lo_top_Ask", "co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
+        "lo_inspread_Bid", "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid"
+        ]
+    n_cols = len(cols)
+
+    paramsFake, faketod = fakeParams(kernel_type, seed)
+
+    # check if dir exists
+    if not os.path.exists(os.path.join(args.inputs_path, model_name)):
+        os.makedirs(os.path.join(args.inputs_path, model_name))
+
+    # save the fake data
+    with open(os.path.join(args.inputs_path, model_name, "fakeData_Params_sod_eod_dictTOD_constt"), "wb") as f:
+        pickle.dump(faketod, f)
 
     mat = np.zeros((n_cols,n_cols))
     for i in range(len(cols)):
@@ -93,39 +109,25 @@ if __name__ == '__main__':
 
     paramsPath = os.path.join(args.inputs_path, model_name, "fake_ParamsInferredWCutoff_sod_eod_true")
     todPath = os.path.join(args.inputs_path, model_name, "fakeData_Params_sod_eod_dictTOD_constt")
-    simulate = Simulate()
-
-    # check if dir exists
-    if not os.path.exists(os.path.join(args.outputs_path, model_name)):
-        os.makedirs(os.path.join(args.outputs_path, model_name))
-
     #### WARNING: THIS PIECE OF CODE TAKES A LONG TIME ####
-    for i in range(n_sims):
-        Ts, lob, lobL3, thinningtime = simulate.run(T=T, # 6.5*3600
-                                                    paramsPath=paramsPath, 
-                                                    todPath=todPath, 
-                                                    beta=1., 
-                                                    avgSpread=.01, 
-                                                    spread0=5, 
-                                                    price0=45,
-                                                    verbose=True,
-                                                    kernel = kernel_type)
-        
-        if len(pd.DataFrame(Ts[1:])[0].unique()) != len(cols):
-            raise ValueError(f"Some columns are missing in the data 'T' for id = {i}")
-        
-        fakeSimPath = os.path.join(args.outputs_path, model_name, f"fake_simulated_sod_eod_{i}")
-
-        with open(fakeSimPath, "wb") as f:
-            pickle.dump((Ts, lob, lobL3), f)
+    # path i is written to fake_simulated_sod_eod_{i} and seeded from (seed, i), see run_parallel_simulations.py
+    runParallel(paramsPath, todPath, T, n_sims, seed, os.path.join(args.outputs_path, model_name),
+                prefix="fake_simulated_sod_eod", n_workers=args.n_workers, overwrite=True,
+                beta=1., avgSpread=.01, spread0=5, price0=45, verbose=True, kernel=kernel_type)
 
     # save as 12D 
-    paths = [i for i in os.listdir(os.path.join(os.path.join(args.outputs_path, model_name))) if ("fake_simulated" in i)]
+    paths = [i for i in os.listdir(os.path.join(os.path.join(args.outputs_path, model_name))) if ("fake_simulated" in i) and not i.endswith(".tmp")]
     for p in paths:
         resPath = os.path.join(args.outputs_path, model_name, p)
-        with open(resPath, 'rb') as f:
-            results = pickle.load(f)
-        
+        if PathReader.ispath(resPath):
+            results = PathReader(resPath).tolegacy()
+        else:
+            with open(resPath, 'rb') as f:
+                results = pickle.load(f)
+
+        if len(pd.DataFrame(results[0][1:])[0].unique()) != len(cols):
+            raise ValueError(f"Some columns are missing in the data 'T' for {p}")
+
         ask_t = []
         bid_t = []
         ask_d = []
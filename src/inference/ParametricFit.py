@@ -9,6 +9,7 @@ import datetime as dt
 import copy
 
 from data.dataLoader import dataLoader
+from simulation.functions import powerLawCutoffSumExp
 
 class ParametricFit():
 
@@ -49,6 +50,13 @@ class ParametricFit():
         thetas = params
         return thetas, cov
 
+    def fitPowerLawCutoffSumExp(self, norm, numTerms = None, tol = 1e-2, horizon = 10.):
+        # power law with cutoff followed by its sum of exponentials approximation, for the recursive simulator
+        thetas, cov = self.fitPowerLawCutoff(norm)
+        weights, rates, err = powerLawCutoffSumExp(thetas, numTerms = numTerms, tol = tol, horizon = horizon)
+        print("sum of exponentials max rel error ", err)
+        return thetas, (weights, rates, err)
+
     def fitPowerLawCutoffNormConstrained(self, norm, alphaInit): # a not the same as norm in calibration
         def powerLawCutoff(time, beta, gamma):
             alpha = norm*(gamma*(beta - 1))
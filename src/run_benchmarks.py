@@ -0,0 +1,406 @@
+import os
+import sys
+import argparse
+import copy
+import json
+import pickle
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from generate_fake_data import fakeParams
+from simulation.Simulate import Simulate
+from simulation.ThinningEngine import ThinningEngine, SPREAD_EVENTS
+from simulation.ExactExpEngine import ExactExpEngine
+from simulation.KernelState import ExpKernelState, SumExpKernelState
+from simulation.OrderSizeSampler import OrderSizeSampler
+from simulation.RNGService import RNGService
+from simulation.LOBState import LOBState, SmallTickLOBState, COLS
+from simulation.functions import kernelTables, historyKernelSum, njit
+
+file_source = os.path.dirname(__file__)
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--groups", type=str, nargs="+", default=["thinning", "history", "lob", "sampler", "run", "exchange", "kernel"], help="Benchmark groups to run")
+parser.add_argument("--intensities", type=float, nargs="+", default=[1, 4, 16], help="Multipliers of the fake baseline intensities")
+parser.add_argument("--history_lengths", type=int, nargs="+", default=[10, 100, 1000, 10000], help="#of points in the history window of the kernel sum benchmarks")
+parser.add_argument("--n_events", type=int, default=2000, help="#of events per thinning / LOB / Exchange / Kernel case")
+parser.add_argument("--T", type=float, default=300, help="Time horizon of the Simulate.run cases")
+parser.add_argument("--n_paths", type=int, default=100, help="#of paths of the Simulate.runpaths cases, each one over --T/10")
+parser.add_argument("--repeat", type=int, default=3, help="Each case is timed repeat times and the fastest one is kept")
+parser.add_argument("--seed", type=int, default=2, help="Seed of the fake params and of the simulations")
+parser.add_argument("--in_process", action="store_true", help="Run every case in this process instead of a fresh one (peak RSS is then cumulative)")
+parser.add_argument("--output", type=str, default=os.path.join(file_source, 'data', 'outputs', 'benchmarks', f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"), help="JSON file the results are written to")
+parser.add_argument("--compare", type=str, default=None, help="Previous results JSON to compare events/sec against")
+parser.add_argument("--threshold", type=float, default=0.1, help="Relative events/sec drop reported as a regression by --compare")
+
+def peakRSS():
+    """Peak resident set size of this process in MB"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/1024**2 if sys.platform == "darwin" else maxrss/1024 # bytes on macOS, kB on Linux
+
+def fakeArrays(kernel, seed, intensity = 1):
+    """(tod, params) arrays of Simulate.preprocessdata for the fake params of generate_fake_data.py, baselines scaled by intensity"""
+    with tempfile.TemporaryDirectory() as path:
+        paramsPath, todPath = writeFakeParams(path, kernel, seed, intensity)
+        return Simulate().preprocessdata(paramsPath, todPath, kernel = kernel)
+
+def writeFakeParams(path, kernel, seed, intensity = 1):
+    """Pickles the fake params to path and returns paramsPath, todPath"""
+    paramsFake, faketod = fakeParams(kernel, seed)
+    for col in COLS:
+        paramsFake[col] = intensity*paramsFake[col]
+    paramsPath = os.path.join(path, "fake_ParamsInferredWCutoff_sod_eod_true")
+    todPath = os.path.join(path, "fakeData_Params_sod_eod_dictTOD_constt")
+    with open(paramsPath, "wb") as f:
+        pickle.dump(paramsFake, f)
+    with open(todPath, "wb") as f:
+        pickle.dump(faketod, f)
+    return paramsPath, todPath
+
+def defaultSamplers(rng):
+    """Order size and queue size samplers of Simulate.run with its default (AAPL) Pis and Pi_Q0"""
+    Pis = {'lo_deep_Bid': [0.0028405540014542, [(1, 0.012527718976326372), (10, 0.13008130053050898), (50, 0.01432529704009695), (100, 0.7405118066127269)]],
+           'lo_inspread_Bid': [0.001930457915114691, [(1, 0.03065295587464324), (10, 0.18510015294680732), (50, 0.021069809772740915), (100, 2.594573929265402)]],
+           'lo_top_Bid': [0.0028207493506166507, [(1, 0.05839080241927479), (10, 0.17259077005977103), (50, 0.011272365769158578), (100, 2.225254050790496)]],
+           'mo_Bid': [0.008810527626617248, [(1, 0.13607245009890734), (10, 0.07035276109045323), (50, 0.041795348623102815), (100, 1.0584893799948996), (200, 0.10656843768185977)]]}
+    for col in ["mo", "lo_top", "lo_inspread", "lo_deep"]:
+        Pis[col + "_Ask"] = Pis[col + "_Bid"]
+    Pi_Q0 = {'Ask_touch': [0.0018287411983379015, [(1, 0.007050802017724003), (10, 0.009434048841996959), (100, 0.20149407216104853), (500, 0.054411455742183645), (1000, 0.01605198687975892)]],
+             'Ask_deep': [0.001229380704944344, [(1, 0.0), (10, 0.0005240951083719349), (100, 0.03136813097471952), (500, 0.06869444491232923), (1000, 0.04298980350337664)]]}
+    Pi_Q0["Bid_touch"] = Pi_Q0["Ask_touch"]
+    Pi_Q0["Bid_deep"] = Pi_Q0["Ask_deep"]
+    return OrderSizeSampler.fromdict(Pis, maxSize = 10000, rng = rng), OrderSizeSampler.fromdict(Pi_Q0, maxSize = 100000, rng = rng), Pi_Q0
+
+def randomEvents(n, rng):
+    """n event ids and order sizes, the same mix for every LOB case"""
+    return rng.integers(0, len(COLS), n), rng.integers(1, 200, n)
+
+"""Benchmark cases: each one sets up outside the timed section and returns a callable that runs the case and returns its #of events"""
+
+def benchThinning(kernel, intensity, recursive, adaptiveBound, n_events, seed):
+    tod, params = fakeArrays(kernel, seed, intensity)
+    kernelstate = None
+    if recursive: # the sum of exponentials fit of the powerlaw kernels is a one off cost, keep it out of the timed section
+        kernelstate = ExpKernelState(params[0]) if kernel == 'exp' else SumExpKernelState(params[0])
+    def case():
+        engine = ThinningEngine(params, tod, kernel = kernel, spread = 0.02, beta = 1., avgSpread = .01, recursive = recursive, kernelstate = copy.deepcopy(kernelstate), rng = np.random.default_rng(seed), adaptiveBound = adaptiveBound, history = False)
+        events = 0
+        while events < n_events:
+            events += len(engine.simulate(np.inf, maxJumps = n_events - events, stopEvents = SPREAD_EVENTS))
+            engine.setspread(0.02) # keep the inspread events on, as the LOB would
+        return events, {"acceptance_rate": engine.acceptancerate(), "bound_refreshes": engine.refreshes}
+    return case
+
+def benchExact(intensity, n_events, seed):
+    tod, params = fakeArrays('exp', seed, intensity)
+    def case():
+        engine = ExactExpEngine(params, tod, spread = 0.02, beta = 1., avgSpread = .01, rng = np.random.default_rng(seed), history = False)
+        events = 0
+        while events < n_events:
+            events += len(engine.simulate(np.inf, maxJumps = n_events - events, stopEvents = SPREAD_EVENTS))
+            engine.setspread(0.02)
+        return events
+    return case
+
+def benchHistory(kernel, historyLength, jit, seed):
+    if jit and (njit is None):
+        raise ImportError("numba is not installed")
+    _, params = fakeArrays(kernel, seed)
+    tables = kernelTables(params[0], kernel)
+    rng = np.random.default_rng(seed)
+    dt = np.sort(rng.uniform(0, 10, historyLength))[::-1].copy()
+    types = rng.integers(0, len(COLS), historyLength)
+    calls = max(10, 200000//historyLength)
+    historyKernelSum(dt, types, *tables, jit = jit) # compile outside the timed section
+    def case():
+        for _ in range(calls):
+            historyKernelSum(dt, types, *tables, jit = jit)
+        return calls
+    return case
+
+def benchLOBState(n_events, seed):
+    rng = np.random.default_rng(seed)
+    _, queueSamplers, _ = defaultSamplers(rng)
+    events, sizes = randomEvents(n_events, rng)
+    def case():
+        lobstate = LOBState.fromprices(queueSamplers, priceMid0 = 45, spread0 = 5, rng = rng)
+        for k, size in zip(events, sizes):
+            lobstate.apply(k, size)
+        return n_events
+    return case
+
+def benchSmallTickLOBState(n_events, seed):
+    rng = np.random.default_rng(seed)
+    _, queueSamplers, _ = defaultSamplers(rng)
+    _, Pi_M0, Pi_eta = Simulate().widthdistributions({"lo_top_Ask": None, "lo_top_Bid": None, "lo_deep_Ask": None, "lo_deep_Bid": None})
+    widthSamplers = OrderSizeSampler.fromdict({k: (p, []) for k, p in Pi_M0.items()}, maxSize = 100, rng = rng)
+    etaSamplers = OrderSizeSampler.fromdict({k: (p, []) for k, p in Pi_eta.items()}, maxSize = 100, rng = rng)
+    events, sizes = randomEvents(n_events, rng)
+    def case():
+        lobstate = SmallTickLOBState.fromprices(queueSamplers, widthSamplers, etaSamplers, priceMid0 = 45, spread0 = 20, M_med = 50)
+        for k, size in zip(events, sizes):
+            if (k in (5, 6)) and (lobstate.spread() < 0.015): continue # inspread events are off at a one tick spread, as in the engine
+            lobstate.apply(k, size)
+        return n_events
+    return case
+
+def benchCreateLOB(n_events, seed):
+    rng = np.random.default_rng(seed)
+    _, queueSamplers, Pi_Q0 = defaultSamplers(rng)
+    events, sizes = randomEvents(n_events, rng)
+    times = np.cumsum(rng.exponential(0.01, n_events))
+    dictTimestamps = {col: times[events == k] for k, col in enumerate(COLS)}
+    eventSizes = {col: sizes[events == k] for k, col in enumerate(COLS)}
+    def case():
+        T, _, _ = Simulate().createLOB(dictTimestamps, eventSizes, Pi_Q0, priceMid0 = 45, spread0 = 5, samplers = queueSamplers)
+        return len(T) - 1
+    return case
+
+def benchSampler(vectorised, n_events, seed):
+    sizeSamplers, _, _ = defaultSamplers(np.random.default_rng(seed))
+    sampler = sizeSamplers["lo_top_Ask"]
+    def case():
+        if vectorised:
+            sampler.sample(n_events)
+        else:
+            for _ in range(n_events):
+                sampler.sample()
+        return n_events
+    return case
+
+def benchRun(kernel, intensity, T, seed, smallTick = False, poisson = None):
+    workdir = tempfile.TemporaryDirectory()
+    paramsPath, todPath = writeFakeParams(workdir.name, kernel, seed, intensity)
+    book = dict(beta = .6, avgSpread = .2, spread0 = 20, M_med = 50) if smallTick else dict(beta = 1., avgSpread = .01, spread0 = 5)
+    def case():
+        Ts, _, _, _ = Simulate().run(T, paramsPath, todPath, price0 = 45, kernel = kernel, rng = np.random.default_rng(seed), smallTick = smallTick, poisson = poisson, batchSize = 256, **book)
+        return len(Ts) - 1
+    case.workdir = workdir # the params are removed with the case
+    return case
+
+def benchRunPaths(kernel, intensity, T, numPaths, seed):
+    workdir = tempfile.TemporaryDirectory()
+    paramsPath, todPath = writeFakeParams(workdir.name, kernel, seed, intensity)
+    def case():
+        paths = Simulate().runpaths(T, paramsPath, todPath, numPaths, beta = 1., avgSpread = .01, spread0 = 5, price0 = 45, kernel = kernel, rng = np.random.default_rng(seed))
+        return sum(len(Ts) - 1 for Ts, _, _ in paths)
+    case.workdir = workdir
+    return case
+
+def rlenvExchange(seed):
+    """A HawkesArrival driven Exchange with one random agent, linked to a Kernel. Raises if RLenv cannot be set up"""
+    sys.path.append(os.path.dirname(file_source)) # RLenv lives next to src
+    from RLenv.Kernel import Kernel
+    from RLenv.SimulationEntities.Exchange import Exchange
+    from RLenv.SimulationEntities.TradingAgent import TradingAgent
+    from RLenv.Stochastic_Processes.Arrival_Models import HawkesArrival
+    tod, params = fakeArrays("powerlaw", seed)
+    _, _, Pi_Q0 = defaultSamplers(None)
+    Pi_Q0 = {level.replace("touch", "L1").replace("deep", "L2"): pi for level, pi in Pi_Q0.items()}
+    arrivals = HawkesArrival(params = {"kernelparams": params, "tod": tod, "Pis": None, "beta": 1., "avgSpread": .01, "spread0": 5, "price0": 45, "Pi_Q0": Pi_Q0}, seed = seed)
+    agent = TradingAgent(seed = seed)
+    exchange = Exchange(Arrival_model = arrivals, agents = [agent])
+    kernel = Kernel(agents = [agent], exchange = exchange, seed = seed, log_to_file = False)
+    exchange.initialize_exchange(priceMid0 = 45, spread0 = 5)
+    return kernel, exchange
+
+def randomOrders(exchange, n_events, seed):
+    from RLenv.Orders import LimitOrder, MarketOrder, CancelOrder
+    rng = np.random.default_rng(seed)
+    orders = []
+    for i in range(n_events):
+        side = "Ask" if rng.uniform() < 0.5 else "Bid"
+        kind = rng.integers(0, 3)
+        if kind == 0:
+            level = f"{side}_L{rng.integers(1, 3)}"
+            price = exchange.askprices[level] if side == "Ask" else exchange.bidprices[level]
+            order = LimitOrder(time_placed = i, side = side, size = int(rng.integers(1, 200)), symbol = exchange.symbol, agent_id = -1, price = price)
+        elif kind == 1:
+            order = MarketOrder(time_placed = i, side = side, size = int(rng.integers(1, 200)), symbol = exchange.symbol, agent_id = -1)
+            level = f"{side}_MO"
+        else:
+            level = f"{side}_L{rng.integers(1, 3)}"
+            order = CancelOrder(time_placed = i, side = side, size = -1, symbol = exchange.symbol, agent_id = -1)
+        order._level = level
+        orders.append(order)
+    return orders
+
+def benchExchange(n_events, seed):
+    _, exchange = rlenvExchange(seed)
+    orders = randomOrders(exchange, n_events, seed)
+    def case():
+        for order in orders:
+            exchange.processorder(order = order)
+        return n_events
+    return case
+
+def benchOrderBook(n_events, seed):
+    """Inserts, cancels by ID, touch fills and random public cancels on a two level RLenv OrderBook"""
+    sys.path.append(os.path.dirname(file_source))
+    from RLenv.OrderBook import OrderBook
+    from RLenv.Orders import LimitOrder
+    rng = np.random.default_rng(seed)
+    kinds = rng.integers(0, 4, n_events)
+    sides = np.where(rng.uniform(size = n_events) < 0.5, "Ask", "Bid")
+    levels = rng.integers(0, 2, n_events)
+    sizes = rng.integers(1, 200, n_events)
+    prices = {"Ask": [45.03, 45.04], "Bid": [44.97, 44.96]}
+    pick = RNGService(seed)
+    def case():
+        book = OrderBook()
+        for side in ["Ask", "Bid"]:
+            for price in prices[side]:
+                book.pushlevel(side, price, [LimitOrder(time_placed = 0, side = side, size = 100, symbol = "X", agent_id = -1, price = price) for _ in range(10)])
+        live = []
+        for i in range(n_events):
+            side, price = sides[i], prices[sides[i]][levels[i]]
+            if kinds[i] == 0 or len(book) < 20:
+                order = LimitOrder(time_placed = i, side = side, size = int(sizes[i]), symbol = "X", agent_id = -1 if i % 10 else 1, price = price)
+                book.add(order)
+                live.append(order.order_id)
+            elif kinds[i] == 1 and live:
+                orderID = live.pop(pick.randrange(0, len(live)))
+                if orderID in book: book.cancel(orderID)
+            elif kinds[i] == 2 and len(book.level(side, 0)) > 1:
+                book.popfront(side)
+            else:
+                order = book.randompublic(side, price, pick)
+                if order is not None: book.cancel(order.order_id)
+        return n_events
+    return case
+
+def benchKernel(n_events, seed, debug = False):
+    kernel, _ = rlenvExchange(seed)
+    kernel.debug = debug
+    from RLenv.Messages.AgentMessages import DoNothing
+    agentID = kernel.agents[0].id
+    def case():
+        kernel.queue, kernel.current_time = [], 0
+        for i in range(n_events):
+            kernel.sendmessage(senderID = agentID, recipientID = kernel.exchange.id, message = DoNothing(), delay = i)
+        kernel.run()
+        return n_events
+    return case
+
+def cases(args):
+    """Yields (name, group, settings, builder, builder arguments) for every case of the requested groups"""
+    if "thinning" in args.groups:
+        for kernel in ['exp', 'powerlaw']:
+            for recursive in [False, True]:
+                for adaptiveBound in [False, True]:
+                    for intensity in args.intensities:
+                        settings = {"kernel": kernel, "recursive": recursive, "adaptive_bound": adaptiveBound, "intensity": intensity}
+                        yield f"thinning_{kernel}_{'recursive' if recursive else 'window'}{'_adaptive' if adaptiveBound else ''}_x{intensity:g}", "thinning", settings, benchThinning, (kernel, intensity, recursive, adaptiveBound, args.n_events, args.seed)
+        for intensity in args.intensities:
+            yield f"thinning_exp_exact_x{intensity:g}", "thinning", {"kernel": "exp", "exact": True, "intensity": intensity}, benchExact, (intensity, args.n_events, args.seed)
+    if "history" in args.groups:
+        for kernel in ['exp', 'powerlaw']:
+            for jit in [False, True]:
+                for historyLength in args.history_lengths:
+                    settings = {"kernel": kernel, "jit": jit, "history_length": historyLength}
+                    yield f"history_{kernel}_{'numba' if jit else 'numpy'}_n{historyLength}", "history", settings, benchHistory, (kernel, historyLength, jit, args.seed)
+    if "lob" in args.groups:
+        yield "lob_lobstate_apply", "lob", {}, benchLOBState, (args.n_events, args.seed)
+        yield "lob_smalltick_apply", "lob", {"smallTick": True}, benchSmallTickLOBState, (args.n_events, args.seed)
+        yield "lob_createLOB", "lob", {}, benchCreateLOB, (args.n_events, args.seed)
+    if "sampler" in args.groups:
+        yield "sampler_scalar", "sampler", {"vectorised": False}, benchSampler, (False, args.n_events, args.seed)
+        yield "sampler_vectorised", "sampler", {"vectorised": True}, benchSampler, (True, 100*args.n_events, args.seed)
+    if "run" in args.groups:
+        for kernel in ['exp', 'powerlaw']:
+            for intensity in args.intensities:
+                yield f"run_{kernel}_x{intensity:g}", "run", {"kernel": kernel, "intensity": intensity, "T": args.T}, benchRun, (kernel, intensity, args.T, args.seed)
+                yield f"run_{kernel}_smalltick_x{intensity:g}", "run", {"kernel": kernel, "intensity": intensity, "T": args.T, "smallTick": True}, benchRun, (kernel, intensity, args.T, args.seed, True)
+                yield f"run_{kernel}_poisson_x{intensity:g}", "run", {"kernel": kernel, "intensity": intensity, "T": args.T, "poisson": "stationary"}, benchRun, (kernel, intensity, args.T, args.seed, False, "stationary")
+                yield f"run_{kernel}_paths{args.n_paths}_x{intensity:g}", "run", {"kernel": kernel, "intensity": intensity, "T": args.T/10, "n_paths": args.n_paths}, benchRunPaths, (kernel, intensity, args.T/10, args.n_paths, args.seed)
+    if "exchange" in args.groups:
+        yield "exchange_processorder", "exchange", {}, benchExchange, (args.n_events, args.seed)
+        yield "exchange_orderbook", "exchange", {}, benchOrderBook, (args.n_events, args.seed)
+    if "kernel" in args.groups:
+        yield "kernel_run", "kernel", {}, benchKernel, (args.n_events, args.seed)
+        yield "kernel_run_debug", "kernel", {"debug": True}, benchKernel, (args.n_events, args.seed, True)
+
+def runCase(builder, builderArgs, repeat):
+    """
+    Builds and times one case. Returns its measurements, or the reason it was skipped if it could not be set up or run.
+    A case returns its #of events, or (#of events, dict of extra measurements of the last repeat)
+    """
+    try:
+        case = builder(*builderArgs)
+        best, events, extra = np.inf, 0, {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            events = case()
+            best = min(best, time.perf_counter() - start)
+            if isinstance(events, tuple): events, extra = events
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc(), "peak_rss_mb": peakRSS()}
+    return {"events": int(events), "seconds": best, "events_per_sec": events/best if best > 0 else None,
+            "us_per_event": 1e6*best/events if events > 0 else None, "peak_rss_mb": peakRSS(), **extra}
+
+def runBenchmarks(args):
+    """Runs every case, each one in a fresh process unless args.in_process. Returns the results document"""
+    results = []
+    for name, group, settings, builder, builderArgs in cases(args):
+        if args.in_process:
+            res = runCase(builder, builderArgs, args.repeat)
+        else:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                res = pool.submit(runCase, builder, builderArgs, args.repeat).result()
+        res = {"name": name, "group": group, "settings": settings, **res}
+        results.append(res)
+        if "skipped" in res:
+            print(f"{name}: skipped ({res['skipped']})")
+        else:
+            acceptance = f", acceptance rate {res['acceptance_rate']:.3f}" if "acceptance_rate" in res else ""
+            print(f"{name}: {res['events_per_sec']:.0f} events/s, {res['us_per_event']:.1f} us/event{acceptance}, peak RSS {res['peak_rss_mb']:.0f} MB")
+    return {"meta": buildInfo(args), "results": results}
+
+def buildInfo(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = file_source, capture_output = True, text = True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count(), "args": vars(args)}
+
+def compare(results, baseline, threshold = 0.1):
+    """
+    Compares events/sec case by case with a previous results document. Returns the names of the cases more than threshold slower
+    """
+    previous = {res["name"]: res for res in baseline["results"] if res.get("events_per_sec")}
+    regressions = []
+    print(f"\nvs {baseline['meta'].get('commit')} ({baseline['meta'].get('time')}):")
+    for res in results["results"]:
+        old = previous.get(res["name"])
+        if (old is None) or not res.get("events_per_sec"): continue
+        ratio = res["events_per_sec"]/old["events_per_sec"]
+        flag = ""
+        if ratio < 1 - threshold:
+            regressions.append(res["name"])
+            flag = "  REGRESSION"
+        print(f"{res['name']}: {old['events_per_sec']:.0f} -> {res['events_per_sec']:.0f} events/s ({ratio:.2f}x){flag}")
+    return regressions
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    results = runBenchmarks(args)
+    if not os.path.exists(os.path.dirname(os.path.abspath(args.output))):
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 1)
+    print(f"results written to {args.output}")
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, threshold = args.threshold)
+        if len(regressions):
+            sys.exit(1)
@@ -0,0 +1,99 @@
+import os
+import argparse
+
+# one thread per worker: the pool already uses every core and the 12x12 linear algebra gains nothing from BLAS threads
+for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+    os.environ.setdefault(var, "1")
+
+import pickle
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from simulation.Simulate import Simulate
+from simulation.PathStore import PathReader
+from simulation.RNGService import RNGService, BIT_GENERATORS
+
+file_source = os.path.dirname(__file__)
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--model_name", type=str, default="simulation-hawkes", help="Model name")
+parser.add_argument("--paramsPath", type=str, default=None, help="Kernel params path, defaults to the fake params of generate_fake_data.py")
+parser.add_argument("--todPath", type=str, default=None, help="TOD params path, defaults to the fake TOD of generate_fake_data.py")
+parser.add_argument("--kernel_type", type=str, default="exp", help="Kernel type", choices=['powerlaw', 'exp'])
+parser.add_argument("--T", type=float, default=100, help="Time horizon of each path")
+parser.add_argument("--n_sims", type=int, default=10, help="Number of paths")
+parser.add_argument("--start", type=int, default=0, help="Index of the first path")
+parser.add_argument("--base_seed", type=int, default=2, help="Base seed, path i draws from SeedSequence(base_seed, spawn_key=(i,))")
+parser.add_argument("--bit_generator", type=str, default="PCG64", help="Bit generator of the path streams", choices=list(BIT_GENERATORS))
+parser.add_argument("--rng_block_size", type=int, default=4096, help="#of uniforms pre-drawn per block by the RNGService of a path, 0 to draw one by one (the streams of np.random.Generator(PCG64))")
+parser.add_argument("--n_workers", type=int, default=None, help="Number of processes, all cores by default")
+parser.add_argument("--prefix", type=str, default="simulated", help="Output file name prefix, path i is written to <prefix>_<i>")
+parser.add_argument("--batch_size", type=int, default=256, help="Max #of events per thinning batch of Simulate.run, 1 for the event by event draw order")
+parser.add_argument("--recursive", action="store_true", help="Use the recursive kernel state in the thinning")
+parser.add_argument("--pathFormat", type=str, default="npy", help="npy: PathStore directories, pickle: (Ts, lob, lobL3) pickles", choices=['npy', 'pickle'])
+parser.add_argument("--overwrite", action="store_true", help="Re-simulate paths whose output already exists")
+parser.add_argument("--inputs_path", type=str, default=os.path.join(file_source, 'data', 'inputs'), help="Inputs path")
+parser.add_argument("--outputs_path", type=str, default=os.path.join(file_source, 'data', 'outputs'), help="Outputs path")
+
+def pathRNG(base_seed, i, bitGenerator="PCG64", blockSize=4096):
+    """RNGService of path i: independent across i and the same whatever the number of paths or workers"""
+    return RNGService(base_seed, bitGenerator=bitGenerator, blockSize=blockSize).child(i)
+
+def simulatePath(i, paramsPath, todPath, T, base_seed, outputPath, pathFormat, runKwargs, bitGenerator="PCG64", blockSize=4096):
+    """
+    Simulates path i and writes it to outputPath, streamed as a PathStore directory (pathFormat='npy') or as a
+    (Ts, lob, lobL3) pickle. Returns (i, #events, thinningtime, wall time)
+    """
+    start = time.time()
+    rng = pathRNG(base_seed, i, bitGenerator=bitGenerator, blockSize=blockSize)
+    tmpPath = outputPath + ".tmp"
+    if os.path.isdir(tmpPath): shutil.rmtree(tmpPath)
+    if pathFormat == 'npy':
+        Ts, lob, lobL3, thinningtime = Simulate().run(T, paramsPath, todPath, rng=rng, filePathName=tmpPath, inMemory=False, **runKwargs)
+        numEvents = len(PathReader(tmpPath)) - 1
+    else:
+        Ts, lob, lobL3, thinningtime = Simulate().run(T, paramsPath, todPath, rng=rng, **runKwargs)
+        numEvents = len(Ts) - 1
+        with open(tmpPath, "wb") as f:
+            pickle.dump((Ts, lob, lobL3), f)
+    if os.path.isdir(outputPath): shutil.rmtree(outputPath)
+    os.replace(tmpPath, outputPath) # never leave a half written path behind
+    return i, numEvents, thinningtime, time.time() - start
+
+def runParallel(paramsPath, todPath, T, n_sims, base_seed, outputs_path, prefix="simulated", start=0, n_workers=None, pathFormat="npy", overwrite=False, bitGenerator="PCG64", blockSize=4096, **runKwargs):
+    """
+    Simulates paths start, ..., start + n_sims - 1 over a process pool and writes each one to outputs_path/<prefix>_<i>
+    as soon as it is done. Path i only depends on (base_seed, i), so any subset of paths can be (re)run on any machine.
+    Paths already on disk are skipped unless overwrite. See simulatePath for pathFormat and pathRNG for bitGenerator, blockSize.
+
+    runKwargs: passed on to Simulate.run
+    Returns the list of written file paths
+    """
+    if not os.path.exists(outputs_path):
+        os.makedirs(outputs_path)
+    outputPaths = {i: os.path.join(outputs_path, f"{prefix}_{i}") for i in range(start, start + n_sims)}
+    todo = [i for i in outputPaths if overwrite or not os.path.exists(outputPaths[i])]
+    if len(todo) < n_sims:
+        print(f"skipping {n_sims - len(todo)} paths already in {outputs_path}")
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(simulatePath, i, paramsPath, todPath, T, base_seed, outputPaths[i], pathFormat, runKwargs, bitGenerator, blockSize) for i in todo]
+        for done, future in enumerate(as_completed(futures)):
+            i, numEvents, thinningtime, walltime = future.result()
+            print(f"path {i} done ({done + 1}/{len(todo)}): {numEvents} events in {walltime:.1f}s, thinning {thinningtime*1e-9:.1f}s")
+    return list(outputPaths.values())
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    paramsPath = args.paramsPath
+    if paramsPath is None:
+        paramsPath = os.path.join(args.inputs_path, args.model_name, "fake_ParamsInferredWCutoff_sod_eod_true")
+    todPath = args.todPath
+    if todPath is None:
+        todPath = os.path.join(args.inputs_path, args.model_name, "fakeData_Params_sod_eod_dictTOD_constt")
+
+    runParallel(paramsPath, todPath, args.T, args.n_sims, args.base_seed, os.path.join(args.outputs_path, args.model_name),
+                prefix=args.prefix, start=args.start, n_workers=args.n_workers, pathFormat=args.pathFormat, overwrite=args.overwrite,
+                bitGenerator=args.bit_generator, blockSize=args.rng_block_size,
+                beta=1., avgSpread=.01, spread0=5, price0=45, kernel=args.kernel_type, recursive=args.recursive, batchSize=args.batch_size)
@@ -0,0 +1,63 @@
+import os
+import pickle
+import numpy as np
+
+from simulation.RNGService import RNGService
+
+class SimulationState:
+    """
+    Serialisable state of a running Simulate.run, enough to resume it bit-identically to an uninterrupted run.
+
+    Taken between two engine.simulate batches, once the LOB and the spread fed back to the engine are in sync. It holds
+    the engine state (ThinningEngine.getstate: times, counts, the recursive kernel state or the 10 second window, spread
+    multipliers), the book (LOBState.getstate), the state of the random generator every draw is taken from, the
+    snapshots still in the SnapshotBuffer and the #of chunks already written to the PathStore, i.e. the output offset.
+    The path written so far stays in the PathStore: a checkpoint only grows with the 10 second window and the buffered
+    rows, not with the length of the run.
+
+    Arguments:
+    engine, lobstate, snapshots: ThinningEngine, LOBState and SnapshotBuffer of the run
+    rng: np.random.Generator or RNGService of the run, or None / np.random for the global RandomState
+    chunks: #of chunks in the PathStore
+    lob0L3: initial L3 book returned in lobL3
+    thinningtime: thinning time so far
+    """
+    def __init__(self, engine, lobstate, snapshots, rng, chunks, lob0L3, thinningtime = 0):
+        self.engine = engine.getstate()
+        self.lob = lobstate.getstate()
+        self.snapshots = snapshots.columns()
+        self.rng = SimulationState.rngstate(rng)
+        self.chunks = chunks
+        self.lob0L3 = lob0L3
+        self.thinningtime = thinningtime
+
+    @staticmethod
+    def rngstate(rng):
+        if isinstance(rng, RNGService):
+            return rng.getstate()
+        if isinstance(rng, np.random.Generator):
+            return rng.bit_generator.state
+        return (rng if isinstance(rng, np.random.RandomState) else np.random).get_state()
+
+    def restore(self, engine, lobstate, snapshots, rng):
+        """Puts the saved state into the engine, book, buffer and random generator of a run built with the same arguments"""
+        engine.setstate(self.engine)
+        lobstate.setstate(self.lob)
+        snapshots.load(self.snapshots)
+        if isinstance(rng, RNGService):
+            rng.setstate(self.rng)
+        elif isinstance(rng, np.random.Generator):
+            rng.bit_generator.state = self.rng
+        else:
+            (rng if isinstance(rng, np.random.RandomState) else np.random).set_state(self.rng)
+
+    def save(self, path):
+        """Pickles the state to path, through a temporary file so that a crash while saving keeps the previous checkpoint"""
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,102 @@
+import numpy as np
+
+class EventWindow:
+    """
+    Array backed window of the latest (t, k) points, for the kernel sums over the last 10 seconds.
+
+    Points are appended at the tail and dropped from the head once they are out of the window, so the live points are
+    always the contiguous slices times(), types() that historyKernelSum takes. When the tail reaches the end of the
+    arrays the live points are moved back to the front (and the arrays doubled if they are more than half full), so
+    memory is bounded by the largest window, not by the length of the run, and no tuple or list is rebuilt per point.
+
+    Arguments:
+    capacity: initial length of the arrays
+    """
+    __slots__ = ("t", "k", "head", "tail")
+
+    def __init__(self, capacity = 1024):
+        self.t = np.zeros(capacity)
+        self.k = np.zeros(capacity, dtype = np.int64)
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def append(self, t, k):
+        if self.tail == len(self.t):
+            self._rebase()
+        self.t[self.tail] = t
+        self.k[self.tail] = k
+        self.tail += 1
+
+    def extend(self, points):
+        """Appends an iterable of (t, k)"""
+        for t, k in points:
+            self.append(t, k)
+
+    def dropolder(self, s, length = 10):
+        """Drops the points with s - t >= length and returns their #, the times being sorted"""
+        if self.tail == self.head: return 0
+        dropped = int(np.count_nonzero(s - self.t[self.head:self.tail] >= length))
+        self.head += dropped
+        return dropped
+
+    def times(self):
+        return self.t[self.head:self.tail]
+
+    def types(self):
+        return self.k[self.head:self.tail]
+
+    def _rebase(self):
+        n = self.tail - self.head
+        if 2*n > len(self.t):
+            t, k = np.zeros(2*len(self.t)), np.zeros(2*len(self.k), dtype = np.int64)
+        else:
+            t, k = self.t, self.k
+        t[:n] = self.t[self.head:self.tail]
+        k[:n] = self.k[self.head:self.tail]
+        self.t, self.k = t, k
+        self.head, self.tail = 0, n
+
+class EventSink:
+    """
+    Append-only chunked store of every (t, k) point, for the callers that need the whole history back.
+
+    Points are written into a fixed size chunk that is sealed once full, so appending never copies the points already
+    stored.
+
+    Arguments:
+    chunkSize: #of points per chunk
+    """
+    __slots__ = ("chunkSize", "chunks", "t", "k", "n")
+
+    def __init__(self, chunkSize = 65536):
+        self.chunkSize = chunkSize
+        self.chunks = []
+        self.t = np.zeros(chunkSize)
+        self.k = np.zeros(chunkSize, dtype = np.int64)
+        self.n = 0
+
+    def __len__(self):
+        return self.chunkSize*len(self.chunks) + self.n
+
+    def append(self, t, k):
+        if self.n == self.chunkSize:
+            self.chunks.append((self.t, self.k))
+            self.t = np.zeros(self.chunkSize)
+            self.k = np.zeros(self.chunkSize, dtype = np.int64)
+            self.n = 0
+        self.t[self.n] = t
+        self.k[self.n] = k
+        self.n += 1
+
+    def extend(self, points):
+        """Appends an iterable of (t, k)"""
+        for t, k in points:
+            self.append(t, k)
+
+    def arrays(self):
+        """(t, k) arrays of every point, oldest first"""
+        return (np.concatenate([t for t, _ in self.chunks] + [self.t[:self.n]]),
+                np.concatenate([k for _, k in self.chunks] + [self.k[:self.n]]))
@@ -0,0 +1,187 @@
+import numpy as np
+
+from simulation.ThinningEngine import ThinningEngine
+
+class ExactExpEngine(ThinningEngine):
+    """
+    Exact simulation of the exp kernel Hawkes process of Simulate by inverting its compensator, without thinning.
+
+    Between two points the TOD bin, the spread and the kernel state are fixed, so the intensity of dimension j is
+    c_j*max(g_j(v), 0) with g_j(v) = baselines_j + sum_i state_ij*exp(-beta_ij*v), v being the time since the last
+    point and c_j the TOD multiplier (times the spread multiplier for the inspread dimensions, 0 when they are off). The
+    compensator is then known in closed form on every interval where each g_j keeps its sign: the next point is the
+    time it reaches an Exp(1) draw, found by a safeguarded Newton solve, and its type is drawn from the intensities at
+    that time. Until the kernels that inhibit g_j have decayed below its baseline, g_j may change sign: from each piece
+    start a the next piece is as long as the second order bound |g_j(a + w)| >= |g_j| + sign(g_j)*g_j'*w - M_j*w**2/2
+    (M_j bounding |g_j''| on [a, inf)) keeps g_j away from zero, which closes in on its roots quadratically.
+    A point that would fall after the end of the TOD bin is not kept, the time moves to the bin end and a new draw is
+    made there, which is exact as the process has no memory beyond its kernel state. compensator and addpoint replay a
+    given path, e.g. to check any sampler by time rescaling (see tests/test_exact_sampler.py).
+
+    This is the process of ThinningEngine(kernel='exp', recursive=True) (there is no 10 second truncation), so it is a
+    drop in replacement for it: same state, setspread, stopEvents and returned (s, k, tau). Every draw is a point.
+
+    Arguments:
+    params, tod, num_nodes, s, spread, beta, avgSpread, kernelstate, timeseries, n, Ts, rng, profiler, todtable, history: see ThinningEngine,
+        params being [mask, alpha, beta], baselines as returned by Simulate.preprocessdata(kernel='exp')
+    tol: time tolerance in seconds of the root solves of the compensator and of the g_j
+    """
+    def __init__(self, params, tod, num_nodes = 12, s = 0, spread = 1, beta = 0.7479, avgSpread = 0.0169, kernelstate = None, timeseries = None, n = None, Ts = None, rng = None, profiler = None, todtable = None, tol = 1e-10, history = True):
+        super().__init__(params, tod, kernel = 'exp', num_nodes = num_nodes, s = s, spread = spread, beta = beta, avgSpread = avgSpread, recursive = True, kernelstate = kernelstate, timeseries = timeseries, n = n, Ts = Ts, rng = rng, profiler = profiler, todtable = todtable, history = history)
+        self.tol = tol
+        decays = self.kernelstate.decays
+        self.safeDecays = np.where(decays > 0, decays, 1.) # kernels with beta <= 0 must have a zero jump
+
+    def _coefficients(self, hourIndex):
+        """Returns c, baselines as (num_nodes,) vectors, see the class docstring"""
+        c = self.todtable.todmults[hourIndex][:, 0].copy()
+        c[5] = self.spreadMult*c[5]
+        c[6] = self.spreadMult*c[6]
+        if self.inspreadOff:
+            c[5] = c[6] = 0
+        return c, self.baselines[:, 0]
+
+    def _integral(self, xOverDecays, c, mu, a, u, expA):
+        """
+        Compensator of the dimensions with c > 0 between v = a and v = u <= inf, assuming every g_j keeps its sign on
+        [a, u]. expA is exp(-beta*a). Also returns exp(-beta*u).
+        """
+        if u == np.inf:
+            if np.any((c > 0) & (mu > 0)): return np.inf, 0.
+            return float(c @ (xOverDecays*expA).sum(axis = 0)), 0.
+        expU = np.exp(-1*self.safeDecays*u)
+        return float(c @ (mu*(u - a) + (xOverDecays*(expA - expU)).sum(axis = 0))), expU
+
+    def _solve(self, x, xOverDecays, c, mu, a, b, E):
+        """Returns u in [a, b] with _integral(a, u) = E, the dimensions with c > 0 being positive on [a, b]"""
+        expA = np.exp(-1*self.safeDecays*a)
+        rate = float(c @ mu)
+        lo, hi = a, b
+        if (rate > 0) and (a + E/rate < b):
+            # the baselines alone reach E by a + E/rate, a bracket only if the kernels do not take more than they add
+            bound = a + E/rate
+            if self._integral(xOverDecays, c, mu, a, bound, expA)[0] >= E: hi = bound
+        u = a + E/max(float(c @ (mu + (x*expA).sum(axis = 0))), 1e-300)
+        if hi == np.inf: # only decaying kernels left, bracket by doubling
+            hi = u
+            while self._integral(xOverDecays, c, mu, a, hi, expA)[0] < E:
+                hi = a + 2*(hi - a)
+        u = min(u, hi)
+        while hi - lo > self.tol:
+            f, expU = self._integral(xOverDecays, c, mu, a, u, expA)
+            f -= E
+            if abs(f) <= self.tol*max(1., E): break
+            if f > 0:
+                hi = u
+            else:
+                lo = u
+            lamb = float(c @ (mu + (x*expU).sum(axis = 0)))
+            step = u - f/lamb if lamb > 0 else np.nan
+            u = step if lo < step < hi else (lo + hi)/2
+        return u
+
+    def _walk(self, s, horizon, E):
+        """
+        Walks the compensator from s over the pieces on which every g_j keeps its sign. Returns (v, 0.) if it reaches E
+        at s + v before s + horizon (horizon may be inf, s + horizon must be in the TOD bin of s), (None, compensator
+        up to s + horizon) otherwise. The kernel state is decayed to s, not moved.
+        """
+        kernelstate = self.kernelstate
+        x = kernelstate.state
+        if s > kernelstate.s: x = x*np.exp(-1*kernelstate.decays*(s - kernelstate.s))
+        c, mu = self._coefficients(self.hourindex(s))
+        active = c > 0
+        if not np.any(active): return None, 0.
+        xOverDecays = x/self.safeDecays
+        # g, g' and a bound on |g''| at v are (taylor*exp(-beta*v)).sum(axis = 1) + (mu, 0, 0), |g''| only decaying
+        taylor = np.stack([x, -1*self.safeDecays*x, self.safeDecays**2*np.abs(x)])
+        # past V_j the g_j with a positive baseline is positive: its negative part is below the baseline
+        negative = np.maximum(-1*x, 0)
+        Nsum = negative.sum(axis = 0)
+        slowest = np.where(negative > 0, self.safeDecays, np.inf).min(axis = 0)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            V = np.where(mu > 0, np.where(Nsum > mu, np.log(Nsum/np.maximum(mu, 1e-300))/slowest, 0.), np.inf)
+        V[~active] = 0
+        a, walked = 0., 0.
+        while a < horizon:
+            undecided = V > a
+            if not np.any(undecided):
+                b, positive = horizon, active
+            else:
+                g, dg, M = (taylor*np.exp(-1*self.safeDecays*a)).sum(axis = 1)
+                g += mu
+                sign = np.sign(g)
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    # |g(a + w)| >= |g| + sign*dg*w - M*w**2/2 > 0 for w below its positive root
+                    w = np.where(M > 0, (sign*dg + np.sqrt(dg**2 + 2*M*np.abs(g)))/M, np.inf)
+                    # g_j is at a root up to tol (or exactly, where sign is 0), it takes the sign of its derivative
+                    crossing = (w <= self.tol) | (sign == 0)
+                    sign = np.where(crossing, np.sign(dg), sign)
+                    w = np.where(crossing, np.where(M > 0, 2*np.abs(dg)/M, np.inf), w)
+                w = np.where(undecided & active, np.maximum(w, self.tol), np.inf)
+                b = min(horizon, a + float(np.min(w)))
+                positive = active & (~undecided | (sign > 0))
+            cPos = np.where(positive, c, 0.)
+            total = self._integral(xOverDecays, cPos, mu, a, b, np.exp(-1*self.safeDecays*a))[0]
+            if total >= E:
+                return self._solve(x, xOverDecays, cPos, mu, a, b, E), 0.
+            E -= total
+            a = b
+            walked += total
+        return None, walked
+
+    def compensator(self, t):
+        """Integrated total intensity from self.s to t >= self.s given no point in between, split at the TOD bin ends"""
+        total = 0.
+        s = self.s
+        while s < t:
+            end = min(t, self.todtable.binend(s))
+            total += self._walk(s, end - s, np.inf)[1]
+            s = end
+        return total
+
+    def addpoint(self, s, k):
+        """Moves to time s >= self.s and adds a point of type k as simulate does. Returns its tau"""
+        if k in [5, 6]:
+            self._setspreadmult(self.spread-0.01) # the baselines keep the old spread until the caller calls setspread
+        self.s = s
+        self.accepted += 1
+        return self._record(s, k)
+
+    def simulate(self, T, maxJumps = None, stopEvents = ()):
+        """
+        Generates points until s > T, maxJumps points were generated or a point in stopEvents was generated.
+        Returns the list of (s, k, tau) where tau is the integrated baseline since the previous point of type k.
+        """
+        events = []
+        rng = self.rng
+        prof = self.profiler
+        todtable = self.todtable
+        while self.s<=T:
+            if prof is not None: t0 = prof.clock()
+            stop = False
+            binEnd = todtable.binend(self.s)
+            v = self._walk(self.s, binEnd - self.s, -1*np.log(rng.uniform(0, 1)))[0]
+            if v is None:
+                self.s = binEnd # no point in this TOD bin
+                if prof is not None: prof.add("candidate", prof.clock() - t0)
+                continue
+            s = self.s + v
+            if prof is not None:
+                t1 = prof.clock()
+                prof.add("candidate", t1 - t0)
+            hourIndex, todmult, decays = self._intensities(s)
+            self.lamb = float(decays.sum())
+            self.candidates += 1
+            if prof is not None:
+                t0 = prof.clock()
+                prof.add("intensity", t0 - t1)
+
+            """Assigning the point to a process by a ratio of intensities"""
+            D=rng.uniform(0, 1)
+            k = min(int(np.searchsorted(np.cumsum(decays[:, 0]), D*self.lamb, side = 'right')), self.num_nodes - 1)
+            events.append((s, k, self.addpoint(s, k)))
+            stop = (k in stopEvents) or ((maxJumps is not None) and (len(events)>=maxJumps))
+            if prof is not None: prof.add("acceptance", prof.clock() - t0)
+            if stop: break
+        return events
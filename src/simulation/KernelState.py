@@ -0,0 +1,106 @@
+import numpy as np
+
+from simulation.functions import powerLawCutoffSumExp
+
+class ExpKernelState:
+    """
+    Recursive excitation state for the exponential kernel phi_ij(t) = mask_ij*alpha_ij*exp(-beta_ij*t).
+
+    state[i][j] holds the decayed sum of phi_ij over every past point of type i, so the cross excitation
+    felt by dimension j at time s is state[:, j].sum(). Moving the state forward by dt is one elementwise
+    multiply of the [num_nodes, num_nodes] matrix and adding a point of type k adds phi_k.(0) to row k, so
+    each candidate costs O(num_nodes**2) regardless of how many points are in the history.
+
+    Arguments:
+    kernelparams: [mask, alpha, beta] as returned in params[0] by Simulate.preprocessdata(kernel='exp')
+    num_nodes: #of different processes
+    s: time the state starts at
+    """
+    def __init__(self, kernelparams, num_nodes=12, s=0):
+        self.num_nodes = num_nodes
+        self.jumps = kernelparams[0]*kernelparams[1] # phi_ij(0)
+        self.decays = kernelparams[2]
+        self.state = np.zeros((num_nodes, num_nodes))
+        self.s = s
+
+    def advance(self, s):
+        """Decays the state from self.s to time s"""
+        dt = s - self.s
+        if dt > 0:
+            self.state *= np.exp(-1*self.decays*dt)
+        self.s = s
+
+    def excitation(self, s):
+        """Returns the (num_nodes, 1) vector of kernel sums at time s"""
+        self.advance(s)
+        return self.state.sum(axis=0).reshape((self.num_nodes, 1))
+
+    def excitatory(self, s):
+        """Returns the (num_nodes, 1) vector of kernel sums at time s restricted to the excitatory (positive) kernels, which only decays until the next point"""
+        self.advance(s)
+        return np.maximum(self.state, 0).sum(axis=0).reshape((self.num_nodes, 1))
+
+    def addpoint(self, s, k):
+        """Registers a point of type k at time s"""
+        self.advance(s)
+        self.state[k] += self.jumps[k]
+
+    @classmethod
+    def fromhistory(cls, kernelparams, timeseries, s, num_nodes=12):
+        """Builds the state at time s from a timeseries of (t, k) points"""
+        kernelstate = cls(kernelparams, num_nodes=num_nodes, s=s)
+        for point in timeseries:
+            kernelstate.state[point[1]] += kernelstate.jumps[point[1]]*np.exp(-1*kernelstate.decays[point[1]]*(s - point[0]))
+        return kernelstate
+
+class SumExpKernelState(ExpKernelState):
+    """
+    Recursive excitation state for the power law with cutoff phi_ij(t) = mask_ij*alpha_ij/(1 + gamma_ij*t)**beta_ij.
+
+    The power law has no recursive update, so each of the [num_nodes, num_nodes] kernels is replaced by a fitted
+    sum of numTerms exponentials (see functions.powerLawCutoffSumExp) and one ExpKernelState-like matrix is carried
+    per term. Each candidate then costs O(numTerms*num_nodes**2).
+
+    Arguments:
+    kernelparams: [mask, alpha, beta, gamma] as returned in params[0] by Simulate.preprocessdata(kernel='powerlaw')
+    numTerms: number of exponentials per kernel. If None, chosen per kernel to meet tol
+    tol: target max relative error of each fitted kernel over [0, horizon]
+    horizon: time range (in seconds) the kernels are fitted on
+    """
+    def __init__(self, kernelparams, num_nodes=12, s=0, numTerms=None, tol=1e-2, horizon=10.):
+        mask, alpha, beta, gamma = kernelparams[0], kernelparams[1], kernelparams[2], kernelparams[3]
+        fits = {}
+        for i in range(num_nodes):
+            for j in range(num_nodes):
+                if (mask[i][j]*alpha[i][j] == 0) or np.isnan(gamma[i][j]): continue
+                fits[(i, j)] = powerLawCutoffSumExp((mask[i][j]*alpha[i][j], beta[i][j], gamma[i][j]), numTerms=numTerms, tol=tol, horizon=horizon)
+        M = max([len(fit[0]) for fit in fits.values()] + [1])
+        self.num_nodes = num_nodes
+        self.jumps = np.zeros((M, num_nodes, num_nodes)) # kernels fitted with fewer terms are padded with zero weights
+        self.decays = np.zeros((M, num_nodes, num_nodes))
+        self.errors = np.zeros((num_nodes, num_nodes))
+        for (i, j), (weights, rates, err) in fits.items():
+            self.jumps[:len(weights), i, j] = weights
+            self.decays[:len(rates), i, j] = rates
+            self.errors[i][j] = err
+        self.state = np.zeros((M, num_nodes, num_nodes))
+        self.s = s
+
+    def excitation(self, s):
+        self.advance(s)
+        return self.state.sum(axis=(0, 1)).reshape((self.num_nodes, 1))
+
+    def excitatory(self, s):
+        self.advance(s)
+        return np.maximum(self.state, 0).sum(axis=(0, 1)).reshape((self.num_nodes, 1))
+
+    def addpoint(self, s, k):
+        self.advance(s)
+        self.state[:, k] += self.jumps[:, k]
+
+    @classmethod
+    def fromhistory(cls, kernelparams, timeseries, s, num_nodes=12, numTerms=None, tol=1e-2, horizon=10.):
+        kernelstate = cls(kernelparams, num_nodes=num_nodes, s=s, numTerms=numTerms, tol=tol, horizon=horizon)
+        for point in timeseries:
+            kernelstate.state[:, point[1]] += kernelstate.jumps[:, point[1]]*np.exp(-1*kernelstate.decays[:, point[1]]*(s - point[0]))
+        return kernelstate
@@ -0,0 +1,608 @@
+import numpy as np
+
+LEVELS = ["Ask_deep", "Ask_touch", "Bid_touch", "Bid_deep"]
+WIDTHS = ["Ask_m_D", "Ask_m_T", "Bid_m_T", "Bid_m_D"] # #of ticks spanned by each level of the small tick book
+COLS = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
+        "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
+
+LO_DEEP, LO_TOP, LO_INSPREAD, MO, CO_DEEP, CO_TOP = range(6)
+
+def _decode(col):
+    """Maps an event name to (kind, touch level, deep level, outward direction)"""
+    if "Ask" in col:
+        touch, deep, out = 1, 0, 1
+    else:
+        touch, deep, out = 2, 3, -1
+    if "lo" in col:
+        kind = LO_DEEP if "deep" in col else (LO_TOP if "top" in col else LO_INSPREAD)
+    elif "mo" in col:
+        kind = MO
+    else:
+        kind = CO_DEEP if "deep" in col else CO_TOP
+    return kind, touch, deep, out
+
+EVENTS = tuple(_decode(col) for col in COLS)
+
+class LOBState:
+    """
+    Array backed two level (touch + deep) limit order book, updated in place by the 12 event types of the simulator.
+
+    price[l], size[l] hold the L2 book and queues[l, :counts[l]] the L3 queue of level l, with l indexing LEVELS.
+    The transitions are the ones of Simulate.createLOB: lo events join the back of a queue (inspread ones open a new
+    touch and push the old touch to deep), mo events eat the touch queue in FIFO order and walk the book on depletion,
+    co events cancel a uniformly chosen order of the queue, and depleted deep levels are refilled from Pi_Q0.
+
+    Arguments:
+    samplers: dictionary of OrderSizeSampler keyed by level, as built from Pi_Q0
+    ticksize: price increment between levels
+    numOrdersPerLevel: #of orders a refilled deep queue is split into
+    rng: np.random.Generator or RandomState used to pick cancelled orders, the global np.random by default
+    capacity: initial length of each L3 queue, grown as needed
+    """
+    __slots__ = ("price", "size", "queues", "counts", "samplers", "ticksize", "numOrdersPerLevel", "rng", "randint")
+
+    def __init__(self, samplers, ticksize = 0.01, numOrdersPerLevel = 10, rng = None, capacity = 64):
+        self.price = np.zeros(len(LEVELS))
+        self.size = np.zeros(len(LEVELS), dtype = np.int64)
+        self.queues = np.zeros((len(LEVELS), capacity), dtype = np.int64)
+        self.counts = np.zeros(len(LEVELS), dtype = np.int64)
+        self.samplers = samplers
+        self.ticksize = ticksize
+        self.numOrdersPerLevel = numOrdersPerLevel
+        self.rng = np.random if rng is None else rng
+        self.randint = self.rng.integers if isinstance(self.rng, np.random.Generator) else self.rng.randint
+
+    @classmethod
+    def fromprices(cls, samplers, priceMid0 = 260, spread0 = 4, ticksize = 0.01, numOrdersPerLevel = 10, rng = None, numOrdersPerLevel0 = None):
+        """Builds the initial book around priceMid0 with queue sizes drawn from samplers, split into numOrdersPerLevel0 (default numOrdersPerLevel) orders"""
+        if numOrdersPerLevel0 is None: numOrdersPerLevel0 = numOrdersPerLevel
+        state = cls(samplers, ticksize = ticksize, numOrdersPerLevel = numOrdersPerLevel, rng = rng)
+        state.price[1] = priceMid0 + np.floor(spread0/2)*ticksize
+        state.price[2] = priceMid0 - np.ceil(spread0/2)*ticksize
+        state.price[0] = priceMid0 + np.floor(spread0/2)*ticksize + ticksize
+        state.price[3] = priceMid0 - np.ceil(spread0/2)*ticksize - ticksize
+        for k in samplers.keys():
+            state.size[LEVELS.index(k)] = samplers[k].sample()
+        for l in range(len(LEVELS)):
+            state._split(l, numOrdersPerLevel0)
+        return state
+
+    @classmethod
+    def fromdicts(cls, lob0, lob0_l3, samplers, ticksize = 0.01, numOrdersPerLevel = 10, rng = None):
+        """Builds the book from the {level: (price, size)} and {level: [orders]} dictionaries used by createLOB"""
+        state = cls(samplers, ticksize = ticksize, numOrdersPerLevel = numOrdersPerLevel, rng = rng)
+        for l, level in enumerate(LEVELS):
+            state.price[l] = lob0[level][0]
+            state.size[l] = lob0[level][1]
+            state._setqueue(l, lob0_l3[level])
+        return state
+
+    def todict(self):
+        """L2 snapshot as {level: (price, size)}"""
+        return {level: (self.price[l], int(self.size[l])) for l, level in enumerate(LEVELS)}
+
+    def tol3dict(self):
+        """L3 snapshot as {level: [orders]}"""
+        return {level: self.queues[l, :self.counts[l]].tolist() for l, level in enumerate(LEVELS)}
+
+    def spread(self):
+        return self.price[1] - self.price[2]
+
+    def getstate(self):
+        """Copy of the book arrays, to restore with setstate"""
+        return {"price": self.price.copy(), "size": self.size.copy(), "queues": self.queues.copy(), "counts": self.counts.copy()}
+
+    def setstate(self, state):
+        self.price = state["price"].copy()
+        self.size = state["size"].copy()
+        self.queues = state["queues"].copy()
+        self.counts = state["counts"].copy()
+
+    def apply(self, k, size):
+        """Applies one event of type COLS[k] with the given size (ignored for co events). Returns the size of the order, i.e. the cancelled one for co events"""
+        kind, touch, deep, out = EVENTS[k]
+        ticksize = self.ticksize
+        if kind == LO_DEEP:
+            if np.abs(self.price[touch] - self.price[deep]) > 2.5*ticksize:
+                self.price[deep] = np.round(self.price[touch] + out*ticksize, decimals=2)
+                self.size[deep] = size
+                self._setqueue(deep, (size,))
+            else:
+                self.size[deep] += size
+                self._push(deep, size)
+        elif kind == LO_TOP:
+            self.size[touch] += size
+            self._push(touch, size)
+        elif kind == LO_INSPREAD:
+            self.price[deep] = self.price[touch]
+            self.size[deep] = self.size[touch]
+            self._copyqueue(touch, deep)
+            self.price[touch] = np.round(self.price[touch] - out*ticksize, decimals=2)
+            self.size[touch] = size
+            self._setqueue(touch, (size,))
+        elif kind == MO:
+            self.size[touch] -= size
+            if self.size[touch] > 0:
+                self._consume(touch, size)
+            while self.size[touch] <= 0: # queue depletion
+                extraVolume = -1*self.size[touch]
+                self.price[touch] = self.price[deep]
+                self.size[touch] = self.size[deep] - extraVolume
+                self._copyqueue(deep, touch)
+                if (self.size[touch] > 0) and (extraVolume > 0):
+                    self._consume(touch, extraVolume, dropzeros = True)
+                self._refill(deep, out, self.numOrdersPerLevel)
+        else:
+            level = deep if kind == CO_DEEP else touch
+            n = self.counts[level]
+            size = self.queues[level, self.randint(0, n)]
+            self.size[level] -= size
+            self._remove(level, size)
+            if self.size[touch] <= 0: # queue depletion
+                self.price[touch] = self.price[deep]
+                self.size[touch] = self.size[deep]
+                self._copyqueue(deep, touch)
+                self._refill(deep, out, self.numOrdersPerLevel)
+            if self.size[deep] <= 0: # queue depletion
+                self._refill(deep, out, 2*self.numOrdersPerLevel)
+        return size
+
+    def _refill(self, l, out, m):
+        """Moves level l one tick outwards with a fresh queue split into m orders"""
+        self.price[l] = np.round(self.price[l] + out*self.ticksize, decimals=2)
+        self.size[l] = self.samplers[LEVELS[l]].sample()
+        self._split(l, m)
+
+    def _split(self, l, m):
+        q = self.size[l]
+        tmp = q//m
+        self._reserve(l, m)
+        self.queues[l, 0] = q - (m - 1)*tmp
+        self.queues[l, 1:m] = tmp
+        self.counts[l] = m
+
+    def _consume(self, l, volume, dropzeros = False):
+        """Removes volume from the front of queue l"""
+        n = self.counts[l]
+        q = self.queues[l]
+        cumsum = np.cumsum(q[:n])
+        idx = np.argmax(cumsum >= volume)
+        q[:n - idx] = q[idx:n]
+        q[0] = cumsum[idx] - volume
+        n -= idx
+        if dropzeros:
+            keep = q[:n][q[:n] > 0]
+            n = len(keep)
+            q[:n] = keep
+        self.counts[l] = n
+
+    def _remove(self, l, value):
+        """Removes the first order of queue l equal to value"""
+        n = self.counts[l]
+        q = self.queues[l]
+        idx = np.argmax(q[:n] == value)
+        q[idx:n - 1] = q[idx + 1:n]
+        self.counts[l] = n - 1
+
+    def _push(self, l, value):
+        n = self.counts[l]
+        self._reserve(l, n + 1)
+        self.queues[l, n] = value
+        self.counts[l] = n + 1
+
+    def _setqueue(self, l, values):
+        n = len(values)
+        self._reserve(l, n)
+        self.queues[l, :n] = values
+        self.counts[l] = n
+
+    def _copyqueue(self, src, dst):
+        n = self.counts[src]
+        self._reserve(dst, n)
+        self.queues[dst, :n] = self.queues[src, :n]
+        self.counts[dst] = n
+
+    def _reserve(self, l, n):
+        capacity = self.queues.shape[1]
+        if n > capacity:
+            queues = np.zeros((len(LEVELS), max(n, 2*capacity)), dtype = np.int64)
+            queues[:, :capacity] = self.queues
+            self.queues = queues
+
+class SmallTickLOBState:
+    """
+    Array backed touch + deep book of the small tick model, updated in place by the 12 event types of the simulator.
+
+    price[l], size[l] hold the L2 book with l indexing LEVELS as in LOBState, and width[l] the #of ticks level l spans
+    (WIDTHS): width[touch] is the distance m_T from the touch to the first deep price, width[deep] the width m_D of the
+    deep bucket, whose size is the volume over the whole bucket. The transitions are the ones of the small tick model
+    (backup/hawkes/simulate_smalltick.createLOB_smallTick): lo_top orders land eta_T ticks behind the touch, inspread
+    ones eta_IS ticks inside the spread, and a depleted touch is refilled from the first eta_T+1 ticks of the deep
+    bucket, the depth of the book (spread/2 + m_T + m_D) being kept around M_med ticks. Widths and eta are geometric,
+    drawn from widthSamplers (keys m_T, m_D) and etaSamplers (keys eta_T, eta_IS, eta_T+1). There is no L3 queue, so
+    cancel orders carry their own size.
+
+    Arguments:
+    samplers: dictionary of OrderSizeSampler keyed by level, as built from Pi_Q0
+    widthSamplers, etaSamplers: dictionaries of OrderSizeSampler of the widths and eta, see Simulate.widthdistributions
+    ticksize: price increment between ticks
+    M_med: depth of the book in ticks
+    """
+    __slots__ = ("price", "size", "width", "samplers", "widthSamplers", "etaSamplers", "ticksize", "M_med")
+
+    def __init__(self, samplers, widthSamplers, etaSamplers, ticksize = 0.01, M_med = 100):
+        self.price = np.zeros(len(LEVELS))
+        self.size = np.zeros(len(LEVELS), dtype = np.int64)
+        self.width = np.zeros(len(LEVELS), dtype = np.int64)
+        self.samplers = samplers
+        self.widthSamplers = widthSamplers
+        self.etaSamplers = etaSamplers
+        self.ticksize = ticksize
+        self.M_med = M_med
+
+    @classmethod
+    def fromprices(cls, samplers, widthSamplers, etaSamplers, priceMid0 = 260, spread0 = 4, ticksize = 0.01, M_med = 100):
+        """Builds the initial book around priceMid0 with widths drawn from widthSamplers and queue sizes from samplers, a deep bucket holding m_D queues"""
+        state = cls(samplers, widthSamplers, etaSamplers, ticksize = ticksize, M_med = M_med)
+        for touch, deep in ((1, 0), (2, 3)):
+            state.width[touch] = widthSamplers["m_T"].sample()
+            state.width[deep] = widthSamplers["m_D"].sample()
+        state.price[1] = priceMid0 + np.floor(spread0/2)*ticksize
+        state.price[2] = priceMid0 - np.ceil(spread0/2)*ticksize
+        state.price[0] = state.price[1] + state.width[1]*ticksize
+        state.price[3] = state.price[2] - state.width[2]*ticksize
+        for k in samplers.keys():
+            l = LEVELS.index(k)
+            state.size[l] = samplers[k].sample()*(state.width[l] if "deep" in k else 1)
+        return state
+
+    def todict(self):
+        """L2 snapshot as {level: (price, size)} and {width: #of ticks}"""
+        lob = {level: (self.price[l], int(self.size[l])) for l, level in enumerate(LEVELS)}
+        lob.update({width: int(self.width[l]) for l, width in enumerate(WIDTHS)})
+        return lob
+
+    def tol3dict(self):
+        """None, the small tick book has no L3 queues"""
+        return None
+
+    def spread(self):
+        return self.price[1] - self.price[2]
+
+    def getstate(self):
+        """Copy of the book arrays, to restore with setstate"""
+        return {"price": self.price.copy(), "size": self.size.copy(), "width": self.width.copy()}
+
+    def setstate(self, state):
+        self.price = state["price"].copy()
+        self.size = state["size"].copy()
+        self.width = state["width"].copy()
+
+    def apply(self, k, size):
+        """Applies one event of type COLS[k] with the given size. Returns the size of the order"""
+        kind, touch, deep, out = EVENTS[k]
+        ticksize = self.ticksize
+        price, volume, width = self.price, self.size, self.width
+        if kind == LO_DEEP:
+            volume[deep] += size
+        elif kind == LO_TOP:
+            eta = min(width[touch], self.etaSamplers["eta_T"].sample()) - 1
+            if eta != 0: # order between the touch and the deep bucket, which now starts at it
+                width[deep] += width[touch] - eta
+                price[deep] = np.round(price[deep] + out*ticksize*(eta - width[touch]), decimals=2)
+                volume[deep] += size
+                width[touch] = eta
+            else:
+                volume[touch] += size
+        elif kind == LO_INSPREAD:
+            spread = self._spreadticks()
+            eta = min(spread - 1, self.etaSamplers["eta_IS"].sample())
+            depth = width[touch] + width[deep] + 0.5*spread
+            oldWidth, oldSize = width[touch], volume[touch]
+            width[touch] = eta
+            price[touch] = np.round(price[touch] - out*ticksize*eta, decimals=2)
+            volume[touch] = size
+            spread = self._spreadticks()
+            if depth + 0.5*eta <= self.M_med: # the old touch joins the deep bucket
+                width[deep] += oldWidth
+                price[deep] = np.round(price[deep] - out*ticksize*oldWidth, decimals=2)
+                volume[deep] += oldSize
+            else: # and the far end of the bucket is cut to keep the depth at M_med
+                half = np.round(0.5*spread)
+                deleted = min(width[deep], width[deep] - self.M_med + half + eta + oldWidth)
+                removed = self._partition(volume[deep], deleted, width[deep])
+                width[deep] = max(1, self.M_med - half - width[touch])
+                price[deep] = np.round(price[touch] + out*ticksize*width[touch], decimals=2)
+                volume[deep] += oldSize - removed
+                if volume[deep] == 0:
+                    volume[deep] = self.samplers[LEVELS[deep]].sample()
+        elif kind == CO_DEEP:
+            volume[deep] = max(0, volume[deep] - size)
+            self._refill(touch, deep, volume[deep] <= 0)
+        else:
+            volume[touch] -= size
+            while volume[touch] <= 0: # queue depletion, the touch moves to the front of the deep bucket
+                if kind == CO_TOP: volume[touch] = 0 # a cancel can not eat more than the queue
+                extraVolume = -1*volume[touch]
+                eta = min(width[deep], self.etaSamplers["eta_T+1"].sample())
+                moved = self._partition(volume[deep], eta, width[deep])
+                price[touch] = price[deep]
+                volume[touch] = moved - extraVolume
+                width[touch] = eta
+                width[deep] -= eta
+                price[deep] = np.round(price[touch] + out*ticksize*eta, decimals=2)
+                volume[deep] -= moved
+                self._refill(touch, deep, volume[deep] == 0)
+        return size
+
+    def _spreadticks(self):
+        return round(float(self.price[1] - self.price[2])/self.ticksize)
+
+    def _partition(self, q, newWidth, width):
+        """Volume of newWidth of the width ticks of a bucket holding q"""
+        return int(np.round(q*newWidth/width))
+
+    def _refill(self, touch, deep, empty):
+        """Redraws an empty deep bucket: a fresh one of width m_D while the book is shallower than M_med, a single tick otherwise"""
+        volume, width = self.size, self.width
+        depth = width[touch] + width[deep] + np.round(0.5*self._spreadticks())
+        if (depth <= self.M_med) and empty: # go deeper
+            width[deep] = min(self.M_med - depth, self.widthSamplers["m_D"].sample())
+            volume[deep] = width[deep]*self.samplers[LEVELS[deep]].sample()
+        if volume[deep] == 0: # even at the M_med limit keep one deep tick
+            volume[deep] = self.samplers[LEVELS[deep]].sample()
+            width[deep] = 1
+
+class MultiLOBState:
+    """
+    The LOBState book of numPaths independent paths, held in 2-D arrays and updated for many paths at once.
+
+    price[p, l], size[p, l] hold the L2 book of path p and queues[p, l, :counts[p, l]] its L3 queues, with l indexing
+    LEVELS. apply takes one event per path for any subset of paths and applies the transitions of LOBState.apply to all
+    of them with array operations: the paths are grouped by event type, so each group shares its levels and direction,
+    and the queue shifts of the FIFO consumption and of the cancellations are gathers along the queue axis. The depth
+    walk of a market order that depletes several levels loops over the depletions, not over the paths.
+
+    Arguments:
+    numPaths: #of paths
+    samplers, ticksize, numOrdersPerLevel, capacity: see LOBState. Each sampler draws for all the refilled paths at once
+    rng: np.random.Generator or RandomState used to pick cancelled orders, the global np.random by default
+    """
+    __slots__ = ("price", "size", "queues", "counts", "samplers", "ticksize", "numOrdersPerLevel", "rng", "randint")
+
+    def __init__(self, numPaths, samplers, ticksize = 0.01, numOrdersPerLevel = 10, rng = None, capacity = 64):
+        self.price = np.zeros((numPaths, len(LEVELS)))
+        self.size = np.zeros((numPaths, len(LEVELS)), dtype = np.int64)
+        self.queues = np.zeros((numPaths, len(LEVELS), capacity), dtype = np.int64)
+        self.counts = np.zeros((numPaths, len(LEVELS)), dtype = np.int64)
+        self.samplers = samplers
+        self.ticksize = ticksize
+        self.numOrdersPerLevel = numOrdersPerLevel
+        self.rng = np.random if rng is None else rng
+        self.randint = self.rng.integers if isinstance(self.rng, np.random.Generator) else self.rng.randint
+
+    @classmethod
+    def fromprices(cls, numPaths, samplers, priceMid0 = 260, spread0 = 4, ticksize = 0.01, numOrdersPerLevel = 10, rng = None, numOrdersPerLevel0 = None):
+        """Builds numPaths initial books as LOBState.fromprices, with independent queue sizes"""
+        if numOrdersPerLevel0 is None: numOrdersPerLevel0 = numOrdersPerLevel
+        state = cls(numPaths, samplers, ticksize = ticksize, numOrdersPerLevel = numOrdersPerLevel, rng = rng)
+        state.price[:, 1] = priceMid0 + np.floor(spread0/2)*ticksize
+        state.price[:, 2] = priceMid0 - np.ceil(spread0/2)*ticksize
+        state.price[:, 0] = priceMid0 + np.floor(spread0/2)*ticksize + ticksize
+        state.price[:, 3] = priceMid0 - np.ceil(spread0/2)*ticksize - ticksize
+        paths = np.arange(numPaths)
+        for k in samplers.keys():
+            state.size[:, LEVELS.index(k)] = samplers[k].sample(numPaths)
+        for l in range(len(LEVELS)):
+            state._split(paths, l, numOrdersPerLevel0)
+        return state
+
+    def path(self, p):
+        """LOBState copy of the book of path p"""
+        state = LOBState(self.samplers, ticksize = self.ticksize, numOrdersPerLevel = self.numOrdersPerLevel, rng = self.rng, capacity = self.queues.shape[2])
+        state.setstate({"price": self.price[p], "size": self.size[p], "queues": self.queues[p], "counts": self.counts[p]})
+        return state
+
+    def spread(self):
+        return self.price[:, 1] - self.price[:, 2]
+
+    def apply(self, paths, ks, sizes):
+        """
+        Applies event ks[i] with size sizes[i] (ignored for co events) to the book of paths[i], paths being distinct.
+        Returns the sizes of the orders, i.e. the cancelled ones for co events
+        """
+        sizes = np.array(sizes, dtype = np.int64)
+        for k in np.unique(ks):
+            group = ks == k
+            sizes[group] = self._applyevent(paths[group], k, sizes[group])
+        return sizes
+
+    def _applyevent(self, r, k, size):
+        """LOBState.apply of event type k on the paths r"""
+        kind, touch, deep, out = EVENTS[k]
+        ticksize = self.ticksize
+        price, sizes = self.price, self.size
+        if kind == LO_DEEP:
+            far = np.abs(price[r, touch] - price[r, deep]) > 2.5*ticksize
+            f, n = r[far], r[~far]
+            price[f, deep] = np.round(price[f, touch] + out*ticksize, decimals=2)
+            sizes[f, deep] = size[far]
+            self._setqueue(f, deep, size[far])
+            sizes[n, deep] += size[~far]
+            self._push(n, deep, size[~far])
+        elif kind == LO_TOP:
+            sizes[r, touch] += size
+            self._push(r, touch, size)
+        elif kind == LO_INSPREAD:
+            price[r, deep] = price[r, touch]
+            sizes[r, deep] = sizes[r, touch]
+            self._copyqueue(r, touch, deep)
+            price[r, touch] = np.round(price[r, touch] - out*ticksize, decimals=2)
+            sizes[r, touch] = size
+            self._setqueue(r, touch, size)
+        elif kind == MO:
+            sizes[r, touch] -= size
+            left = sizes[r, touch] > 0
+            self._consume(r[left], touch, size[left])
+            depleted = r[sizes[r, touch] <= 0]
+            while len(depleted): # queue depletion
+                extraVolume = -1*sizes[depleted, touch]
+                price[depleted, touch] = price[depleted, deep]
+                sizes[depleted, touch] = sizes[depleted, deep] - extraVolume
+                self._copyqueue(depleted, deep, touch)
+                eat = (sizes[depleted, touch] > 0) & (extraVolume > 0)
+                self._consume(depleted[eat], touch, extraVolume[eat], dropzeros = True)
+                self._refill(depleted, deep, out, self.numOrdersPerLevel)
+                depleted = depleted[sizes[depleted, touch] <= 0]
+        else:
+            level = deep if kind == CO_DEEP else touch
+            size = self.queues[r, level, self.randint(0, self.counts[r, level])]
+            sizes[r, level] -= size
+            self._remove(r, level, size)
+            depleted = r[sizes[r, touch] <= 0]
+            if len(depleted): # queue depletion
+                price[depleted, touch] = price[depleted, deep]
+                sizes[depleted, touch] = sizes[depleted, deep]
+                self._copyqueue(depleted, deep, touch)
+                self._refill(depleted, deep, out, self.numOrdersPerLevel)
+            depleted = r[sizes[r, deep] <= 0]
+            if len(depleted): # queue depletion
+                self._refill(depleted, deep, out, 2*self.numOrdersPerLevel)
+        return size
+
+    def _refill(self, r, l, out, m):
+        """Moves level l of the paths r one tick outwards with fresh queues split into m orders"""
+        self.price[r, l] = np.round(self.price[r, l] + out*self.ticksize, decimals=2)
+        self.size[r, l] = self.samplers[LEVELS[l]].sample(len(r))
+        self._split(r, l, m)
+
+    def _split(self, r, l, m):
+        q = self.size[r, l]
+        tmp = q//m
+        self._reserve(m)
+        self.queues[r, l, 0] = q - (m - 1)*tmp
+        self.queues[r, l, 1:m] = tmp[:, None]
+        self.counts[r, l] = m
+
+    def _consume(self, r, l, volume, dropzeros = False):
+        """Removes volume[i] from the front of queue l of path r[i]"""
+        if len(r) == 0: return
+        n = self.counts[r, l]
+        q = self.queues[r, l]
+        slots = np.arange(q.shape[1])
+        cumsum = np.cumsum(np.where(slots < n[:, None], q, 0), axis = 1)
+        idx = np.argmax(cumsum >= volume[:, None], axis = 1)
+        q = np.take_along_axis(q, np.minimum(idx[:, None] + slots, q.shape[1] - 1), axis = 1)
+        q[:, 0] = cumsum[np.arange(len(r)), idx] - volume
+        n = n - idx
+        if dropzeros:
+            keep = (q > 0) & (slots < n[:, None])
+            q = np.take_along_axis(q, np.argsort(~keep, axis = 1, kind = "stable"), axis = 1)
+            n = keep.sum(axis = 1)
+        self.queues[r, l] = q
+        self.counts[r, l] = n
+
+    def _remove(self, r, l, value):
+        """Removes the first order equal to value[i] from queue l of path r[i]"""
+        n = self.counts[r, l]
+        q = self.queues[r, l]
+        slots = np.arange(q.shape[1])
+        idx = np.argmax((q == value[:, None]) & (slots < n[:, None]), axis = 1)
+        self.queues[r, l] = np.take_along_axis(q, np.minimum(slots + (slots >= idx[:, None]), q.shape[1] - 1), axis = 1)
+        self.counts[r, l] = n - 1
+
+    def _push(self, r, l, value):
+        if len(r) == 0: return
+        n = self.counts[r, l]
+        self._reserve(n.max() + 1)
+        self.queues[r, l, n] = value
+        self.counts[r, l] = n + 1
+
+    def _setqueue(self, r, l, value):
+        """Replaces queue l of the paths r by a single order of size value"""
+        self.queues[r, l, 0] = value
+        self.counts[r, l] = 1
+
+    def _copyqueue(self, r, src, dst):
+        self.queues[r, dst] = self.queues[r, src]
+        self.counts[r, dst] = self.counts[r, src]
+
+    def _reserve(self, n):
+        capacity = self.queues.shape[2]
+        if n > capacity:
+            queues = np.zeros(self.queues.shape[:2] + (max(n, 2*capacity),), dtype = np.int64)
+            queues[:, :, :capacity] = self.queues
+            self.queues = queues
+
+class SnapshotBuffer:
+    """
+    Columnar ring buffer of L2 snapshots: t, event (index into COLS, -1 for an initial book), tau, orderSize and the
+    price / size of each level in LEVELS.
+
+    When the buffer is full it hands its rows to onflush as a dictionary of arrays and starts over. Without onflush it
+    keeps the latest capacity rows, overwriting the oldest. With widths the width of each level (WIDTHS) of a
+    SmallTickLOBState is kept as well.
+    """
+    __slots__ = ("capacity", "t", "event", "tau", "orderSize", "price", "size", "width", "n", "start", "onflush")
+
+    def __init__(self, capacity = 4096, onflush = None, widths = False):
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        self.event = np.zeros(capacity, dtype = np.int8)
+        self.tau = np.zeros(capacity)
+        self.orderSize = np.zeros(capacity, dtype = np.int64)
+        self.price = np.zeros((capacity, len(LEVELS)))
+        self.size = np.zeros((capacity, len(LEVELS)), dtype = np.int64)
+        self.width = np.zeros((capacity, len(LEVELS)), dtype = np.int64) if widths else None
+        self.n = 0
+        self.start = 0
+        self.onflush = onflush
+
+    def append(self, t, event, tau, lobstate, orderSize = 0):
+        if self.n == self.capacity:
+            if self.onflush is not None:
+                self.flush()
+            else:
+                self.start = (self.start + 1) % self.capacity
+                self.n -= 1
+        i = (self.start + self.n) % self.capacity
+        self.t[i] = t
+        self.event[i] = event
+        self.tau[i] = tau
+        self.orderSize[i] = orderSize
+        self.price[i] = lobstate.price
+        self.size[i] = lobstate.size
+        if self.width is not None: self.width[i] = lobstate.width
+        self.n += 1
+
+    def columns(self):
+        """Copies of the buffered rows, oldest first"""
+        idx = (self.start + np.arange(self.n)) % self.capacity
+        chunk = {"t": self.t[idx], "event": self.event[idx], "tau": self.tau[idx], "orderSize": self.orderSize[idx], "price": self.price[idx], "size": self.size[idx]}
+        if self.width is not None: chunk["width"] = self.width[idx]
+        return chunk
+
+    def load(self, chunk):
+        """Replaces the buffered rows by those of a columns() chunk"""
+        n = len(chunk["t"])
+        for name, values in chunk.items():
+            getattr(self, name)[:n] = values
+        self.n = n
+        self.start = 0
+
+    def flush(self):
+        """Hands the buffered rows to onflush and empties the buffer"""
+        if self.n > 0 and self.onflush is not None:
+            self.onflush(self.columns())
+        self.n = 0
+        self.start = 0
+
+    @staticmethod
+    def todicts(chunk):
+        """Converts a chunk of columns into the (Ts, lob) lists returned by Simulate.run"""
+        Ts = [0 if e < 0 else [COLS[e], t, tau] for e, t, tau in zip(chunk["event"], chunk["t"], chunk["tau"])]
+        lob = [{level: (price[l], int(size[l])) for l, level in enumerate(LEVELS)} for price, size in zip(chunk["price"], chunk["size"])]
+        if "width" in chunk:
+            for book, width in zip(lob, chunk["width"]):
+                book.update({name: int(width[l]) for l, name in enumerate(WIDTHS)})
+        return Ts, lob
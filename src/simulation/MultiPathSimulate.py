@@ -0,0 +1,181 @@
+import numpy as np
+
+from simulation.KernelState import ExpKernelState, SumExpKernelState
+from simulation.OrderSizeSampler import OrderSizeSampler
+from simulation.LOBState import MultiLOBState, COLS
+from simulation.TODTable import TODTable
+
+class MultiPathSimulate:
+    """
+    numPaths independent paths of the Simulate.run model (Hawkes events and the two level LOB they drive) from the same
+    calibration, advanced in lockstep.
+
+    Every step draws one candidate per path: the per path state (time, kernel state, last point of each type, spread
+    multipliers) is held in arrays with a leading path axis, so the candidate, intensity, acceptance and type
+    assignment stages are a handful of array operations for all the paths, and the accepted events of the step are
+    applied to the books of their paths at once by a MultiLOBState. The Python overhead of an event is paid once per
+    step instead of once per path, which pays off for many short paths, e.g. for scenario generation.
+
+    The kernel state is the recursive one of ThinningEngine(recursive=True): exact for kernel='exp', the sum of
+    exponentials fit of SumExpKernelState for kernel='powerlaw'. Its [num_nodes, numTerms, num_nodes] matrix per path
+    holds the decayed jumps, each entry keeping the sign of its jump, so the excitatory part is the sum of the entries
+    with a positive jump. The candidates are drawn at the dominating bound of ThinningEngine(adaptiveBound=True), made
+    of the excitatory part, over look-ahead windows cut at the TOD bin ends. The book and the spread the inspread
+    intensities are scaled by are updated after every event, as Simulate.run(batchSize=1) does.
+
+    A path only depends on the seed of rng and on numPaths, not on how its draws would be ordered by Simulate.run:
+    the paths have the law of Simulate.run(recursive=True, adaptiveBound=True), not its seeded values. Events are
+    kept up to T included.
+
+    Arguments:
+    params, tod: as returned by Simulate.preprocessdata
+    numPaths: #of paths
+    kernel: 'powerlaw' or 'exp'
+    Pis, Pi_Q0: order and queue size distributions, see Simulate.run and Simulate.sizedistributions
+    s0, spread0, price0, beta, avgSpread: see Simulate.run
+    numTerms, tol: sum of exponentials settings for kernel='powerlaw', see SumExpKernelState
+    lookahead: length in seconds of the look-ahead windows of the dominating bound
+    rng: np.random.Generator every draw is taken from, the global np.random by default
+    todtable: TODTable of params and tod, built if None
+    profiler: Profiler the candidate, intensity, acceptance, size, lob and snapshot stages of run are timed into, a
+        call being one step of all the paths. None to disable
+    """
+    def __init__(self, params, tod, numPaths, Pis, Pi_Q0, kernel = 'powerlaw', s0 = 0, spread0 = 3, price0 = 260, beta = 0.7479, avgSpread = 0.0169, numTerms = None, tol = 1e-2, lookahead = 1., rng = None, todtable = None, profiler = None):
+        if kernel == 'exp':
+            kernelstate = ExpKernelState(params[0], num_nodes = len(COLS))
+            jumps, decays = kernelstate.jumps[:, None, :], kernelstate.decays[:, None, :]
+        elif kernel == 'powerlaw':
+            kernelstate = SumExpKernelState(params[0], num_nodes = len(COLS), numTerms = numTerms, tol = tol)
+            jumps, decays = kernelstate.jumps.transpose(1, 0, 2), kernelstate.decays.transpose(1, 0, 2)
+        else:
+            raise Exception("kernel must be either 'exp' or 'powerlaw'")
+        self.num_nodes = len(COLS)
+        self.numPaths = numPaths
+        self.kernel = kernel
+        self.jumps = np.ascontiguousarray(jumps) # [source, term, target]
+        self.decays = np.ascontiguousarray(decays)
+        self.excitatoryMask = self.jumps > 0
+        self.positiveJumps = np.maximum(self.jumps, 0).sum(axis = 1) # [source, target] jump of the excitatory part
+        self.baselines = params[1][:, 0]
+        self.todtable = TODTable(params, tod, kernel = kernel) if todtable is None else todtable
+        self.s0 = s0
+        self.beta = beta
+        self.avgSpread = avgSpread
+        self.lookahead = lookahead
+        self.rng = np.random if rng is None else rng
+        self.profiler = profiler
+        self.sizeSamplers = OrderSizeSampler.fromdict(Pis, maxSize = 10000, rng = rng)
+        queueSamplers = OrderSizeSampler.fromdict(Pi_Q0, maxSize = 100000, rng = rng)
+        self.lobstate = MultiLOBState.fromprices(numPaths, queueSamplers, priceMid0 = price0, spread0 = spread0, ticksize = 0.01, numOrdersPerLevel = 10, numOrdersPerLevel0 = 5, rng = rng)
+        self.lob0L3 = [self.lobstate.path(p).tol3dict() for p in range(numPaths)]
+        self.candidates = 0
+        self.accepted = 0
+
+    def spreadmults(self, spread):
+        """(len(spread), num_nodes) multipliers of the baselines and intensities: the spread one on 5, 6 and 1 elsewhere, and the mask of the dimensions that are on"""
+        mults = np.ones((len(spread), self.num_nodes))
+        mults[:, 5] = mults[:, 6] = (spread/self.avgSpread)**self.beta
+        on = np.ones((len(spread), self.num_nodes), dtype = bool)
+        on[:, 5] = on[:, 6] = ~(100*np.round(spread, 2) < 2)
+        return mults, on
+
+    def acceptancerate(self):
+        """Fraction of the candidates tested so far that were accepted"""
+        return self.accepted/self.candidates if self.candidates > 0 else np.nan
+
+    def run(self, T):
+        """
+        Simulates every path from s0 to T. Returns the list of the numPaths paths, each one as a dictionary of columns
+        in the SnapshotBuffer.columns format (t, event, tau, orderSize, price, size), starting with the initial book
+        (event -1), to be converted with SnapshotBuffer.todicts or written with PathStore.PathWriter.append.
+        """
+        rng = self.rng
+        prof = self.profiler
+        todtable = self.todtable
+        lobstate = self.lobstate
+        num_nodes = self.num_nodes
+        P = self.numPaths
+        # per path arrays of the paths still running, paths[i] being the path of row i
+        paths = np.arange(P)
+        s = np.full(P, float(self.s0))
+        state = np.zeros((P,) + self.jumps.shape)
+        excitatory = np.zeros((P, num_nodes))
+        lastT = np.zeros((P, num_nodes))
+        mults, on = self.spreadmults(lobstate.spread())
+        rows = [(paths, s.copy(), np.full(P, -1), np.zeros(P), np.zeros(P, dtype = np.int64), lobstate.price.copy(), lobstate.size.copy())]
+        while len(paths):
+            if prof is not None: t0 = prof.clock()
+            hourIndex = np.minimum(todtable.lastBin, (s//todtable.binLength).astype(int))
+            todmults = todtable.todmults[hourIndex, :, 0]
+            bound = (np.maximum(todmults*(self.baselines*mults + excitatory), 0)*mults*on).sum(axis = 1)
+            u = rng.uniform(0, 1, len(paths))
+            with np.errstate(divide = 'ignore'):
+                w = np.where(bound > 0, np.maximum(1e-7, -1*np.log(u)/bound), np.inf) # floor at 0.1 microsec
+            binEnd = np.where(hourIndex == todtable.lastBin, np.inf, (hourIndex + 1)*todtable.binLength)
+            end = np.minimum(s + self.lookahead, binEnd)
+            test = s + w <= end # no candidate in the window otherwise, the bound is refreshed at its end
+            sNew = np.where(test, s + w, end)
+            done = sNew > T
+            if prof is not None:
+                t1 = prof.clock()
+                prof.add("candidate", t1 - t0)
+
+            """Decaying the kernel states to the candidates"""
+            state *= np.exp(-1*self.decays*(sNew - s)[:, None, None, None])
+            s = sNew
+            excitatory = (state*self.excitatoryMask).sum(axis = (1, 2))
+            hourIndex = np.minimum(todtable.lastBin, (s//todtable.binLength).astype(int))
+            decays = np.maximum(todtable.todmults[hourIndex, :, 0]*(self.baselines*mults + state.sum(axis = (1, 2))), 0)*mults*on
+            lamb = decays.sum(axis = 1)
+            test &= ~done
+            self.candidates += int(test.sum())
+            if prof is not None:
+                t0 = prof.clock()
+                prof.add("intensity", t0 - t1)
+
+            """Testing the candidates and assigning the accepted ones to a process by a ratio of intensities"""
+            D = rng.uniform(0, 1, len(paths))
+            acc = np.flatnonzero(test & (D*bound <= lamb))
+            ks = np.minimum((np.cumsum(decays[acc], axis = 1) <= (D*bound)[acc, None]).sum(axis = 1), num_nodes - 1)
+            state[acc, ks] += self.jumps[ks]
+            excitatory[acc] += self.positiveJumps[ks]
+            tau = self.baselines[ks]*mults[acc, ks]*(s[acc] - lastT[acc, ks])
+            lastT[acc, ks] = s[acc]
+            self.accepted += len(acc)
+            if prof is not None:
+                t1 = prof.clock()
+                prof.add("acceptance", t1 - t0)
+
+            sizes = np.zeros(len(acc), dtype = np.int64)
+            for k in np.unique(ks):
+                if "co" in COLS[k]: continue # size of cancel order drawn in the book
+                group = ks == k
+                sizes[group] = self.sizeSamplers[COLS[k]].sample(int(group.sum()))
+            if prof is not None:
+                t0 = prof.clock()
+                prof.add("size", t0 - t1)
+            sizes = lobstate.apply(paths[acc], ks, sizes)
+            mults[acc], on[acc] = self.spreadmults(lobstate.spread()[paths[acc]])
+            inspread = (ks == 5) | (ks == 6)
+            tau[inspread] *= mults[acc[inspread], ks[inspread]] # the spread multiplier of the engine after an inspread event
+            if prof is not None:
+                t1 = prof.clock()
+                prof.add("lob", t1 - t0)
+            rows.append((paths[acc], s[acc], ks, tau, sizes, lobstate.price[paths[acc]], lobstate.size[paths[acc]]))
+
+            if np.any(done):
+                keep = ~done
+                paths, s, state, excitatory, lastT, mults, on = paths[keep], s[keep], state[keep], excitatory[keep], lastT[keep], mults[keep], on[keep]
+            if prof is not None: prof.add("snapshot", prof.clock() - t1)
+        return self._split(rows)
+
+    def _split(self, rows):
+        """Sorts the rows (path, t, event, tau, orderSize, price, size) of every step into one column dictionary per path"""
+        path, t, event, tau, orderSize, price, size = (np.concatenate(column) for column in zip(*rows))
+        order = np.argsort(path, kind = "stable") # the rows of a path are in time order
+        bounds = np.searchsorted(path[order], np.arange(self.numPaths + 1))
+        res = []
+        for p in range(self.numPaths):
+            idx = order[bounds[p]:bounds[p + 1]]
+            res.append({"t": t[idx], "event": event[idx].astype(np.int8), "tau": tau[idx], "orderSize": orderSize[idx], "price": price[idx], "size": size[idx]})
+        return res
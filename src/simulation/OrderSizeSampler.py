@@ -0,0 +1,60 @@
+import numpy as np
+
+class OrderSizeSampler:
+    """
+    Inverse-CDF sampler for the geometric + dirac deltas size distributions used in Pis and Pi_Q0.
+
+    pi = (p, diracdeltas(i, p_i)) stands for the pmf proportional to p*(1-p)**k + sum_i p_i*1(k == i) on k = 1, ..., maxSize - 1.
+    The cdf is only tabulated up to the largest spike; past it the pmf is a truncated geometric which is inverted in closed form,
+    so the sampler is built once per event type and each draw is one uniform and a short binary search.
+
+    Arguments:
+    pi: (p, [(i, p_i), ...])
+    maxSize: sizes are supported on 1, ..., maxSize - 1
+    rng: np.random.Generator (or anything with a uniform(low, high, size) method), the global np.random by default
+    """
+    def __init__(self, pi, maxSize = 100000, rng = None):
+        p = pi[0]
+        dd = pi[1]
+        self.rng = np.random if rng is None else rng
+        self.head = min(max([i for i, _ in dd] + [1]), maxSize - 1)
+        pmf = p*(1-p)**np.arange(1, self.head + 1)
+        for i, p_i in dd:
+            pmf[i-1] = p_i + pmf[i-1]
+        self.q = 1 - p
+        self.tailTerms = maxSize - 1 - self.head
+        tailMass = self.q**(self.head + 1) - self.q**(maxSize) # sum of p*(1-p)**k for k = head + 1, ..., maxSize - 1
+        total = np.sum(pmf) + tailMass
+        self.cdf = np.cumsum(pmf)/total
+        self.headMass = self.cdf[-1]
+        if self.tailTerms > 0:
+            self.tailNorm = 1 - self.q**self.tailTerms
+
+    @classmethod
+    def fromdict(cls, Pis, maxSize = 100000, rng = None):
+        """Builds one sampler per key of a Pis / Pi_Q0 style dictionary"""
+        return {k: cls(pi, maxSize = maxSize, rng = rng) for k, pi in Pis.items()}
+
+    def sample(self, size = None):
+        """Draws one size (size=None) or a numpy array of sizes"""
+        a = self.rng.uniform(0, 1, size)
+        if size is None:
+            if a <= self.headMass:
+                return int(np.searchsorted(self.cdf, a)) + 1
+            return self._tail(a)
+        a = np.asarray(a)
+        qSize = np.searchsorted(self.cdf, a) + 1
+        tail = a > self.headMass
+        if np.any(tail):
+            qSize[tail] = self._tail(a[tail])
+        return qSize
+
+    def _tail(self, a):
+        if self.tailTerms <= 0:
+            return self.head
+        v = (a - self.headMass)/(1 - self.headMass)
+        j = np.floor(np.log(1 - v*self.tailNorm)/np.log(self.q))
+        j = np.minimum(j, self.tailTerms - 1)
+        if np.ndim(j) == 0:
+            return self.head + 1 + int(j)
+        return self.head + 1 + j.astype(int)
@@ -0,0 +1,132 @@
+import os
+import json
+import numpy as np
+
+class PathWriter:
+    """
+    Append-only columnar store for one simulated path.
+
+    The path is a directory holding one .npy file per column and chunk (<column>_<chunk>.npy) and an index.json with the
+    column dtypes, the event / level names, the row count and time range of every chunk and free form metadata. Each
+    append writes the new chunk and rewrites the (small) index, so streaming a day costs O(N) I/O, and a reader only ever
+    sees complete chunks.
+
+    Arguments:
+    path: directory to write to, created if needed
+    events: names of the event ids stored in the "event" column
+    levels: names of the price levels stored in the "price" and "size" columns
+    meta: json serialisable dictionary saved with the index
+    append: if True an existing index is appended to (checkpoint resume), if False (default) the chunks of an existing
+        path are deleted and a fresh one is started
+    """
+    def __init__(self, path, events = None, levels = None, meta = None, append = False):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        indexPath = os.path.join(path, "index.json")
+        if os.path.exists(indexPath):
+            with open(indexPath, "r") as f:
+                self.index = json.load(f)
+            if append: return
+            self._clear()
+        self.index = {"events": events, "levels": levels, "columns": {}, "chunks": [], "meta": meta or {}}
+
+    def append(self, chunk):
+        """Writes a dictionary of equal length column arrays, sorted by its "t" column, as the next chunk"""
+        rows = len(chunk["t"])
+        if rows == 0: return
+        i = len(self.index["chunks"])
+        for name, values in chunk.items():
+            values = np.ascontiguousarray(values)
+            np.save(os.path.join(self.path, f"{name}_{i:06d}.npy"), values)
+            self.index["columns"][name] = {"dtype": values.dtype.str, "shape": list(values.shape[1:])}
+        self.index["chunks"].append({"rows": rows, "t0": float(chunk["t"][0]), "t1": float(chunk["t"][-1])})
+        self._writeindex()
+
+    def truncate(self, numChunks):
+        """Drops the chunks after the first numChunks from the index, e.g. to resume a run from a checkpoint. Their files are overwritten by the next appends"""
+        del self.index["chunks"][numChunks:]
+        self._writeindex()
+
+    def setmeta(self, **meta):
+        self.index["meta"].update(meta)
+        self._writeindex()
+
+    def _clear(self):
+        """Deletes the chunk files listed in the loaded index, and the index"""
+        for name in self.index["columns"]:
+            for i in range(len(self.index["chunks"])):
+                chunkPath = os.path.join(self.path, f"{name}_{i:06d}.npy")
+                if os.path.exists(chunkPath): os.remove(chunkPath)
+        os.remove(os.path.join(self.path, "index.json"))
+
+    def _writeindex(self):
+        indexPath = os.path.join(self.path, "index.json")
+        with open(indexPath + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(indexPath + ".tmp", indexPath)
+
+class PathReader:
+    """
+    Reads a path written by PathWriter. Chunks are memory mapped, so slicing by time only touches the chunks that
+    overlap the requested range.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), "r") as f:
+            self.index = json.load(f)
+        self.events = self.index["events"]
+        self.levels = self.index["levels"]
+        self.meta = self.index["meta"]
+        self.chunks = self.index["chunks"]
+
+    @staticmethod
+    def ispath(path):
+        return os.path.isfile(os.path.join(path, "index.json"))
+
+    def __len__(self):
+        return sum(c["rows"] for c in self.chunks)
+
+    def columns(self):
+        return list(self.index["columns"].keys())
+
+    def _chunk(self, name, i):
+        return np.load(os.path.join(self.path, f"{name}_{i:06d}.npy"), mmap_mode = "r")
+
+    def chunk(self, i):
+        """{column: array} of chunk i, loaded in memory"""
+        return {name: np.array(self._chunk(name, i)) for name in self.columns()}
+
+    def read(self, columns = None, tmin = None, tmax = None):
+        """
+        Returns {column: array} for the rows with tmin <= t <= tmax (either bound may be None).
+        """
+        if columns is None: columns = self.columns()
+        parts = {name: [] for name in columns}
+        for i, c in enumerate(self.chunks):
+            if (tmin is not None and c["t1"] < tmin) or (tmax is not None and c["t0"] > tmax): continue
+            t = self._chunk("t", i)
+            lo = 0 if tmin is None else np.searchsorted(t, tmin, side = "left")
+            hi = len(t) if tmax is None else np.searchsorted(t, tmax, side = "right")
+            for name in columns:
+                parts[name].append(self._chunk(name, i)[lo:hi])
+        res = {}
+        for name in columns:
+            if len(parts[name]):
+                res[name] = np.concatenate(parts[name])
+            else:
+                col = self.index["columns"][name]
+                res[name] = np.zeros([0] + col["shape"], dtype = np.dtype(col["dtype"]))
+        return res
+
+    def tolegacy(self):
+        """Rebuilds the (Ts, lob, lobL3) lists returned by Simulate.run. Rows with event -1 are initial books"""
+        data = self.read(["t", "event", "tau", "price", "size"])
+        lob = [{level: (price[l], int(size[l])) for l, level in enumerate(self.levels)} for price, size in zip(data["price"], data["size"])]
+        widths = self.meta.get("widths")
+        if widths is not None: # small tick book
+            for book, width in zip(lob, self.read(["width"])["width"]):
+                book.update({name: int(width[l]) for l, name in enumerate(widths)})
+        Ts = [0 if e < 0 else [self.events[e], t, tau] for e, t, tau in zip(data["event"], data["t"], data["tau"])]
+        lobL3 = [self.meta.get("lob0_l3")]
+        return Ts, lob, lobL3
@@ -0,0 +1,177 @@
+import numpy as np
+
+from simulation.TODTable import TODTable
+from simulation.EventWindow import EventSink
+
+INSPREAD = (5, 6)
+
+class PoissonEngine:
+    """
+    Inhomogeneous Poisson process with the TOD profile of the Hawkes process of Simulate, as a drop in replacement for
+    ThinningEngine in Simulate.run: the null model without cross excitation the Hawkes paths are compared against.
+
+    The rate of type k is constant within a TOD bin: the baseline of the Hawkes process (rates='baseline', the
+    todtable.baselines) or its stationary mean intensity in the bin (rates='stationary', see TODTable.stationaryrates),
+    so that the null paths have about the event counts of the Hawkes ones. The inspread rates are scaled by the spread
+    multiplier and off at a one tick spread, as in ThinningEngine.
+
+    The points of the other types are drawn in bulk, a block up to the end of the TOD bin at a time: a Poisson #of
+    points, their times as sorted uniforms (the order statistics of the block) and their types by inverse cdf of the
+    rates, i.e. three array draws per block instead of two draws per candidate. As the inspread rates change with
+    the spread, the inspread points come from an exponential clock redrawn whenever the spread changes, which is exact
+    as the process is memoryless. Every draw is a point, there is no thinning.
+
+    Arguments:
+    params, tod, num_nodes, s, spread, beta, avgSpread, rng, todtable, history: see ThinningEngine
+    rates: 'baseline' or 'stationary'
+    blockLength: max length in seconds of a block, the last TOD bin having no end
+    """
+    def __init__(self, params, tod, kernel = 'powerlaw', num_nodes = 12, s = 0, spread = 1, beta = 0.7479, avgSpread = 0.0169, rng = None, todtable = None, rates = 'baseline', blockLength = 1800, history = True):
+        if rates not in ['baseline', 'stationary']:
+            raise Exception("rates must be either 'baseline' or 'stationary'")
+        self.params = params
+        self.num_nodes = num_nodes
+        self.beta = beta
+        self.avgSpread = avgSpread
+        self.rng = np.random if rng is None else rng
+        self.todtable = TODTable(params, tod, kernel = kernel) if todtable is None else todtable
+        self.rates = self.todtable.baselines[:, :, 0] if rates == 'baseline' else self.todtable.stationaryrates()
+        self.bulkRates = self.rates.copy()
+        self.bulkRates[:, list(INSPREAD)] = 0
+        self.bulkCumulative = np.cumsum(self.bulkRates, axis = 1)
+        self.blockLength = blockLength
+        self.s = 0 if s is None else s
+        self.n = num_nodes*[0]
+        self.lastT = np.zeros(num_nodes)
+        self.sink = EventSink() if history else None
+        self.blockEnd = self.s # end of the drawn blocks, the first call draws the first block from s
+        self.blockT, self.blockK, self.i = [], [], 0
+        self.nextInspread = None # drawn when needed
+        self.candidates = 0
+        self.accepted = 0
+        self.refreshes = 0 # blocks drawn
+        self.spread = self.baselineSpread = None
+        self.setspread(1 if spread is None else spread)
+
+    @property
+    def timeseries(self):
+        """Every point as a list of (time, event), only kept with history"""
+        if self.sink is None: raise Exception("the engine was built with history=False, it keeps no timeseries")
+        t, k = self.sink.arrays()
+        return list(zip(t.tolist(), k.tolist()))
+
+    @property
+    def Ts(self):
+        """Tuple of the times of each type, only kept with history"""
+        if self.sink is None: raise Exception("the engine was built with history=False, it keeps no Ts")
+        t, k = self.sink.arrays()
+        return [tuple(t[k == i].tolist()) for i in range(self.num_nodes)]
+
+    def setspread(self, spread):
+        """Sets the spread the inspread (5, 6) rates are scaled by. The inspread clock is only redrawn if it changed"""
+        if spread != self.spread:
+            self._setspreadmult(spread)
+        if spread != self.baselineSpread:
+            self.baselines = self.params[1].copy()
+            self.baselines[5] = self.spreadMult*self.baselines[5]
+            self.baselines[6] = self.spreadMult*self.baselines[6]
+            self.baselineSpread = spread
+
+    def _setspreadmult(self, spread):
+        self.spread = spread
+        self.spreadMult = (spread/self.avgSpread)**self.beta
+        self.inspreadOff = 100*np.round(spread, 2) < 2
+        self.nextInspread = None
+
+    def acceptancerate(self):
+        """1, every draw is a point"""
+        return self.accepted/self.candidates if self.candidates > 0 else np.nan
+
+    def getstate(self):
+        """Dynamic state of the engine, the rest of the current block included, to resume it with setstate"""
+        return {"s": self.s, "n": list(self.n), "lastT": self.lastT.copy(), "spread": self.spread, "spreadMult": self.spreadMult,
+                "inspreadOff": self.inspreadOff, "baselines": self.baselines.copy(), "baselineSpread": self.baselineSpread, "blockEnd": self.blockEnd,
+                "blockT": self.blockT[self.i:], "blockK": self.blockK[self.i:], "nextInspread": self.nextInspread,
+                "candidates": self.candidates, "accepted": self.accepted, "refreshes": self.refreshes}
+
+    def setstate(self, state):
+        """Restores a state returned by getstate. With history, the sink restarts empty"""
+        for name in ["s", "n", "spread", "spreadMult", "inspreadOff", "baselineSpread", "blockEnd", "nextInspread", "candidates", "accepted", "refreshes"]:
+            setattr(self, name, state[name])
+        self.n = list(self.n)
+        self.lastT = state["lastT"].copy()
+        self.baselines = state["baselines"].copy()
+        self.blockT, self.blockK, self.i = list(state["blockT"]), list(state["blockK"]), 0
+        if self.sink is not None: self.sink = EventSink()
+
+    def _drawblock(self):
+        """Draws the points of the non inspread types from blockEnd to the end of its TOD bin (at most blockLength later)"""
+        todtable = self.todtable
+        start = self.blockEnd
+        hourIndex = todtable.hourindex(start)
+        end = min(todtable.binend(start), start + self.blockLength)
+        rng = self.rng
+        cumulative = self.bulkCumulative[hourIndex]
+        total = cumulative[-1]
+        num = int(rng.poisson(total*(end - start))) if total > 0 else 0
+        if num > 0:
+            t = start + (end - start)*np.sort(rng.uniform(0, 1, num))
+            k = np.minimum(np.searchsorted(cumulative, total*rng.uniform(0, 1, num), side = 'right'), self.num_nodes - 1)
+            self.blockT, self.blockK = t.tolist(), k.tolist()
+        else:
+            self.blockT, self.blockK = [], []
+        self.i = 0
+        self.blockEnd = end
+        self.nextInspread = None # the inspread rates change with the bin
+        self.refreshes += 1
+
+    def _drawinspread(self, s):
+        """Time of the next inspread point from s at the current spread, inf if the inspread rates are 0"""
+        if self.inspreadOff: return np.inf
+        rates = self.rates[self.todtable.hourindex(s)]
+        rate = self.spreadMult*(rates[5] + rates[6])
+        if rate <= 0: return np.inf
+        return s + max(1e-7, -1*np.log(self.rng.uniform(0, 1))/rate) # floor at 0.1 microsec
+
+    def _record(self, s, k):
+        """Adds the point of type k at time s and returns its tau"""
+        tau = self.baselines[k][0]*(s - self.lastT[k])
+        self.lastT[k] = s
+        self.n[k] += 1
+        if self.sink is not None: self.sink.append(s, k)
+        self.candidates += 1
+        self.accepted += 1
+        return tau
+
+    def simulate(self, T, maxJumps = None, stopEvents = ()):
+        """
+        Generates points until s > T, maxJumps points were generated or a point in stopEvents was generated. Returns the
+        list of (s, k, tau) where tau is the integrated baseline since the previous point of type k. A point past T is
+        kept for the next call, s being moved to it.
+        """
+        events = []
+        s = self.s
+        while s <= T:
+            if self.nextInspread is None:
+                self.nextInspread = self._drawinspread(s)
+            tBulk = self.blockT[self.i] if self.i < len(self.blockT) else self.blockEnd
+            if self.nextInspread < tBulk:
+                s = self.nextInspread
+                if s > T: break
+                r = self.rates[self.todtable.hourindex(s)]
+                k = 5 if self.rng.uniform(0, 1)*(r[5] + r[6]) < r[5] else 6
+                self._setspreadmult(self.spread - 0.01) # the baselines keep the old spread until the caller calls setspread
+            elif self.i < len(self.blockT):
+                s = tBulk
+                if s > T: break
+                k = self.blockK[self.i]
+                self.i += 1
+            else: # end of the block, draw the next one
+                s = self.blockEnd
+                if s > T: break
+                self._drawblock()
+                continue
+            events.append((s, k, self._record(s, k)))
+            if (k in stopEvents) or ((maxJumps is not None) and (len(events) >= maxJumps)): break
+        self.s = s
+        return events
@@ -0,0 +1,59 @@
+import time
+import numpy as np
+
+class Profiler:
+    """
+    Cumulative wall time and call counts per named stage of an event loop.
+
+    The loops take profiler=None by default and only call the clock behind an `if profiler is not None` test, so a
+    disabled profiler costs one comparison per stage. Stages are timed with time.perf_counter_ns and recorded with add.
+
+    Arguments:
+    traceEvery: also keep (stage, end time, duration) for every traceEvery-th call of each stage, 0 for no traces
+    maxTraces: cap on the number of kept traces
+    """
+    clock = staticmethod(time.perf_counter_ns)
+
+    def __init__(self, traceEvery = 0, maxTraces = 100000):
+        self.totals = {}
+        self.counts = {}
+        self.traceEvery = traceEvery
+        self.maxTraces = maxTraces
+        self._traces = []
+        self.start = time.perf_counter_ns()
+
+    def add(self, stage, ns):
+        """Records one call of stage that took ns nanoseconds"""
+        count = self.counts.get(stage, 0) + 1
+        self.counts[stage] = count
+        self.totals[stage] = self.totals.get(stage, 0) + ns
+        if self.traceEvery and (count % self.traceEvery == 0) and (len(self._traces) < self.maxTraces):
+            self._traces.append((stage, time.perf_counter_ns() - self.start, ns))
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+        self._traces = []
+        self.start = time.perf_counter_ns()
+
+    def summary(self):
+        """{stage: {"calls", "seconds", "us_per_call", "share"}} sorted by total time, share being the fraction of the time of all stages"""
+        total = sum(self.totals.values())
+        res = {}
+        for stage in sorted(self.totals, key = self.totals.get, reverse = True):
+            ns = self.totals[stage]
+            res[stage] = {"calls": self.counts[stage], "seconds": ns*1e-9, "us_per_call": ns*1e-3/self.counts[stage], "share": ns/total if total > 0 else 0.}
+        return res
+
+    def traces(self):
+        """Sampled traces as a structured array of (stage, t, ns), t being the time since the profiler was created or reset"""
+        return np.array(self._traces, dtype = [("stage", "U64"), ("t", np.int64), ("ns", np.int64)])
+
+    def report(self):
+        """The summary as a text table"""
+        summary = self.summary()
+        width = max([len(stage) for stage in summary] + [5])
+        lines = [f"{'stage':<{width}} {'calls':>10} {'seconds':>10} {'us/call':>10} {'share':>7}"]
+        for stage, row in summary.items():
+            lines.append(f"{stage:<{width}} {row['calls']:>10} {row['seconds']:>10.3f} {row['us_per_call']:>10.2f} {100*row['share']:>6.1f}%")
+        return "\n".join(lines)
@@ -0,0 +1,87 @@
+import numpy as np
+
+BIT_GENERATORS = {"PCG64": np.random.PCG64, "PCG64DXSM": np.random.PCG64DXSM, "Philox": np.random.Philox}
+
+class RNGService:
+    """
+    The random source injected into the simulators: a np.random.Generator on a PCG64 or counter based Philox stream,
+    with the scalar draws of the event loops served from pre-drawn blocks.
+
+    Streams are derived from a np.random.SeedSequence, so child(i) (a path, an agent, ...) gets a stream independent
+    of every other key and that only depends on the seed and the key, not on the number of paths, workers or agents.
+    Scalar uniform and exponential draws come from blocks of blockSize values drawn in one call, which saves the
+    per call overhead of the Generator in the thinning and order size loops. With blockSize=0 every draw goes to the
+    Generator, i.e. the stream is the one of np.random.Generator(bitGenerator(seed)). Draws with a size and the other
+    Generator methods (integers, choice, normal, ...) always go to the Generator.
+
+    Arguments:
+    seed: int, sequence of ints, SeedSequence or None (fresh entropy)
+    bitGenerator: key of BIT_GENERATORS
+    blockSize: #of values per pre-drawn block, 0 to disable the blocks
+    """
+    def __init__(self, seed = None, bitGenerator = "PCG64", blockSize = 4096):
+        if bitGenerator not in BIT_GENERATORS:
+            raise Exception(f"bitGenerator must be one of {list(BIT_GENERATORS)}")
+        self.seedSequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.bitGenerator = bitGenerator
+        self.blockSize = blockSize
+        self.generator = np.random.Generator(BIT_GENERATORS[bitGenerator](self.seedSequence))
+        self._uniforms, self._u = [], 0
+        self._exponentials, self._e = [], 0
+
+    def child(self, *key):
+        """Stream of the integer key, e.g. child(i) for path i or child(1, agentID) for an agent, with the same settings"""
+        seedSequence = np.random.SeedSequence(self.seedSequence.entropy, spawn_key = self.seedSequence.spawn_key + tuple(key))
+        return RNGService(seedSequence, bitGenerator = self.bitGenerator, blockSize = self.blockSize)
+
+    def spawn(self, n):
+        """Streams child(0), ..., child(n - 1)"""
+        return [self.child(i) for i in range(n)]
+
+    def uniform(self, low = 0., high = 1., size = None):
+        if (size is not None) or (self.blockSize == 0):
+            return self.generator.uniform(low, high, size)
+        if self._u == len(self._uniforms):
+            self._uniforms, self._u = self.generator.random(self.blockSize).tolist(), 0
+        u = self._uniforms[self._u]
+        self._u += 1
+        return u if (low == 0. and high == 1.) else low + (high - low)*u
+
+    def standard_exponential(self, size = None):
+        if (size is not None) or (self.blockSize == 0):
+            return self.generator.standard_exponential(size)
+        if self._e == len(self._exponentials):
+            self._exponentials, self._e = self.generator.standard_exponential(self.blockSize).tolist(), 0
+        e = self._exponentials[self._e]
+        self._e += 1
+        return e
+
+    def exponential(self, scale = 1., size = None):
+        if (size is not None) or (self.blockSize == 0):
+            return self.generator.exponential(scale, size)
+        return scale*self.standard_exponential()
+
+    def integers(self, low, high = None, size = None):
+        return self.generator.integers(low, high, size)
+
+    def randint(self, low, high = None, size = None):
+        """np.random.randint interface (high exclusive), for the code written against the global RandomState"""
+        return self.generator.integers(low, high, size)
+
+    def randrange(self, start, stop):
+        """random.randrange interface"""
+        return int(self.generator.integers(start, stop))
+
+    def __getattr__(self, name):
+        if (name == "generator") or name.startswith("__"): raise AttributeError(name) # pickle and copy look up dunders
+        return getattr(self.generator, name)
+
+    def getstate(self):
+        """State of the stream, pre-drawn values included, to restore with setstate"""
+        return {"bitGenerator": self.generator.bit_generator.state, "uniforms": list(self._uniforms), "u": self._u,
+                "exponentials": list(self._exponentials), "e": self._e}
+
+    def setstate(self, state):
+        self.generator.bit_generator.state = state["bitGenerator"]
+        self._uniforms, self._u = list(state["uniforms"]), state["u"]
+        self._exponentials, self._e = list(state["exponentials"]), state["e"]
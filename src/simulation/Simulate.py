@@ -11,185 +11,51 @@ import pandas as pd
 import pickle
 import time
 
-from simulation.functions import powerLawCutoff, powerLawKernel, expKernel
+from simulation.functions import powerLawCutoff, powerLawKernel
+from simulation.KernelState import ExpKernelState, SumExpKernelState
+from simulation.OrderSizeSampler import OrderSizeSampler
+from simulation.LOBState import LOBState, SmallTickLOBState, SnapshotBuffer, COLS, LEVELS, WIDTHS
+from simulation.PathStore import PathWriter, PathReader
+from simulation.Checkpoint import SimulationState
+from simulation.ThinningEngine import ThinningEngine, SPREAD_EVENTS
+from simulation.ExactExpEngine import ExactExpEngine
+from simulation.PoissonEngine import PoissonEngine
+from simulation.MultiPathSimulate import MultiPathSimulate
 
 class Simulate:
     def __init__(self):
         self.num_nodes = 12
 
-    def createLOB(self, dictTimestamps, sizes, Pi_Q0, priceMid0 = 260, spread0 = 4, ticksize = 0.01, numOrdersPerLevel = 10, lob0 = {}, lob0_l3 = {}):
-        lob = []
-        lob_l3 = []
-        T = []
-        levels = ["Ask_deep", "Ask_touch", "Bid_touch", "Bid_deep"]
-        cols = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
-                "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
-        colsToLevels = {
-            "lo_deep_Ask" : "Ask_deep",
-            "lo_top_Ask" : "Ask_touch",
-            "lo_top_Bid" : "Bid_touch",
-            "lo_deep_Bid" : "Bid_deep"
-        }
+    def createLOB(self, dictTimestamps, sizes, Pi_Q0, priceMid0 = 260, spread0 = 4, ticksize = 0.01, numOrdersPerLevel = 10, lob0 = {}, lob0_l3 = {}, samplers = None, rng = None):
+        """
+        Applies the events of dictTimestamps in time order to the book lob0 / lob0_l3 (a fresh book around priceMid0 if empty) and returns the times, L2 and L3 snapshots after each event.
+        The transitions live in LOBState; run drives a LOBState directly.
+
+        samplers: dictionary of OrderSizeSampler built from Pi_Q0, built here if None. Pass it in when calling createLOB repeatedly.
+        rng: np.random.Generator or RNGService.RNGService the queue sizes and cancelled orders are drawn from, the global np.random by default
+        """
+        if samplers is None: samplers = OrderSizeSampler.fromdict(Pi_Q0, maxSize = 100000, rng = rng)
         if len(lob0) == 0:
-            lob0['Ask_touch'] = (priceMid0 + np.floor(spread0/2)*ticksize, 0)
-            lob0['Bid_touch'] = (priceMid0 - np.ceil(spread0/2)*ticksize, 0)
-            lob0['Ask_deep'] = (priceMid0 + np.floor(spread0/2)*ticksize + ticksize, 0)
-            lob0['Bid_deep'] = (priceMid0 - np.ceil(spread0/2)*ticksize - ticksize, 0)
-            for k, pi in Pi_Q0.items():
-                #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
-                p = pi[0]
-                dd = pi[1]
-                pi = np.array([p*(1-p)**k for k in range(1,100000)])
-                # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-                for i, p_i in dd:
-                    pi[i-1] = p_i + pi[i-1]
-                pi = pi/sum(pi)
-                cdf = np.cumsum(pi)
-                a = np.random.uniform(0, 1)
-                qSize = np.argmax(cdf>=a) + 1
-                lob0[k] = (lob0[k][0], qSize)
-            for l in levels:
-                tmp = (numOrdersPerLevel - 1)*[np.floor(lob0[l][1]/numOrdersPerLevel)]
-                if tmp !=0:
-                    lob0_l3[l] = [lob0[l][1] - sum(tmp)] + tmp
-                else:
-                    lob0_l3[l] = [lob0[l][1]]
-            #print("Lob0_l3 post init: ", lob0_l3)
+            lobstate = LOBState.fromprices(samplers, priceMid0 = priceMid0, spread0 = spread0, ticksize = ticksize, numOrdersPerLevel = numOrdersPerLevel, rng = rng)
+        else:
+            lobstate = LOBState.fromdicts(lob0, lob0_l3, samplers, ticksize = ticksize, numOrdersPerLevel = numOrdersPerLevel, rng = rng)
+        lob = [lobstate.todict()]
+        lob_l3 = [lobstate.tol3dict()]
         if len(dictTimestamps) == 0:
-            return T, [lob0], [lob0_l3]
+            return [], lob, lob_l3
 
-        dfs = []
+        T = [0]
+        events, times, eventSizes = [], [], []
         for event in dictTimestamps.keys():
-            sizes_e = sizes[event]
             timestamps_e = dictTimestamps[event]
-            dfs += [pd.DataFrame({"event" : len(timestamps_e)*[event], "time": timestamps_e, "size" : sizes_e})]
-        dfs = pd.concat(dfs)
-        dfs = dfs.sort_values("time")
-        lob.append(lob0.copy())
-        T.append(0)
-        lob_l3.append(lob0_l3.copy())
-        for i in range(len(dfs)):
-            r = dfs.iloc[i]
-            lobNew = lob[i].copy()
-            lob_l3New = lob_l3[i].copy()
-            T.append(r.time)
-            if "Ask" in r.event :
-                side = "Ask"
-            else:
-                side = "Bid"
-
-            if "lo" in r.event:
-                if "deep" in r.event:
-                    if np.abs(lobNew[side + "_touch"][0] - lobNew[side + "_deep"][0]) >  2.5*ticksize:
-                        print("triggered")
-                        direction = 1
-                        if side == "Ask": direction = -1
-                        lobNew[side + "_deep"] = (np.round(lobNew[side + "_touch"][0] - direction*ticksize, decimals=2), r['size'])
-                        lob_l3New[side + "_deep"] = [r['size']]
-                    else:
-                        lobNew[side + "_deep"] = (lobNew[side + "_deep"][0], lobNew[side + "_deep"][1] + r['size'])
-                        lob_l3New[side + "_deep"] += [r['size']]
-                elif "top" in r.event:
-                    lobNew[side + "_touch"] = (lobNew[side + "_touch"][0], lobNew[side + "_touch"][1] + r['size'])
-                    lob_l3New[side + "_touch"] += [r['size']]
-                else: #inspread
-                    direction = 1
-                    if side == "Ask": direction = -1
-                    lobNew[side + "_deep"] = lobNew[side + "_touch"]
-                    lob_l3New[side + "_deep"] = lob_l3New[side + "_touch"].copy()
-                    lobNew[side + "_touch"] = (np.round(lobNew[side + "_touch"][0] + direction*ticksize, decimals=2), r['size'])
-                    lob_l3New[side + "_touch"] = [r['size']]
-
-            if "mo" in r.event:
-                lobNew[side + "_touch"] = (lobNew[side + "_touch"][0], lobNew[side + "_touch"][1] - r['size'])
-                if lobNew[side + "_touch"][1] > 0:
-                    cumsum = np.cumsum(lob_l3New[side + "_touch"])
-                    idx = np.argmax(cumsum >= r['size'])
-                    tmp = lob_l3New[side + "_touch"][idx:]
-                    offset = 0
-                    if idx > 0: offset = cumsum[idx - 1]
-                    tmp[0] = tmp[0] + offset - r['size']
-                    lob_l3New[side + "_touch"] = tmp.copy()
-                while lobNew[side + "_touch"][1] <= 0: # queue depletion
-                    extraVolume = -1*lobNew[side + "_touch"][1]
-                    lobNew[side + "_touch"] = (lobNew[side + "_deep"][0], lobNew[side + "_deep"][1] - extraVolume)
-                    lob_l3New[side + "_touch"] = lob_l3New[side + "_deep"].copy()
-                    if lobNew[side + "_touch"][1] > 0:
-                        if extraVolume > 0:
-                            cumsum = np.cumsum(lob_l3New[side + "_touch"])
-                            idx = np.argmax(cumsum >= extraVolume)
-                            tmp = np.array(lob_l3New[side + "_touch"][idx:])
-                            tmp[0] = cumsum[idx] - extraVolume
-                            tmp = tmp[tmp>0]
-                            lob_l3New[side + "_touch"] = list(tmp).copy()
-                    direction = 1
-                    if side == "Bid": direction = -1
-                    #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
-                    pi = Pi_Q0[side+"_deep"]
-                    p = pi[0]
-                    dd = pi[1]
-                    pi = np.array([p*(1-p)**k for k in range(1,100000)])
-                    # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-                    for i, p_i in dd:
-                        pi[i-1] = p_i + pi[i-1]
-                    pi = pi/sum(pi)
-                    cdf = np.cumsum(pi)
-                    a = np.random.uniform(0, 1)
-                    qSize = np.argmax(cdf>=a)+1
-                    lobNew[side + "_deep"] = (np.round(lobNew[side + "_deep"][0] + direction*ticksize, decimals=2), qSize)
-                    tmp = (numOrdersPerLevel - 1)*[np.floor(lobNew[side + "_deep"][1]/numOrdersPerLevel)]
-                    lob_l3New[side + "_deep"] = [lobNew[side + "_deep"][1] - sum(tmp)] + tmp
-
-            if "co" in r.event:
-
-                if "deep" in r.event:
-                    size = np.random.choice(lob_l3New[side + "_deep"])
-                    lobNew[side + "_deep"] = (lobNew[side + "_deep"][0], lobNew[side + "_deep"][1] - size)
-                    lob_l3New[side + "_deep"].remove(size)
-                elif "top" in r.event:
-                    size = np.random.choice(lob_l3New[side + "_touch"])
-                    lobNew[side + "_touch"] = (lobNew[side + "_touch"][0], lobNew[side + "_touch"][1] - size)
-                    lob_l3New[side + "_touch"].remove(size)
-                if lobNew[side + "_touch"][1] <= 0: # queue depletion
-                    lobNew[side + "_touch"] = (lobNew[side + "_deep"][0], lobNew[side + "_deep"][1])
-                    lob_l3New[side + "_touch"] = lob_l3New[side + "_deep"].copy()
-                    direction = 1
-                    if side == "Bid": direction = -1
-                    pi = Pi_Q0[side+"_deep"]
-                    p = pi[0]
-                    dd = pi[1]
-                    pi = np.array([p*(1-p)**k for k in range(1,100000)])
-                    # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-                    for i, p_i in dd:
-                        pi[i-1] = p_i + pi[i-1]
-                    pi = pi/sum(pi)
-                    cdf = np.cumsum(pi)
-                    a = np.random.uniform(0, 1)
-                    qSize = np.argmax(cdf>=a)-1
-                    lobNew[side + "_deep"] = (np.round(lobNew[side + "_deep"][0] + direction*ticksize, decimals=2), qSize)
-                    tmp = (numOrdersPerLevel - 1)*[np.floor(lobNew[side + "_deep"][1]/numOrdersPerLevel)]
-                    lob_l3New[side + "_deep"] = [lobNew[side + "_deep"][1] - sum(tmp)] + tmp
-
-                if lobNew[side + "_deep"][1] <= 0: # queue depletion
-                    direction = 1
-                    if side == "Bid": direction = -1
-                    #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
-                    pi = Pi_Q0[side+"_deep"]
-                    p = pi[0]
-                    dd = pi[1]
-                    pi = np.array([p*(1-p)**k for k in range(1,100000)])
-                    # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-                    for i, p_i in dd:
-                        pi[i-1] = p_i + pi[i-1]
-                    pi = pi/sum(pi)
-                    cdf = np.cumsum(pi)
-                    a = np.random.uniform(0, 1)
-                    qSize = np.argmax(cdf>=a)+1
-                    lobNew[side + "_deep"] = (np.round(lobNew[side + "_deep"][0] + direction*ticksize, decimals=2), qSize)
-                    tmp = ((2*numOrdersPerLevel) - 1)*[np.floor(lobNew[side + "_deep"][1]/(2*numOrdersPerLevel))]
-                    lob_l3New[side + "_deep"] = [lobNew[side + "_deep"][1] - sum(tmp)] + tmp
-            lob.append(lobNew.copy())
-            lob_l3.append(lob_l3New.copy())
+            events += len(timestamps_e)*[COLS.index(event)]
+            times += list(timestamps_e)
+            eventSizes += list(np.broadcast_to(sizes[event], len(timestamps_e)))
+        for i in np.argsort(times, kind = "stable"):
+            lobstate.apply(events[i], eventSizes[i])
+            T.append(times[i])
+            lob.append(lobstate.todict())
+            lob_l3.append(lobstate.tol3dict())
         return T, lob, lob_l3
 
     def thinningOgata(self, T, paramsPath, num_nodes = 12, maxJumps = None):
@@ -383,7 +249,7 @@ class Simulate:
                     return s,n,Ts, Ts_new, tau, lamb
         return s,n, Ts, Ts_new, -1, lamb
 
-    def thinningOgataIS2(self, T, params, tod, kernel = 'powerlaw', num_nodes=12, maxJumps = None, s = None, n = None, Ts = None, timeseries=None, spread=None, beta = 0.7479, avgSpread = 0.0169,lamb= None, left=None):
+    def thinningOgataIS2(self, T, params, tod, kernel = 'powerlaw', num_nodes=12, maxJumps = None, s = None, n = None, Ts = None, timeseries=None, spread=None, beta = 0.7479, avgSpread = 0.0169,lamb= None, left=None, recursive=False, kernelstate=None, numTerms=None, tol=1e-2, jit=False, todtable=None, adaptiveBound=False, lookahead=1., rng=None):
         """
         Arguments:
         T: timelimit of simulation process
@@ -393,130 +259,22 @@ class Simulate:
         tod: a [12, 13] matrix containing values of f(Q_t), the time multiplier for the 13 different 30 min bins of the trading day.
         num_nodes: #of different processes
         timeseries: the sequence of all point-events arranged in the form (t, m) where m is the #of the dimension
+        recursive: if True, cross excitations are carried in a recursive kernel state instead of rescanning the last 10 seconds of timeseries. The exp kernel is exact, the powerlaw kernel is replaced by a sum of exponentials fitted on [0, 10] seconds. There is no 10 second truncation in this mode.
+        kernelstate: the recursive kernel state to carry between calls; it is updated in place. Built from timeseries if None.
+        numTerms, tol: number of exponentials per powerlaw kernel and the max relative error they must meet (see SumExpKernelState)
+        jit: sum the 10 second history window with the numba compiled loop instead of numpy (see functions.historyKernelSum)
+        todtable: TODTable.TODTable of params and tod. Built on every call if None, so pass it in when calling repeatedly
+        adaptiveBound, lookahead: draw the candidates at a dominating bound built from the excitatory kernels over look-ahead windows of lookahead seconds (see ThinningEngine.simulate)
+        rng: np.random.Generator or RNGService.RNGService the thinning draws from, the global np.random by default
+
+        This is a one shot wrapper around ThinningEngine, which keeps the state between calls itself.
         """
-        numJumps = 0
-        if n is None: n = num_nodes*[0]
-        if Ts is None: Ts = num_nodes*[()]
-        if spread is None: spread = 1
-        """Setting up thinningOgata params"""
-        cols = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
-                "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
-        baselines =params[1].copy()
-        mat = np.zeros((num_nodes, num_nodes))
-        if s is None:
-            s = 0
-        hourIndex = min(12,int(s//1800)) #1800 seconds in 30 minutes
-        todmult=tod[:, hourIndex].reshape((12, 1))
-        #todMult*kernelParams[0]*kernelParams[1][0]/((-1 + kernelParams[1][1])*kernelParams[1][2])
-        if kernel=='powerlaw':
-            mat=todmult*params[0][0]*params[0][1]/((params[0][2]-1) *params[0][3])
-        elif kernel == 'exp':
-            mat= todmult*params[0][0]*params[0][1]/params[0][2]
-        baselines[5] = ((spread/avgSpread)**beta)*baselines[5]
-        baselines[6] = ((spread/avgSpread)**beta)*baselines[6]
-        specRad = np.max(np.linalg.eig(mat)[0])
-        #print("spectral radius = ", specRad)
-        specRad = np.max(np.linalg.eig(mat)[0]).real
-        if specRad < 1 : specRad = 0.99 #  # dont change actual specRad if already good
-
-        """calculating initial values of lamb_bar"""
-        if lamb is None:
-            decays=(0.99/specRad) * todmult * baselines
-            lamb=np.sum(decays) #3.04895025
-        if left is None:
-            left=0
-        if timeseries is None:
-            timeseries=[]
-
-        """simulation loop"""
-        while s<=T:
-            """Assign lamb_bar"""
-            lamb_bar=lamb
-            #print("lamb_bar: ", lamb_bar)
-            """generate random u"""
-            u=np.random.uniform(0, 1)
-            if lamb_bar==0:
-                s+=0.1  # wait for some time
-            else:
-                w=max(1e-7, -1 * np.log(u)/lamb_bar) # floor at 0.1 microsec
-                s+=w
-            """Recalculating baseline lambdas sum with new candidate"""
-            hourIndex = min(12,int(s//1800))
-            todmult=tod[:, hourIndex].reshape((12, 1)) * (0.99/specRad)
-            decays=todmult * baselines
-            """Summing cross excitations for previous points"""
-            if timeseries==[]:
-                pass
-            else:
-                while left<len(timeseries):
-                    #print("Iterating: s: ", s, ", timestamp: ", timeseries[left][0])
-                    if s-timeseries[left][0]>=10:
-                        left+=1
-                    else:
-                        break
-                for point in timeseries[left:]: #point is of the form(s, k)
-                    if kernel == 'powerlaw':
-                        kern=powerLawCutoff(time=s-point[0], alpha=params[0][0][point[1]]*params[0][1][point[1]], beta=params[0][2][point[1]], gamma=params[0][3][point[1]])
-                    elif kernel == 'exp':
-                        kern=expKernel(s-point[0], params[0][0][point[1]], params[0][1][point[1]])
-                    else:
-                        raise Exception("kernel must be either 'exp' or 'powerlaw'")
-                    kern=kern.reshape((12, 1))
-                    decays+=todmult*kern
-            #print(decays.shape) #should be (12, 1)
-            decays=np.maximum(decays, 0)
-            decays[5] = ((spread/avgSpread)**beta)*decays[5]
-            decays[6] = ((spread/avgSpread)**beta)*decays[6]
-            if 100*np.round(spread, 2)  < 2 :
-                decays[5] = decays[6] = 0
-            lamb = float(sum(decays))
-            #print("LAMBDA: ", lamb)
-
-            """Testing candidate point"""
-            D=np.random.uniform(0, 1)
-            #print("Candidate D: ", D)
-            if D*lamb_bar<=lamb:
-                """Accepted so assign candidate point to a process by a ratio of intensities"""
-                k=0
-                total=decays[k]
-                while D*lamb_bar >= total:
-                    k+=1
-                    total+=decays[k]
-                """dimension is cols[k]"""
-                """Update values of lambda for next simulation loop and append point to Ts"""
-                if k in [5, 6]:
-                    spread=spread-0.01
-
-                """Precalc next value of lambda_bar"""
-                newdecays=todmult * params[0][0][k].reshape(12, 1)*params[0][1][k].reshape(12, 1)
-                newdecays=np.maximum(newdecays, 0)
-                newdecays[5] = ((spread/avgSpread)**beta)*newdecays[5]
-                newdecays[6] = ((spread/avgSpread)**beta)*newdecays[6]
-                if 100*np.round(spread, 2) < 2 : newdecays[5] = newdecays[6] = 0
-                lamb+= sum(newdecays)
-                lamb=lamb[0]
-
-
-                if len(Ts[k]) > 0:
-                    T_Minus1 = Ts[k][-1]
-                else:
-                    T_Minus1 = 0
-                decays = np.array(baselines.copy())
-                hourIndex = np.min([12,int(np.floor(s/1800))])
-                decays[5] = ((spread/avgSpread)**beta)*decays[5]
-                decays[6] = ((spread/avgSpread)**beta)*decays[6]
-                decays = decays*(s-T_Minus1)
-
-                """Updating history and returns"""
-                Ts[k]+=(s,)
-                tau = decays[k][0]
-                numJumps+=1
-                n[k]+=1
-                timeseries.append((s, k)) #(time, event)
-                #print("point added")
-                if numJumps>=maxJumps:
-                    return s, n, Ts, tau, lamb, timeseries, left
-        return s, n, Ts, -1, lamb, timeseries, left
+        engine = ThinningEngine(params, tod, kernel=kernel, num_nodes=num_nodes, s=s, spread=spread, beta=beta, avgSpread=avgSpread, recursive=recursive, kernelstate=kernelstate, numTerms=numTerms, tol=tol, timeseries=timeseries, n=n, Ts=Ts, lamb=lamb, left=left, rng=rng, jit=jit, todtable=todtable, adaptiveBound=adaptiveBound, lookahead=lookahead)
+        events = engine.simulate(T, maxJumps=maxJumps)
+        tau = -1
+        if (maxJumps is not None) and (len(events) >= maxJumps):
+            tau = events[-1][2]
+        return engine.s, engine.n, engine.Ts, tau, engine.lamb, engine.timeseries, engine.left
 
     def preprocessdata(self, paramsPath: str, todPath: str, kernel = 'powerlaw'):
         """Takes in params and todpath and spits out corresponding vectorised numpy arrays
@@ -568,12 +326,11 @@ class Simulate:
         params=[kernelparams, baselines]
         return tod, params
     
-    def run(self, T, paramsPath, todPath, s0 = None, filePathName = None, Pis = None, Pi_Q0 = None, beta = 0.7479, avgSpread = 0.0169, spread0 = 3, price0 = 260, verbose = False, kernel = 'powerlaw'):
-
-
-        tod, params=self.preprocessdata(paramsPath=paramsPath, todPath=todPath, kernel = kernel)
-        cols = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
-                "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
+    def sizedistributions(self, paramsPath, Pis = None, Pi_Q0 = None):
+        """
+        Returns the order size (Pis) and queue size (Pi_Q0) distributions of run, the AAPL ones or those of the stock in
+        paramsPath (AMZN.OQ, TSLA.OQ, INTC.OQ) for the ones that are None
+        """
         if Pis == None:
             ## AAPL
             Pis = {'lo_deep_Bid': [0.0028405540014542,
@@ -722,76 +479,169 @@ class Simulate:
                                       (1000, 0.0010547208579439046)]]}
             Pi_Q0["Bid_touch"] = Pi_Q0["Ask_touch"]
             Pi_Q0["Bid_deep"] = Pi_Q0["Ask_deep"]
+        return Pis, Pi_Q0
+
+    def widthdistributions(self, Pis, Pi_M0 = None, Pi_eta = None):
+        """
+        Returns the distributions of the small tick book: the order sizes Pis completed with those of the cancels (the
+        ones of the matching limit orders, the small tick book has no L3 queue to cancel from), the geometric parameters
+        Pi_M0 of the touch and deep widths m_T, m_D and Pi_eta of the distances eta_T, eta_IS, eta_T+1 at which orders
+        land, with defaults for the ones that are None
+        """
+        Pis = dict(Pis)
+        for side in ["Ask", "Bid"]:
+            Pis.setdefault("co_top_" + side, Pis["lo_top_" + side])
+            Pis.setdefault("co_deep_" + side, Pis["lo_deep_" + side])
+        if Pi_M0 == None:
+            Pi_M0 = {'m_T': 0.1,
+                     'm_D': 0.2}
+        if Pi_eta == None:
+            Pi_eta = {'eta_T' : .5,
+                      'eta_IS' : .6,
+                      'eta_T+1': .7}
+        return Pis, Pi_M0, Pi_eta
+
+    def run(self, T, paramsPath, todPath, s0 = None, filePathName = None, Pis = None, Pi_Q0 = None, beta = 0.7479, avgSpread = 0.0169, spread0 = 3, price0 = 260, verbose = False, kernel = 'powerlaw', recursive = False, numTerms = None, tol = 1e-2, batchSize = 1, bufferSize = 4096, inMemory = True, rng = None, jit = False, profiler = None, adaptiveBound = False, lookahead = 1., exact = False, checkpointPath = None, checkpointEvery = 1, resume = False, smallTick = False, Pi_M0 = None, Pi_eta = None, M_med = 100, poisson = None):
+        """
+        recursive: carry the cross excitations in a recursive kernel state (O(num_nodes**2) per candidate) instead of rescanning the 10 second history. See thinningOgataIS2.
+        numTerms, tol: sum of exponentials settings for kernel='powerlaw' with recursive=True
+        jit: numba compiled history window sums for recursive=False, see thinningOgataIS2
+        batchSize: max #of events generated per ThinningEngine.simulate call. A batch also ends after any spread changing event (SPREAD_EVENTS) so the LOB and the inspread intensities stay in sync.
+            batchSize=1 (default) reproduces the draw order of the event by event loop; larger batches (e.g. 256) are faster but draw the order sizes after the batch, so seeded paths differ from the batchSize=1 ones while having the same law.
+        filePathName: directory the path is streamed to in the PathStore format (see PathStore.PathWriter), one chunk every bufferSize events. A store already there is replaced, unless the run is resumed
+        bufferSize: #of LOB snapshots held in the SnapshotBuffer before they are appended to the returned lists and written to filePathName
+        inMemory: if False the returned Ts, lob only hold the initial book and the path is only kept in filePathName
+        rng: np.random.Generator or RNGService.RNGService every draw of the path (thinning, order sizes, cancels, refills) is taken from. The global np.random by default
+        profiler: Profiler.Profiler recording the time and call count of each stage: candidate, intensity, acceptance (see ThinningEngine), size, lob and snapshot (buffer appends and flushes, incl. the writes to filePathName). None (default) to disable
+        adaptiveBound, lookahead: see thinningOgataIS2. With verbose the acceptance rate of the thinning is printed at the end
+        exact: kernel='exp' only, opt-in. Sample the points exactly by compensator inversion with ExactExpEngine instead of thinning, with no rejected candidates but 3-6x the time per point of the recursive thinning. The kernel state is recursive (no 10 second truncation) and adaptiveBound, jit are unused
+        checkpointPath: file a Checkpoint.SimulationState is pickled to every checkpointEvery chunks written to filePathName, which is required. None (default) to disable
+        resume: restart from the state in checkpointPath (if it exists) instead of from zero. The other arguments, rng included, must be those of the interrupted run: the path, the returned lists and the store then end up bit-identical to an uninterrupted run
+        smallTick: simulate the small tick model with a SmallTickLOBState (touch and deep buckets a few ticks wide) instead of the two level LOBState. The lob snapshots and the PathStore then also hold the level widths (WIDTHS) and lobL3 is [None]
+        Pi_M0, Pi_eta, M_med: small tick widths and landing distances (see widthdistributions) and depth of the book in ticks
+        poisson: 'baseline' or 'stationary' to replace the Hawkes process by the TOD only inhomogeneous Poisson process of PoissonEngine with those rates, the null model of the Hawkes paths. recursive, exact, adaptiveBound and jit are then unused. None (default) for the Hawkes process
+        """
 
 
+        tod, params=self.preprocessdata(paramsPath=paramsPath, todPath=todPath, kernel = kernel)
+        cols = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
+                "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
+        Pis, Pi_Q0 = self.sizedistributions(paramsPath, Pis = Pis, Pi_Q0 = Pi_Q0)
+
+
+        if (checkpointPath is not None) and (filePathName is None):
+            raise Exception("checkpointPath needs filePathName, the path written so far is read back from it on resume")
+        if smallTick:
+            Pis, Pi_M0, Pi_eta = self.widthdistributions(Pis, Pi_M0 = Pi_M0, Pi_eta = Pi_eta)
+        sizeSamplers = OrderSizeSampler.fromdict(Pis, maxSize = 10000, rng = rng)
+        queueSamplers = OrderSizeSampler.fromdict(Pi_Q0, maxSize = 100000, rng = rng)
         if s0 is None:
             s = 0
         else:
             s = s0
-        Ts,lob,lobL3 = [],[],[]
-        _, lob0, lob0_l3 = self.createLOB({}, {}, Pi_Q0, priceMid0 = price0, spread0 = spread0, ticksize = 0.01, numOrdersPerLevel = 5, lob0 = {}, lob0_l3 = {})
-        #print("The initial LOB: lob0", lob0, "lob0_l3", lob0_l3)
-        Ts.append(0)
-        lob.append(lob0[-1])
-        lobL3.append(lob0_l3[-1])
-        spread = lob0[0]['Ask_touch'][0] - lob0[0]['Bid_touch'][0]
+        if smallTick:
+            widthSamplers = OrderSizeSampler.fromdict({k: (p, []) for k, p in Pi_M0.items()}, maxSize = 100, rng = rng) # geometric, no spikes
+            etaSamplers = OrderSizeSampler.fromdict({k: (p, []) for k, p in Pi_eta.items()}, maxSize = 100, rng = rng)
+            lobstate = SmallTickLOBState.fromprices(queueSamplers, widthSamplers, etaSamplers, priceMid0 = price0, spread0 = spread0, ticksize = 0.01, M_med = M_med)
+        else:
+            lobstate = LOBState.fromprices(queueSamplers, priceMid0 = price0, spread0 = spread0, ticksize = 0.01, numOrdersPerLevel = 10, numOrdersPerLevel0 = 5, rng = rng)
+        sizeSamplers = [None if ("co" in col and not smallTick) else sizeSamplers[col] for col in cols] # sizes of the cancels of the LOBState are drawn in the book
+        #print("The initial LOB: lob0", lobstate.todict(), "lob0_l3", lobstate.tol3dict())
+        Ts,lob,lobL3 = [],[],[lobstate.tol3dict()]
+        resuming = resume and (checkpointPath is not None) and os.path.exists(checkpointPath)
+        writer = None
+        if filePathName is not None: # a new run starts a new store, only a resumed one appends to the chunks it wrote
+            writer = PathWriter(filePathName, events = COLS, levels = LEVELS, meta = {"T": T, "kernel": kernel, "paramsPath": paramsPath, "todPath": todPath, "lob0_l3": lobL3[0], "widths": WIDTHS if smallTick else None, "poisson": poisson}, append = resuming)
+        def collect(chunk):
+            if inMemory or (len(Ts) == 0):
+                TsChunk, lobChunk = SnapshotBuffer.todicts(chunk)
+                Ts.extend(TsChunk if inMemory else TsChunk[:1])
+                lob.extend(lobChunk if inMemory else lobChunk[:1])
+        def onflush(chunk):
+            if writer is not None:
+                writer.append(chunk)
+            collect(chunk)
+        snapshots = SnapshotBuffer(capacity = bufferSize, onflush = onflush, widths = smallTick)
+        snapshots.append(s, -1, 0, lobstate)
+        spread = lobstate.spread()
         #print("initial spread: ", spread, "\n")
-        n = None
-        timestamps = None
-        timeseries=None
-        lob0 = lob0[0]
-        lob0_l3 = lob0_l3[0]
-        lamb = None
-        trials=1
-        left=None
+        kernelstate=None
+        if recursive:
+            if kernel == 'exp':
+                kernelstate=ExpKernelState(params[0], num_nodes=self.num_nodes, s=s)
+            elif kernel == 'powerlaw':
+                kernelstate=SumExpKernelState(params[0], num_nodes=self.num_nodes, s=s, numTerms=numTerms, tol=tol)
+                if verbose: print("max rel error of sum of exponential kernels = ", np.max(kernelstate.errors))
+            else:
+                raise Exception("kernel must be either 'exp' or 'powerlaw'")
+        if poisson is not None:
+            engine = PoissonEngine(params, tod, kernel = kernel, num_nodes = self.num_nodes, s = s, spread = spread, beta = beta, avgSpread = avgSpread, rng = rng, rates = poisson, history = False)
+        elif exact:
+            if kernel != 'exp':
+                raise Exception("exact sampling needs kernel='exp'")
+            engine = ExactExpEngine(params, tod, num_nodes = self.num_nodes, s = s, spread = spread, beta = beta, avgSpread = avgSpread, kernelstate = kernelstate, rng = rng, profiler = profiler, history = False)
+        else:
+            engine = ThinningEngine(params, tod, kernel = kernel, num_nodes = self.num_nodes, s = s, spread = spread, beta = beta, avgSpread = avgSpread, recursive = recursive, kernelstate = kernelstate, rng = rng, jit = jit, profiler = profiler, adaptiveBound = adaptiveBound, lookahead = lookahead, history = False)
         thinningtime=0
-        while s <= T:
+        if resuming:
+            state = SimulationState.load(checkpointPath)
+            writer.truncate(state.chunks)
+            lobL3[0] = state.lob0L3
+            reader = PathReader(filePathName)
+            for i in range(state.chunks if inMemory else min(1, state.chunks)):
+                collect(reader.chunk(i))
+            state.restore(engine, lobstate, snapshots, rng)
+            thinningtime = state.thinningtime
+        checkpointChunks = len(writer.index["chunks"]) if writer is not None else 0
+        while engine.s <= T:
             start=time.perf_counter_ns()
-            s, n, timestamps, tau, lamb, timeseries, left= self.thinningOgataIS2(T, params, tod, kernel = kernel, num_nodes=self.num_nodes, maxJumps = 1, s = s, n = n, Ts = timestamps, timeseries=timeseries, spread=spread, beta = beta, avgSpread = avgSpread,lamb= lamb, left=left)
-            timestamps_this=[()]*self.num_nodes
-            timestamps_this[timeseries[-1][1]]=(timeseries[-1][0],)
+            events = engine.simulate(T, maxJumps = batchSize, stopEvents = SPREAD_EVENTS)
             end=time.perf_counter_ns()
             thinningtime+=abs(end-start)
-            trials +=1
-            sizes = {}
-            dictTimestamps = {}
-            for t, col in zip(timestamps_this, cols):
-                if len(t) == 0: continue
-                if "co" in col: # handle size of cancel order in createLOB
-                    size = 0
-                else:
-                    pi = Pis[col] #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
-                    p = pi[0]
-                    dd = pi[1]
-                    pi = np.array([p*(1-p)**k for k in range(1,10000)])
-                    # pi = pi*(1-sum([d[1] for d in dd]))/sum(pi)
-                    for i, p_i in dd:
-                        pi[i-1] = p_i + pi[i-1]
-                    pi = pi/sum(pi)
-                    cdf = np.cumsum(pi)
-                    a = np.random.uniform(0, 1, size = len(t))
-                    if type(a) != float:
-                        size =[]
-                        for i in a:
-                            size.append(np.argmax(cdf>=i)+1)
-                    else:
-                        size = np.argmax(cdf>=a)+1
-                sizes[col]  = size
-                dictTimestamps[col] = t
-            #print("Sizes is: ", sizes)
-            TsTmp, lobTmp, lobL3Tmp = self.createLOB(dictTimestamps, sizes, Pi_Q0, lob0 = lob0, lob0_l3 = lob0_l3)
-            spread = lobTmp[-1]['Ask_touch'][0] - lobTmp[-1]['Bid_touch'][0]
-            lob0 = lobTmp[-1]
-            lob0_l3 = lobL3Tmp[-1]
-            #print("Snapshot LOB0: ", lob0, "\n")
-            if len(list(dictTimestamps.keys())):
-                Ts.append([list(dictTimestamps.keys())[0], TsTmp[-1], tau])
-                lob.append(lob0)
-            if (filePathName is not None)&(len(Ts)%100 == 0):
-                with open(filePathName , "wb") as f: #"/home/konajain/params/"
-                    pickle.dump((Ts, lob, lobL3), f)
+            for t, k, tau in events:
+                if profiler is not None: t0 = profiler.clock()
+                sampler = sizeSamplers[k]
+                size = 0 if sampler is None else sampler.sample() #geometric + dirac deltas; pi = (p, diracdeltas(i,p_i))
+                if profiler is not None:
+                    t1 = profiler.clock()
+                    profiler.add("size", t1 - t0)
+                size = lobstate.apply(k, size)
+                if profiler is not None:
+                    t0 = profiler.clock()
+                    profiler.add("lob", t0 - t1)
+                snapshots.append(t, k, tau, lobstate, size)
+                if profiler is not None: profiler.add("snapshot", profiler.clock() - t0)
+            engine.setspread(lobstate.spread())
+            if (checkpointPath is not None) and (len(writer.index["chunks"]) >= checkpointChunks + checkpointEvery):
+                checkpointChunks = len(writer.index["chunks"])
+                SimulationState(engine, lobstate, snapshots, rng, checkpointChunks, lobL3[0], thinningtime).save(checkpointPath)
+        if profiler is not None: t0 = profiler.clock()
+        snapshots.flush()
+        if profiler is not None: profiler.add("snapshot", profiler.clock() - t0)
+        if verbose:
+            print("thinning acceptance rate = ", engine.acceptancerate(), "candidates = ", engine.candidates, "bound refreshes = ", engine.refreshes)
+            if profiler is not None: print(profiler.report())
         return Ts, lob, lobL3, thinningtime
-    
+
+    def runpaths(self, T, paramsPath, todPath, numPaths, s0 = None, Pis = None, Pi_Q0 = None, beta = 0.7479, avgSpread = 0.0169, spread0 = 3, price0 = 260, verbose = False, kernel = 'powerlaw', numTerms = None, tol = 1e-2, lookahead = 1., rng = None, profiler = None):
+        """
+        Simulates numPaths independent paths of run in lockstep with MultiPathSimulate, for many short paths from the
+        same calibration. The paths have the law of run(recursive=True, adaptiveBound=True), not its seeded values.
+
+        numPaths: #of paths
+        rng: np.random.Generator or RNGService.RNGService every draw of every path is taken from. The global np.random by default
+        other arguments: see run
+        Returns the list of (Ts, lob, lobL3) of every path, as returned by run
+        """
+        tod, params = self.preprocessdata(paramsPath=paramsPath, todPath=todPath, kernel = kernel)
+        Pis, Pi_Q0 = self.sizedistributions(paramsPath, Pis = Pis, Pi_Q0 = Pi_Q0)
+        sim = MultiPathSimulate(params, tod, numPaths, Pis, Pi_Q0, kernel = kernel, s0 = 0 if s0 is None else s0, spread0 = spread0, price0 = price0, beta = beta, avgSpread = avgSpread, numTerms = numTerms, tol = tol, lookahead = lookahead, rng = rng, profiler = profiler)
+        chunks = sim.run(T)
+        if verbose:
+            print("thinning acceptance rate = ", sim.acceptancerate(), "candidates = ", sim.candidates)
+            if profiler is not None: print(profiler.report())
+        return [SnapshotBuffer.todicts(chunk) + ([lob0L3],) for chunk, lob0L3 in zip(chunks, sim.lob0L3)]
+
 DEBUG = False
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+import numpy as np
+
+COLS = ["lo_deep_Ask", "co_deep_Ask", "lo_top_Ask","co_top_Ask", "mo_Ask", "lo_inspread_Ask" ,
+        "lo_inspread_Bid" , "mo_Bid", "co_top_Bid", "lo_top_Bid", "co_deep_Bid","lo_deep_Bid" ]
+
+class TODTable:
+    """
+    Per time of day bin tables of the thinning, computed once for all the bins of tod.
+
+    The branching matrix of bin b is the kernel norm matrix with row i scaled by tod[i, b]. Its spectral radius (0.99 if
+    it is already below 1) gives the 0.99/specRad normalisation applied to the whole intensity in that bin, so every
+    per-event quantity that only depends on the bin is tabulated here and looked up by bin index:
+
+    norms: [num_nodes, num_nodes] kernel norms, mask*alpha/((beta - 1)*gamma) (powerlaw) or mask*alpha/beta (exp)
+    specRads: (numBins,) spectral radii of the branching matrices, floored to 0.99
+    todmults: [numBins, num_nodes, 1] tod multipliers times 0.99/specRad
+    baselines: [numBins, num_nodes, 1] todmults times the baselines (without the spread multiplier of the inspread ones)
+    jumps: [numBins, num_nodes, num_nodes, 1] jumps[b, k] is the intensity jump an event of type k adds in bin b, floored at 0
+
+    jumptotals gives the total jumps with the inspread ones scaled by the spread multiplier, cached per multiplier as
+    the spread only takes a few tick values.
+
+    Arguments:
+    params: [kernelparams, baselines] as returned by Simulate.preprocessdata
+    tod: [num_nodes, numBins] tod multipliers
+    kernel: 'powerlaw' or 'exp'
+    binLength: length of a bin in seconds
+    """
+    def __init__(self, params, tod, kernel = 'powerlaw', binLength = 1800):
+        if kernel not in ['exp', 'powerlaw']:
+            raise Exception("kernel must be either 'exp' or 'powerlaw'")
+        kernelparams = params[0]
+        num_nodes, numBins = tod.shape
+        self.kernel = kernel
+        self.tod = tod
+        self.binLength = binLength
+        self.lastBin = numBins - 1
+        if kernel == 'powerlaw':
+            self.norms = kernelparams[0]*kernelparams[1]/((kernelparams[2]-1) *kernelparams[3])
+        else:
+            self.norms = kernelparams[0]*kernelparams[1]/kernelparams[2]
+        self.specRads = np.zeros(numBins)
+        for b in range(numBins):
+            specRad = np.max(np.linalg.eig(tod[:, b].reshape((num_nodes, 1))*self.norms)[0]).real
+            if specRad < 1 : specRad = 0.99 # dont change actual specRad if already good
+            self.specRads[b] = specRad
+        self.todmults = np.stack([tod[:, b].reshape((num_nodes, 1)) * (0.99/self.specRads[b]) for b in range(numBins)])
+        self.baselines = self.todmults*params[1]
+        self.jumps = np.maximum(self.todmults[:, None, :, :] * kernelparams[0][None, :, :, None] * kernelparams[1][None, :, :, None], 0)
+        self._jumpTotals = {}
+
+    @classmethod
+    def fromdicts(cls, params, tod, kernel = 'powerlaw', binLength = 1800):
+        """
+        Builds the table from the fitted params and tod dictionaries ({cols[i] + "->" + cols[j]: (mask, thetas)}, {col: {bin: mult}}).
+        Missing kernels are treated as zero.
+        """
+        num_nodes = len(COLS)
+        numBins = len(tod[COLS[0]])
+        todArr = np.array([[tod[col][b] for b in range(numBins)] for col in COLS])
+        numParams = 4 if kernel == 'powerlaw' else 3
+        kernelparams = [np.zeros((num_nodes, num_nodes)), np.zeros((num_nodes, num_nodes))] + [np.full((num_nodes, num_nodes), 2.) for _ in range(numParams - 2)]
+        for i in range(num_nodes):
+            for j in range(num_nodes):
+                kernelParams = params.get(COLS[i] + "->" + COLS[j], None)
+                if kernelParams is None: continue
+                kernelparams[0][i][j] = kernelParams[0]
+                for p in range(1, numParams):
+                    kernelparams[p][i][j] = kernelParams[1][p - 1]
+        baselines = np.array([params[col] for col in COLS], dtype = float).reshape((num_nodes, 1))
+        return cls([kernelparams, baselines], todArr, kernel = kernel, binLength = binLength)
+
+    def jumptotals(self, spreadMult, inspreadOff = False):
+        """
+        [numBins, num_nodes] total intensity jump of an event of each type in each bin, the jumps on the inspread
+        dimensions 5, 6 being scaled by spreadMult (dropped if inspreadOff). Summed left to right over the dimensions.
+        """
+        key = (float(spreadMult), bool(inspreadOff))
+        totals = self._jumpTotals.get(key)
+        if totals is None:
+            jumps = self.jumps[:, :, :, 0].copy()
+            jumps[:, :, 5:7] = 0 if inspreadOff else spreadMult*jumps[:, :, 5:7]
+            totals = self._jumpTotals[key] = np.cumsum(jumps, axis = 2)[:, :, -1]
+        return totals
+
+    def stationaryrates(self):
+        """
+        [numBins, num_nodes] stationary mean intensities of each bin, the solution of
+        lambda = todmults*(baselines + norms.T @ lambda) of the linear (unfloored) intensities at the base spread, floored at 0
+        """
+        rates = np.zeros(self.baselines.shape[:2])
+        for b in range(self.lastBin + 1):
+            c = self.todmults[b, :, 0]
+            rates[b] = np.linalg.solve(np.eye(len(c)) - c[:, None]*self.norms.T, self.baselines[b, :, 0])
+        return np.maximum(rates, 0)
+
+    def hourindex(self, s):
+        """Bin of time s, the last bin holding everything after it"""
+        return min(self.lastBin, int(s//self.binLength))
+
+    def binend(self, s):
+        """End of the bin of time s, inf in the last bin"""
+        hourIndex = self.hourindex(s)
+        return np.inf if hourIndex == self.lastBin else (hourIndex + 1)*self.binLength
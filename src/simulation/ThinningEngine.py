@@ -0,0 +1,292 @@
+import numpy as np
+
+from simulation.functions import kernelTables, historyKernelSum
+from simulation.KernelState import ExpKernelState, SumExpKernelState
+from simulation.TODTable import TODTable
+from simulation.EventWindow import EventWindow, EventSink
+
+SPREAD_EVENTS = (3, 4, 5, 6, 7, 8) # co_top, mo and lo_inspread events: the only ones that can move the touch prices
+
+class ThinningEngine:
+    """
+    Ogata thinning for the 12 dimensional Hawkes process of Simulate, with the thinning state kept between calls.
+
+    Holds everything thinningOgataIS2 used to pass back and forth (s, n, Ts, timeseries, left, lamb, kernelstate) and
+    generates accepted events in chunks. The intensities only need the points of the last 10 seconds (none in recursive
+    mode) and the last point of each type, kept in an EventWindow and an array: memory stays flat over the run. The full
+    Ts and timeseries are only kept, in an EventSink, if history. The spectral radius normalisation, TOD multipliers and event jumps are looked up
+    per 30 min TOD bin in a TODTable and the spread dependent inspread multipliers are only recomputed when setspread is
+    called. A chunk can be stopped after any event
+    in stopEvents so that the caller can update the LOB and feed the new spread back before the inspread intensities
+    are used again.
+
+    Arguments:
+    params, tod, kernel, num_nodes, beta, avgSpread, recursive, kernelstate, numTerms, tol: see Simulate.thinningOgataIS2
+    s: start time
+    spread: current spread, used to scale the inspread baselines and intensities
+    timeseries, n, Ts, lamb, left: state of a previous thinning run to resume from, fresh if None
+    rng: np.random.Generator (or anything with a uniform(low, high) method) to draw from, the global np.random by default
+    jit: evaluate the 10 second history window with the numba compiled loop of functions.historyKernelSum
+    profiler: Profiler the candidate, intensity and acceptance stages of simulate are timed into, None to disable
+    todtable: TODTable of params and tod, built if None. Pass it in to share it between engines
+    adaptiveBound: draw the candidates at a dominating bound made of the excitatory kernel parts (see simulate) instead of
+        the intensity at the last candidate plus the last jump, which inhibitory kernels, TOD bin changes and spread
+        widenings can exceed
+    lookahead: length in seconds of the look-ahead windows of adaptiveBound
+    history: keep every point so that Ts and timeseries can be returned, the caller keeping its own output otherwise
+    """
+    def __init__(self, params, tod, kernel = 'powerlaw', num_nodes = 12, s = 0, spread = 1, beta = 0.7479, avgSpread = 0.0169, recursive = False, kernelstate = None, numTerms = None, tol = 1e-2, timeseries = None, n = None, Ts = None, lamb = None, left = None, rng = None, jit = False, profiler = None, todtable = None, adaptiveBound = False, lookahead = 1., history = True):
+        if kernel not in ['exp', 'powerlaw']:
+            raise Exception("kernel must be either 'exp' or 'powerlaw'")
+        self.params = params
+        self.tod = tod
+        self.kernel = kernel
+        self.num_nodes = num_nodes
+        self.beta = beta
+        self.avgSpread = avgSpread
+        self.recursive = recursive
+        self.rng = np.random if rng is None else rng
+        self.s = 0 if s is None else s
+        self.n = num_nodes*[0] if n is None else n
+        timeseries = [] if timeseries is None else timeseries
+        self.left = 0 if left is None else left
+        # last point of each type, for tau
+        self.lastT = np.zeros(num_nodes)
+        if Ts is not None:
+            for k, ts in enumerate(Ts):
+                if len(ts) > 0: self.lastT[k] = ts[-1]
+        # points of the 10 second history window, none in recursive mode where the kernel state holds the history
+        self.window = EventWindow()
+        if not recursive: self.window.extend(timeseries[self.left:])
+        self.sink = None
+        if history:
+            self.sink = EventSink()
+            self.sink.extend(timeseries)
+        self.jit = jit
+        self.profiler = profiler
+        self.tables = kernelTables(params[0], kernel)
+        self.positiveJumps = np.maximum(self.tables[0], 0)
+        self.adaptiveBound = adaptiveBound
+        self.lookahead = lookahead
+        self.excBound = None # excitatory kernel sums of the adaptive bound, computed on the first candidate
+        self.candidates = 0 # tested candidates
+        self.accepted = 0
+        self.refreshes = 0 # adaptive bound evaluations without a candidate
+        self.todtable = TODTable(params, tod, kernel = kernel) if todtable is None else todtable
+        self.setspread(1 if spread is None else spread)
+        if lamb is None:
+            decays = self.todtable.todmults[self.hourindex(self.s)] * self.baselines
+            lamb = np.sum(decays)
+        self.lamb = lamb
+        if recursive and (kernelstate is None):
+            if kernel == 'exp':
+                kernelstate = ExpKernelState.fromhistory(params[0], timeseries, self.s, num_nodes=num_nodes)
+            else:
+                kernelstate = SumExpKernelState.fromhistory(params[0], timeseries, self.s, num_nodes=num_nodes, numTerms=numTerms, tol=tol)
+        self.kernelstate = kernelstate
+
+    def hourindex(self, s):
+        return self.todtable.hourindex(s)
+
+    @property
+    def timeseries(self):
+        """Every point as a list of (time, event), only kept with history"""
+        if self.sink is None: raise Exception("the engine was built with history=False, it keeps no timeseries")
+        t, k = self.sink.arrays()
+        return list(zip(t.tolist(), k.tolist()))
+
+    @property
+    def Ts(self):
+        """Tuple of the times of each type, only kept with history"""
+        if self.sink is None: raise Exception("the engine was built with history=False, it keeps no Ts")
+        t, k = self.sink.arrays()
+        return [tuple(t[k == i].tolist()) for i in range(self.num_nodes)]
+
+    def spectralradius(self, hourIndex):
+        """Spectral radius of the TOD scaled branching matrix in bin hourIndex (0.99 if already below 1)"""
+        return self.todtable.specRads[hourIndex]
+
+    def setspread(self, spread):
+        """Sets the spread the inspread (5, 6) baselines and intensities are scaled by"""
+        self._setspreadmult(spread)
+        self.baselines = self.params[1].copy()
+        self.baselines[5] = self.spreadMult*self.baselines[5]
+        self.baselines[6] = self.spreadMult*self.baselines[6]
+
+    def getstate(self):
+        """
+        Dynamic state of the engine as a dictionary, to resume it with setstate on an engine built with the same
+        arguments. Only the history the intensities still depend on is kept: the last point of each type and the
+        10 second window (empty in recursive mode, where the kernel state holds it), not the history of the sink.
+        """
+        return {"s": self.s, "n": list(self.n), "lastT": self.lastT.copy(), "windowT": self.window.times().copy(),
+                "windowK": self.window.types().copy(), "left": self.left, "lamb": self.lamb,
+                "kernelstate": self.kernelstate, "spread": self.spread, "spreadMult": self.spreadMult, "inspreadOff": self.inspreadOff,
+                "baselines": self.baselines.copy(), "excBound": self.excBound, "candidates": self.candidates, "accepted": self.accepted,
+                "refreshes": self.refreshes}
+
+    def setstate(self, state):
+        """Restores a state returned by getstate. With history, the sink restarts from the points of the window"""
+        for name in ["s", "n", "left", "lamb", "kernelstate", "spread", "spreadMult", "inspreadOff", "baselines", "excBound", "candidates", "accepted", "refreshes"]:
+            setattr(self, name, state[name])
+        self._setjumptotals()
+        self.lastT = state["lastT"].copy()
+        points = list(zip(state["windowT"], state["windowK"]))
+        self.window = EventWindow(max(1024, 2*len(points)))
+        self.window.extend(points)
+        if self.sink is not None:
+            self.sink = EventSink()
+            self.sink.extend(points)
+
+    def _setspreadmult(self, spread):
+        self.spread = spread
+        self.spreadMult = (spread/self.avgSpread)**self.beta
+        self.inspreadOff = 100*np.round(spread, 2) < 2
+        self._setjumptotals()
+
+    def _setjumptotals(self):
+        """Total intensity jump of an event of each type in each TOD bin at the current spread, see TODTable.jumptotals"""
+        self.jumpTotals = self.todtable.jumptotals(self.spreadMult, self.inspreadOff)
+
+    def _record(self, s, k):
+        """Adds an accepted point of type k at time s to the history and returns its tau"""
+        T_Minus1 = self.lastT[k]
+        tau = self.baselines[k][0]
+        if k in [5, 6]: tau = self.spreadMult*tau
+        tau = tau*(s-T_Minus1)
+
+        """Updating history and returns"""
+        self.lastT[k] = s
+        self.n[k]+=1
+        if self.sink is not None: self.sink.append(s, k)
+        if self.recursive:
+            self.kernelstate.addpoint(s, k)
+        else:
+            self.window.append(s, k)
+        return tau
+
+    def acceptancerate(self):
+        """Fraction of the candidates tested so far that were accepted"""
+        return self.accepted/self.candidates if self.candidates > 0 else np.nan
+
+    def _intensities(self, s, bound = False):
+        """
+        Returns hourIndex, todmult and the (num_nodes, 1) intensities at time s. If bound, also stores in excBound the
+        kernel sums at s restricted to the excitatory kernels, from which _bound is computed.
+        """
+        num_nodes = self.num_nodes
+        window = self.window
+        hourIndex = self.hourindex(s)
+        todmult=self.todtable.todmults[hourIndex]
+        decays=todmult * self.baselines
+        if bound: self.excBound = np.zeros((num_nodes, 1))
+        """Summing cross excitations for previous points"""
+        if self.recursive:
+            decays+=todmult*self.kernelstate.excitation(s)
+            if bound: self.excBound = self.kernelstate.excitatory(s)
+        elif len(window) > 0:
+            self.left += window.dropolder(s, 10)
+            if len(window) > 0:
+                if bound:
+                    kern, exc=historyKernelSum(s-window.times(), window.types(), *self.tables, jit=self.jit, positiveJumps=self.positiveJumps)
+                    self.excBound = exc.reshape((num_nodes, 1))
+                else:
+                    kern=historyKernelSum(s-window.times(), window.types(), *self.tables, jit=self.jit)
+                decays+=todmult*kern.reshape((num_nodes, 1))
+        decays=np.maximum(decays, 0)
+        decays[5] = self.spreadMult*decays[5]
+        decays[6] = self.spreadMult*decays[6]
+        if self.inspreadOff:
+            decays[5] = decays[6] = 0
+        return hourIndex, todmult, decays
+
+    def _bound(self, hourIndex):
+        """
+        Total intensity in TOD bin hourIndex with the kernel sums replaced by excBound. The excitatory kernels only decay
+        and the inhibitory ones are dropped, so it dominates the total intensity from the time excBound was computed at
+        until the end of the bin, with the jumps of the events accepted since added to excBound. The current spread
+        multiplier is used, so it stays valid when the spread changes.
+        """
+        upper = np.maximum(self.todtable.todmults[hourIndex]*(self.baselines + self.excBound), 0)
+        upper[5] = self.spreadMult*upper[5]
+        upper[6] = self.spreadMult*upper[6]
+        if self.inspreadOff:
+            upper[5] = upper[6] = 0
+        return float(upper.sum())
+
+    def simulate(self, T, maxJumps = None, stopEvents = ()):
+        """
+        Generates accepted events until s > T, maxJumps events were accepted or an event in stopEvents was accepted.
+        Returns the list of accepted (s, k, tau) where tau is the integrated baseline since the previous point of type k.
+
+        With adaptiveBound the candidates are drawn at the dominating intensity of _bound, refreshed at every tested
+        candidate. A candidate that would land past the end of the look-ahead window (lookahead seconds, cut at the end of
+        the TOD bin) is not tested: the time moves to the window end and the bound is refreshed there instead, which also
+        replaces the 0.1 second waits of a zero intensity.
+        """
+        events = []
+        s = self.s
+        lamb = self.lamb
+        rng = self.rng
+        prof = self.profiler
+        todtable = self.todtable
+        adaptive = self.adaptiveBound
+        while s<=T:
+            if prof is not None: t0 = prof.clock()
+            stop = False
+            if adaptive:
+                if self.excBound is None:
+                    self._intensities(s, bound = True)
+                    self.refreshes += 1
+                lamb_bar = self._bound(self.hourindex(s))
+                end = min(s + self.lookahead, todtable.binend(s))
+                u=rng.uniform(0, 1)
+                w = max(1e-7, -1 * np.log(u)/lamb_bar) if lamb_bar > 0 else np.inf # floor at 0.1 microsec
+                if s + w > end:
+                    s = end # no candidate in the window, refresh the bound at its end
+                    if s <= T:
+                        self._intensities(s, bound = True)
+                        self.refreshes += 1
+                    if prof is not None: prof.add("candidate", prof.clock() - t0)
+                    continue
+                s+=w
+            else:
+                lamb_bar=lamb
+                u=rng.uniform(0, 1)
+                if lamb_bar==0:
+                    s+=0.1  # wait for some time
+                else:
+                    w=max(1e-7, -1 * np.log(u)/lamb_bar) # floor at 0.1 microsec
+                    s+=w
+            if prof is not None:
+                t1 = prof.clock()
+                prof.add("candidate", t1 - t0)
+            """Recalculating baseline lambdas sum with new candidate"""
+            hourIndex, todmult, decays = self._intensities(s, bound = adaptive)
+            cumulative = np.cumsum(decays[:, 0]) # summed left to right, as the type search below
+            lamb = cumulative[-1]
+            self.candidates += 1
+            if prof is not None:
+                t0 = prof.clock()
+                prof.add("intensity", t0 - t1)
+
+            """Testing candidate point"""
+            D=rng.uniform(0, 1)
+            if D*lamb_bar<=lamb:
+                """Accepted so assign candidate point to a process by a ratio of intensities"""
+                k = min(int(np.searchsorted(cumulative, D*lamb_bar, side = 'right')), self.num_nodes - 1)
+                if k in [5, 6]:
+                    self._setspreadmult(self.spread-0.01) # the baselines keep the old spread until the caller calls setspread
+
+                """Precalc next value of lambda_bar"""
+                lamb += self.jumpTotals[hourIndex, k]
+                if adaptive: self.excBound = self.excBound + self.positiveJumps[k].reshape((self.num_nodes, 1))
+
+                events.append((s, k, self._record(s, k)))
+                self.accepted += 1
+                stop = (k in stopEvents) or ((maxJumps is not None) and (len(events)>=maxJumps))
+            if prof is not None: prof.add("acceptance", prof.clock() - t0)
+            if stop: break
+        self.s = s
+        self.lamb = lamb
+        return events
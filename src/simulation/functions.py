@@ -1,5 +1,11 @@
+import warnings
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError: # numba is optional, historyKernelSum(jit=True) falls back to numpy without it
+    njit = None
+
 def powerLawKernel(x, alpha = 1., t0 = 1., beta = -2.):
     if x < t0: return 0
     return alpha*(x**beta)
@@ -15,3 +21,96 @@ def powerLawKernelIntegral(x1, x2, alpha = 1., t0 = 1., beta = -2.):
 
 def expKernel(x, alpha, beta):
     return alpha*np.exp(-x*beta)
+
+def powerLawCutoffSumExp(thetas, numTerms = None, tol = 1e-2, horizon = 10., maxTerms = 24):
+    """
+    Approximates the power law with cutoff alpha/(1 + gamma*t)**beta on [0, horizon] by a sum of exponentials sum_m weights[m]*exp(-rates[m]*t)
+
+    Arguments:
+    thetas: (alpha, beta, gamma), e.g. the thetas returned by ParametricFit.fitPowerLawCutoff
+    numTerms: number of exponentials. If None, the smallest number of terms (up to maxTerms) meeting tol is used
+    tol: target for the max relative error over [0, horizon]
+    horizon: time range (in seconds) the approximation is fitted on
+    Returns:
+    weights, rates: arrays of length numTerms
+    err: the max relative error of the approximation over [0, horizon]
+    """
+    from scipy.optimize import nnls
+    alpha, beta, gamma = thetas[0], thetas[1], thetas[2]
+    times = np.append([0], np.logspace(np.log10(1e-2/gamma), np.log10(horizon), 400))
+    funcEval = (1 + gamma*times)**(-1*beta)
+    termsGrid = [numTerms] if numTerms is not None else range(4, maxTerms + 1)
+    for M in termsGrid:
+        # rates geometrically spaced from the horizon out to a few times the cutoff, weights by NNLS on the relative error
+        rates = np.logspace(np.log10(0.5/horizon), np.log10(5*gamma), M)
+        A = np.exp(-1*np.outer(times, rates))/funcEval.reshape((-1, 1))
+        weights, _ = nnls(A, np.ones(len(times)))
+        err = np.max(np.abs(A.dot(weights) - 1))
+        if err <= tol: break
+    if (numTerms is None) and (err > tol):
+        warnings.warn(f"sum of exponentials did not reach tol = {tol} with {maxTerms} terms, max rel error = {err}")
+    return alpha*weights, rates, err
+
+def kernelTables(kernelparams, kernel = 'powerlaw'):
+    """
+    Precomputes the [num_nodes, num_nodes] tables historyKernelSum gathers from: jumps = mask*alpha, beta and gamma (None for the exp kernel)
+
+    Arguments:
+    kernelparams: [mask, alpha, beta(, gamma)] as returned in params[0] by Simulate.preprocessdata
+    """
+    if kernel == 'powerlaw':
+        return np.ascontiguousarray(kernelparams[0]*kernelparams[1]), np.ascontiguousarray(kernelparams[2], dtype = float), np.ascontiguousarray(kernelparams[3], dtype = float)
+    elif kernel == 'exp':
+        return np.ascontiguousarray(kernelparams[0]*kernelparams[1]), np.ascontiguousarray(kernelparams[2], dtype = float), None
+    raise Exception("kernel must be either 'exp' or 'powerlaw'")
+
+def historyKernelSum(dt, types, jumps, beta, gamma = None, jit = False, positiveJumps = None):
+    """
+    Sums the kernels of a window of past points on every target dimension in one call:
+    out[j] = sum_n phi_{types[n], j}(dt[n]) with phi_ij(t) = jumps_ij/(1 + gamma_ij*t)**beta_ij (power law with cutoff) or jumps_ij*exp(-beta_ij*t) if gamma is None.
+
+    Arguments:
+    dt: (N,) ages s - t_n of the points
+    types: (N,) dimensions of the points
+    jumps, beta, gamma: tables from kernelTables
+    jit: use the numba compiled loop (numpy is used if numba is not installed)
+    positiveJumps: np.maximum(jumps, 0). If given, the sum restricted to the excitatory kernels is returned as well,
+        reusing the kernel evaluations. It only decays until the next point, so it bounds out from above.
+    Returns:
+    (num_nodes,) vector of summed excitations, and the (num_nodes,) excitatory sum if positiveJumps is given
+    """
+    if jit and (njit is not None):
+        dt, types = np.asarray(dt, dtype = float), np.asarray(types, dtype = np.int64)
+        if gamma is None:
+            out = _expHistoryLoop(dt, types, jumps, beta)
+            return out if positiveJumps is None else (out, _expHistoryLoop(dt, types, positiveJumps, beta))
+        out = _powerLawHistoryLoop(dt, types, jumps, beta, gamma)
+        return out if positiveJumps is None else (out, _powerLawHistoryLoop(dt, types, positiveJumps, beta, gamma))
+    dt = np.asarray(dt, dtype = float).reshape((-1, 1))
+    if gamma is None:
+        kern = np.exp(-1*dt*beta[types])
+        out = np.sum(jumps[types]*kern, axis = 0)
+        return out if positiveJumps is None else (out, np.sum(positiveJumps[types]*kern, axis = 0))
+    kern = (1 + gamma[types]*dt)**beta[types]
+    out = np.sum(jumps[types]/kern, axis = 0)
+    return out if positiveJumps is None else (out, np.sum(positiveJumps[types]/kern, axis = 0))
+
+def _powerLawHistoryLoop(dt, types, jumps, beta, gamma):
+    out = np.zeros(jumps.shape[1])
+    for n in range(dt.shape[0]):
+        k = types[n]
+        for j in range(jumps.shape[1]):
+            out[j] += jumps[k, j]/((1 + gamma[k, j]*dt[n])**beta[k, j])
+    return out
+
+def _expHistoryLoop(dt, types, jumps, beta):
+    out = np.zeros(jumps.shape[1])
+    for n in range(dt.shape[0]):
+        k = types[n]
+        for j in range(jumps.shape[1]):
+            out[j] += jumps[k, j]*np.exp(-1*beta[k, j]*dt[n])
+    return out
+
+if njit is not None:
+    _powerLawHistoryLoop = njit(cache = True)(_powerLawHistoryLoop)
+    _expHistoryLoop = njit(cache = True)(_expHistoryLoop)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+#The tests import RLenv from the repository root and the simulation package from src, as the scripts of src do
+_root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [_root, os.path.join(_root, "src")]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
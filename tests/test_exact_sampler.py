@@ -0,0 +1,127 @@
+import copy
+import numpy as np
+import pytest
+from scipy import integrate, stats
+from run_benchmarks import fakeArrays, writeFakeParams
+from simulation.ThinningEngine import ThinningEngine, SPREAD_EVENTS
+from simulation.ExactExpEngine import ExactExpEngine
+from simulation.TODTable import TODTable
+from simulation.Simulate import Simulate
+
+"""
+Statistical checks that ExactExpEngine samples the exp kernel process of ThinningEngine(recursive=True).
+
+For each of the SEEDS, every sampler simulates PATHS independent seeded paths on [S0, S0 + T], across the end of the
+first TOD bin, with the fake exp params of generate_fake_data.py for that seed, the spread being reset to SPREAD after
+every spread changing event as the LOB would. Each path is replayed through the exact compensator: its increments
+between the points must be iid Exp(1) (time rescaling) and the #of points minus the compensator must have mean 0. The
+points of a path are clustered, so the exact and thinning paths are compared on per path summaries (#of points, mean
+log inter-event time, inspread share). The SEEDS are the first five, some near critical, and the NUM_TESTS p-values
+over all of them are Bonferroni corrected: each test is run at ALPHA/NUM_TESTS, so that the whole family is at ALPHA.
+"""
+
+PATHS = 200
+S0 = 1790
+T = 20.
+SPREAD = 0.0169 # the avgSpread: the inspread multiplier is 1
+SEEDS = [0, 1, 2, 3, 4]
+SUMMARIES = ["#of points", "mean log inter-event time", "inspread share"]
+NUM_TESTS = len(SEEDS)*(2*2 + len(SUMMARIES)) # KS and t-test of the rescaling of both samplers, KS of every summary
+ALPHA = 0.01
+
+def simulatePaths(name, seed, params, tod, todtable):
+    """Returns the list of [(t, k)] of every path, the last point of a path being the first one after S0 + T"""
+    paths = []
+    end = S0 + T
+    for path in range(PATHS):
+        rng = np.random.default_rng([seed, path, ["exact", "thinning"].index(name)])
+        if name == "exact":
+            engine = ExactExpEngine(params, tod, s = S0, spread = SPREAD, rng = rng, todtable = todtable)
+        else:
+            engine = ThinningEngine(params, tod, kernel = 'exp', recursive = True, adaptiveBound = True, s = S0, spread = SPREAD, rng = rng, todtable = todtable)
+        points = []
+        while (len(points) == 0) or (points[-1][0] <= end):
+            points += [(t, k) for t, k, _ in engine.simulate(np.inf, maxJumps = 1 if engine.s > end else None, stopEvents = SPREAD_EVENTS)]
+            engine.setspread(SPREAD)
+        paths.append([point for point in points if point[0] <= end] + [point for point in points if point[0] > end][:1])
+    return paths
+
+def rescale(paths, params, tod, todtable):
+    """Compensator increments between the points of every path, and (#of points, compensator) of every path"""
+    increments, totals = [], []
+    end = S0 + T
+    for points in paths:
+        engine = ExactExpEngine(params, tod, s = S0, spread = SPREAD, todtable = todtable)
+        total = 0.
+        for t, k in points:
+            if t > end:
+                totals.append((len(points) - 1, total + engine.compensator(end)))
+            increment = engine.compensator(t)
+            increments.append(increment)
+            total += increment
+            engine.addpoint(t, k)
+            if k in SPREAD_EVENTS: engine.setspread(SPREAD)
+    return np.array(increments), np.array(totals)
+
+def summaries(paths):
+    """Per path #of points, mean log inter-event time and share of inspread points"""
+    res = []
+    for points in paths:
+        points = points[:-1]
+        times = np.array([t for t, _ in points])
+        types = np.array([k for _, k in points], dtype = int)
+        res.append((len(points), np.mean(np.log(np.diff(times))) if len(points) > 1 else np.nan,
+                    np.mean((types == 5) | (types == 6)) if len(points) > 0 else np.nan))
+    return np.array(res)
+
+@pytest.fixture(scope = "module", params = SEEDS)
+def setup(request):
+    tod, params = fakeArrays('exp', request.param)
+    return request.param, params, tod, TODTable(params, tod, kernel = 'exp')
+
+@pytest.fixture(scope = "module")
+def paths(setup):
+    return {name: simulatePaths(name, *setup) for name in ["exact", "thinning"]}
+
+@pytest.mark.parametrize("name", ["exact", "thinning"])
+def test_time_rescaling(setup, paths, name):
+    increments, totals = rescale(paths[name], *setup[1:])
+    assert stats.kstest(increments, "expon").pvalue >= ALPHA/NUM_TESTS
+    assert stats.ttest_1samp(totals[:, 0] - totals[:, 1], 0.).pvalue >= ALPHA/NUM_TESTS
+
+@pytest.mark.parametrize("summary", SUMMARIES)
+def test_paths_match_thinning(paths, summary):
+    i = SUMMARIES.index(summary)
+    x, y = summaries(paths["exact"])[:, i], summaries(paths["thinning"])[:, i]
+    assert stats.ks_2samp(x[~np.isnan(x)], y[~np.isnan(y)]).pvalue >= ALPHA/NUM_TESTS
+
+def test_compensator_matches_quadrature():
+    """
+    The compensator against the quadrature of the intensities of ThinningEngine, from the states of a path of the
+    near critical seed 2 params, on which inhibited intensities cross zero
+    """
+    tod, params = fakeArrays('exp', 2)
+    todtable = TODTable(params, tod, kernel = 'exp')
+    engine = ThinningEngine(params, tod, kernel = 'exp', recursive = True, adaptiveBound = True, s = 1800, spread = SPREAD, rng = np.random.default_rng(1), todtable = todtable)
+    for _ in range(60):
+        engine.simulate(np.inf, maxJumps = 5, stopEvents = SPREAD_EVENTS)
+        engine.setspread(SPREAD)
+        s = engine.s
+        dt = min(1., todtable.binend(s) - s)
+        exact = ExactExpEngine(params, tod, s = s, spread = SPREAD, todtable = todtable, kernelstate = copy.deepcopy(engine.kernelstate))
+        probe = ThinningEngine(params, tod, kernel = 'exp', recursive = True, s = s, spread = SPREAD, todtable = todtable, kernelstate = copy.deepcopy(engine.kernelstate))
+        state = probe.kernelstate.state.copy()
+        def intensity(v, j):
+            probe.kernelstate.state, probe.kernelstate.s = state.copy(), s # the kernel state only moves forward
+            return probe._intensities(s + v)[2][j, 0]
+        quadrature = sum(integrate.quad(intensity, 0, dt, args = (j,), limit = 200, epsabs = 1e-11, epsrel = 1e-11)[0] for j in range(probe.num_nodes))
+        assert exact.compensator(s + dt) == pytest.approx(quadrature, rel = 1e-7, abs = 1e-9)
+
+def test_run_exact(tmp_path):
+    paramsPath, todPath = writeFakeParams(str(tmp_path), 'exp', 0)
+    Ts, lob, _, _ = Simulate().run(100, paramsPath, todPath, beta = 1., avgSpread = .01, spread0 = 5, price0 = 45, kernel = 'exp', exact = True, rng = np.random.default_rng(0))
+    times = [t for _, t, _ in Ts[1:]]
+    assert len(times) > 0 and len(lob) == len(Ts)
+    assert np.all(np.diff(times) >= 0) and times[-2] <= 100 # as with thinning, the last point is the first one after T
+    with pytest.raises(Exception):
+        Simulate().run(100, paramsPath, todPath, kernel = 'powerlaw', exact = True)
@@ -0,0 +1,115 @@
+import numpy as np
+from RLenv.Stochastic_Processes.Arrival_Models import ArrivalModel
+from RLenv.SimulationEntities.TradingAgent import TradingAgent
+from RLenv.SimulationEntities.Exchange import Exchange
+from RLenv.Messages.ExchangeMessages import OrderExecutedMsg
+from RLenv.OrderBook import OrderBook
+from RLenv.Orders import LimitOrder
+from RLenv.Kernel import Kernel
+from simulation.LOBState import LOBState, COLS
+
+#Every order has size 10 and every queue 5 orders, so that the volume a cancel removes does not depend on which order
+#it picks. No cancel depletes a deep queue, which LOBState moves one tick outwards and the Exchange refills in place.
+SIZE=10
+NUMORDERS=5
+#(side, order type, level, size) of the public orders, None for the order of the agent
+SCRIPT=[("Ask", "lo", "Ask_L1", 10),
+        ("Bid", "lo", "Bid_L2", 10),
+        ("Ask", "mo", None, 20),
+        ("Ask", "co", "Ask_L2", None),
+        ("Bid", "co", "Bid_L1", None),
+        ("Bid", "mo", None, 70), #depletes the bid touch and eats 30 of the deep queue
+        ("Ask", "lo", "Ask_inspread", 10),
+        ("Bid", "lo", "Bid_inspread", 10),
+        None, #agent limit order joining the ask touch
+        ("Ask", "mo", None, 20), #fills the agent order and depletes the ask touch
+        ("Bid", "co", "Bid_L1", None), #depletes the bid touch
+        ("Ask", "co", "Ask_L1", None),
+        ("Ask", "mo", None, 35)] #depletes the ask touch and partially fills the front of the deep queue
+
+class ScriptedArrival(ArrivalModel):
+    """Arrival model replaying SCRIPT, its queues holding NUMORDERS orders of SIZE"""
+    def __init__(self) -> None:
+        super().__init__(params={}, seed=1)
+        self.script=[]
+        self.updates=[]
+    def generate_orders_in_queue(self, loblevel, numorders=10):
+        return numorders*[SIZE]
+    def generate_ordersize(self, loblevel):
+        return SIZE
+    def get_nextarrival(self):
+        return self.script.pop(0) if self.script else None
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+    def reset(self):
+        pass
+    def seed(self):
+        pass
+
+class ConstantSampler:
+    def sample(self):
+        return NUMORDERS*SIZE
+
+def event(side, ordertype, level):
+    """Column of COLS of the order"""
+    if ordertype=="mo":
+        return COLS.index(f"mo_{side}")
+    if ordertype=="lo" and level.endswith("inspread"):
+        return COLS.index(f"lo_inspread_{side}")
+    return COLS.index(f"{ordertype}_{'top' if level.endswith('L1') else 'deep'}_{side}")
+
+def book(exchange: Exchange):
+    """The Exchange book as LOBState levels: {level: (price in ticks, queue sizes)}"""
+    rtn={}
+    for side in OrderBook.SIDES:
+        for i, name in enumerate(["touch", "deep"]):
+            level=exchange.book.level(side, i)
+            rtn[f"{side}_{name}"]=(exchange.book.tick(level.price), [order.size for order in level])
+    return rtn
+
+def reference(state: LOBState):
+    """The LOBState book as book does, without the empty orders LOBState leaves at the front of a queue a market order ate exactly"""
+    queues=state.tol3dict()
+    return {level: (int(round(price/state.ticksize)), [size for size in queues[level] if size>0]) for level, (price, _) in state.todict().items()}
+
+def test_exchange_matches_lobstate():
+    arrival=ScriptedArrival()
+    agent=TradingAgent(seed=1)
+    exchange=Exchange(Arrival_model=arrival, agents=[agent], numOrdersPerLevel=NUMORDERS)
+    kernel=Kernel(agents=[agent], exchange=exchange, log_to_file=False)
+    exchange.initialize_exchange(priceMid0=45, spread0=4)
+    kernel.queue.clear()
+    samplers={level: ConstantSampler() for level in ["Ask_deep", "Ask_touch", "Bid_touch", "Bid_deep"]}
+    state=LOBState.fromprices(samplers, priceMid0=45, spread0=4, numOrdersPerLevel=NUMORDERS, rng=np.random.RandomState(0))
+    assert book(exchange)==reference(state)
+    agentorder=None
+    for t, item in enumerate(SCRIPT, start=1):
+        if item is None:
+            agentorder=LimitOrder(time_placed=t, side="Ask", size=SIZE, symbol=exchange.symbol, agent_id=agent.id, price=exchange.askprice)
+            agentorder._level="Ask_L1"
+            exchange.processorder(agentorder)
+            state.apply(COLS.index("lo_top_Ask"), SIZE)
+        else:
+            side, ordertype, level, size=item
+            arrival.script.append((t, side, ordertype, level if ordertype!="mo" else f"{side}_MO", size))
+            exchange.nextarrival()
+            state.apply(event(side, ordertype, level), size if size is not None else 0)
+        assert book(exchange)==reference(state), f"Order {t} of the script"
+    assert len(exchange.LOBhistory)==len(SCRIPT)
+    #Only the agent order is notified of its fill and only the agent order reaches the arrival model
+    notifications=[item[2] for item in kernel.queue if not kernel.isbatchmessage(item)]
+    assert [(recipientID, type(message)) for _, recipientID, message in notifications]==[(agent.id, OrderExecutedMsg)]
+    assert notifications[0][2].order is agentorder and agentorder.filled
+    assert arrival.updates==[{"time": 9, "side": "Ask", "order_type": "lo", "level": "Ask_L1", "size": SIZE}]
+
+def test_levels_are_keyed_by_tick():
+    exchange_book=OrderBook(ticksize=0.01)
+    exchange_book.pushlevel("Ask", 45.03, [])
+    price=45.0
+    for _ in range(3):
+        price+=0.01 #45.03 up to float rounding
+    assert exchange_book.levelat("Ask", price) is exchange_book.level("Ask", 0)
+    exchange_book.add(LimitOrder(time_placed=0, side="Ask", size=SIZE, symbol="AAPL", agent_id=-1, price=price))
+    assert exchange_book.level("Ask", 0).volume==SIZE
+    exchange_book.poplevel("Ask")
+    assert exchange_book.prices["Ask"]=={}
@@ -0,0 +1,79 @@
+import pytest
+from RLenv.Stochastic_Processes.Arrival_Models import ArrivalModel
+from RLenv.SimulationEntities.TradingAgent import TradingAgent
+from RLenv.SimulationEntities.Exchange import Exchange
+from RLenv.Messages.ExchangeMessages import BeginTradingMsg
+from RLenv.Kernel import Kernel
+
+class FixedArrival(ArrivalModel):
+    """Arrival model whose queues hold numorders orders of queueSize"""
+    def __init__(self, queueSize: int=10) -> None:
+        super().__init__(params={}, seed=1)
+        self.queueSize=queueSize
+    def generate_orders_in_queue(self, loblevel, numorders=10):
+        return numorders*[self.queueSize]
+    def generate_ordersize(self, loblevel):
+        return self.queueSize
+    def get_nextarrival(self):
+        return None
+    def update(self, **kwargs):
+        pass
+    def reset(self):
+        pass
+    def seed(self):
+        pass
+
+class WakeRecorder(TradingAgent):
+    """Trading agent recording the times it is woken up at"""
+    def __init__(self, seed: int=1) -> None:
+        super().__init__(seed=seed)
+        self.wakeups=[]
+    def wakeup(self, current_time: int) -> None:
+        super().wakeup(current_time)
+        self.wakeups.append(current_time)
+
+def build(debug: bool=False, numAgents: int=2):
+    agents=[WakeRecorder(seed=i) for i in range(numAgents)]
+    exchange=Exchange(Arrival_model=FixedArrival(), agents=agents, numOrdersPerLevel=5)
+    kernel=Kernel(agents=agents, exchange=exchange, log_to_file=False, debug=debug)
+    return kernel, exchange, agents
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_batch_message_reaches_every_recipient(debug):
+    kernel, exchange, agents=build(debug=debug)
+    exchange.initialize_exchange(priceMid0=45, spread0=4)
+    assert len(kernel.queue)==1 and kernel.isbatchmessage(kernel.queue[0])
+    kernel.run()
+    assert kernel.queue==[]
+    assert [agent.wakeups for agent in agents]==[[0], [0]]
+
+def test_batch_message_uses_dispatch_table():
+    kernel, exchange, agents=build()
+    delivered=[]
+    kernel.dispatch[BeginTradingMsg]=lambda timesent, senderID, recipientID, message: delivered.append((senderID, recipientID))
+    exchange.initialize_exchange(priceMid0=45, spread0=4)
+    kernel.run()
+    assert delivered==[(exchange.id, agent.id) for agent in agents]
+
+def test_debug_validates_batch_routes():
+    kernel, exchange, agents=build(debug=True)
+    with pytest.raises(AssertionError):
+        exchange.sendbatchmessage(recipientIDs=[agents[0].id, exchange.id], message=BeginTradingMsg())
+    with pytest.raises(KeyError):
+        exchange.sendbatchmessage(recipientIDs=[agents[0].id, -5], message=BeginTradingMsg())
+    assert kernel.queue==[]
+
+def test_batch_routes_not_validated_outside_debug():
+    kernel, exchange, agents=build(debug=False)
+    exchange.sendbatchmessage(recipientIDs=[agents[0].id, exchange.id], message=BeginTradingMsg())
+    assert len(kernel.queue)==1
+
+def test_debug_accepts_kernel_messages():
+    kernel, exchange, agents=build(debug=True)
+    kernel.sendmessage(-1, agents[0].id, BeginTradingMsg())
+    kernel.sendbatchmessage(-1, [agent.id for agent in agents], BeginTradingMsg())
+    assert len(kernel.queue)==2
+    with pytest.raises(AssertionError):
+        kernel.sendmessage(-1, exchange.id, BeginTradingMsg())
+    kernel.run()
+    assert [agent.wakeups for agent in agents]==[[0, 0], [0]]
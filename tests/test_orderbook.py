@@ -0,0 +1,106 @@
+import random
+import numpy as np
+from RLenv.Orders import LimitOrder
+from RLenv.OrderBook import OrderBook, LOBHistory
+
+TICK=0.01
+
+def newbook(LOBlevels: int=2, numOrders: int=3) -> OrderBook:
+    book=OrderBook(ticksize=TICK)
+    for i in range(LOBlevels):
+        for side, price in [("Ask", 45.02+i*TICK), ("Bid", 44.98-i*TICK)]:
+            book.pushlevel(side, price, [neworder(side, price, 10) for _ in range(numOrders)])
+    return book
+
+def neworder(side: str, price: float, size: int, agentID: int=-1) -> LimitOrder:
+    return LimitOrder(time_placed=0, side=side, size=size, symbol="AAPL", agent_id=agentID, price=price)
+
+def levels(book: OrderBook):
+    """Levels of the book from the deepest ask to the deepest bid, keyed as in Exchange.lob0"""
+    rtn={}
+    for i in reversed(range(book.depth("Ask"))):
+        rtn[f"Ask_L{i+1}"]=book.level("Ask", i)
+    for i in range(book.depth("Bid")):
+        rtn[f"Bid_L{i+1}"]=book.level("Bid", i)
+    return rtn
+
+def l2(book: OrderBook):
+    return {name: (level.price, level.volume) for name, level in levels(book).items()}
+
+def l3(book: OrderBook):
+    return {name: (level.price, tuple((order.order_id, order.size) for order in level)) for name, level in levels(book).items()}
+
+def step(book: OrderBook, rng: random.Random) -> None:
+    """Applies a random update to the book, keeping two non empty levels per side"""
+    side=rng.choice(OrderBook.SIDES)
+    sign=1 if side=="Ask" else -1
+    op=rng.choice(["add", "add", "cancel", "fill", "resize", "shift", "inspread"])
+    if op=="add":
+        level=book.level(side, rng.randrange(book.depth(side)))
+        book.add(neworder(side, level.price, rng.randint(1, 20), agentID=rng.choice([-1, 1])))
+    elif op=="cancel" and len(book.level(side, 1))>1:
+        book.cancel(rng.choice(book.level(side, 1).orders()).order_id)
+    elif op=="fill" and len(book.level(side, 0))>1:
+        book.popfront(side)
+    elif op=="resize":
+        order=book.level(side, 0).head.order
+        book.resize(order.order_id, rng.randint(1, 20))
+    elif op=="shift": #depleted touch: the deep level becomes the touch and a new deep level is opened
+        book.poplevel(side, touch=True)
+        price=book.level(side, -1).price+sign*TICK
+        book.pushlevel(side, price, [neworder(side, price, 10)])
+    elif op=="inspread" and book.touch("Ask")-book.touch("Bid")>1.5*TICK:
+        book.poplevel(side, touch=False)
+        price=book.touch(side)-sign*TICK
+        book.pushlevel(side, price, [neworder(side, price, 5)], touch=True)
+
+def test_history_rows_and_snapshots_match_the_live_book():
+    rng=random.Random(0)
+    book=newbook()
+    history=LOBHistory(LOBlevels=2, l3Every=3, capacity=4)
+    expectedl2, expectedl3, spreads=[], [], []
+    for t in range(200):
+        step(book, rng)
+        spread=book.touch("Ask")-book.touch("Bid")
+        history.append(t, book, spread)
+        expectedl2.append(l2(book))
+        spreads.append(spread)
+        if t%3==0:
+            expectedl3.append((t, l3(book)))
+    assert len(history)==200 and len(history.t)>=200 #grown from 4 rows
+    for i in range(200):
+        assert history.lob0(i)==expectedl2[i]
+    columns=history.columns()
+    assert np.array_equal(columns["t"], np.arange(200))
+    assert np.array_equal(columns["spread"], spreads)
+    assert len(history.l3)==len(expectedl3)
+    for k, expected in enumerate(expectedl3):
+        assert history.lobl3(k)==expected
+
+def test_unchanged_levels_share_their_snapshots():
+    book=newbook()
+    history=LOBHistory(LOBlevels=2, l3Every=1)
+    history.append(0, book, 0.04)
+    history.append(1, book, 0.04)
+    book.popfront("Ask")
+    history.append(2, book, 0.04)
+    (_, first), (_, second), (_, third)=history.l3
+    assert all(a is b for a, b in zip(first, second))
+    #Ask_L2, Ask_L1, Bid_L1, Bid_L2: only the ask touch changed
+    assert [a is b for a, b in zip(second, third)]==[True, False, True, True]
+
+def test_snapshots_and_columns_do_not_follow_the_live_book():
+    book=newbook()
+    history=LOBHistory(LOBlevels=2, l3Every=1)
+    history.append(0, book, 0.04)
+    before=l3(book)
+    touch=book.level("Bid", 0).head.order
+    book.resize(touch.order_id, 1)
+    book.cancel(book.level("Ask", 1).tail.order.order_id)
+    book.add(neworder("Ask", 45.02, 7))
+    assert history.lobl3(0)==(0, before)
+    assert history.lob0(0)["Bid_L1"]==(44.98, 30)
+    assert all(isinstance(queue, tuple) and all(isinstance(item, tuple) for item in queue) for queue in history.l3[0][1])
+    columns=history.columns()
+    columns["volume"][0]=0
+    assert history.lob0(0)["Ask_L1"]==(45.02, 30)
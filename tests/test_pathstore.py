@@ -0,0 +1,31 @@
+import numpy as np
+from run_benchmarks import writeFakeParams
+from simulation.PathStore import PathWriter, PathReader
+from simulation.Simulate import Simulate
+
+def runpath(paramsPath, todPath, filePathName):
+    Ts, _, _, _ = Simulate().run(20, paramsPath, todPath, filePathName = filePathName, bufferSize = 16, beta = 1., avgSpread = .01, spread0 = 5, price0 = 45, kernel = 'exp', rng = np.random.default_rng(0))
+    return Ts
+
+def test_run_overwrites_existing_store(tmp_path):
+    paramsPath, todPath = writeFakeParams(str(tmp_path), 'exp', 0)
+    path = str(tmp_path / "path")
+    for _ in range(2):
+        Ts = runpath(paramsPath, todPath, path)
+        reader = PathReader(path)
+        t = reader.read(["t"])["t"]
+        assert len(reader) == len(Ts)
+        assert len(reader.chunks) > 1
+        assert np.all(np.diff(t) >= 0)
+
+def test_writer_appends_only_when_asked(tmp_path):
+    path = str(tmp_path)
+    chunk = {"t": np.arange(3.), "event": np.zeros(3, dtype = np.int8)}
+    PathWriter(path, events = ["e"], levels = []).append(chunk)
+    writer = PathWriter(path, append = True)
+    writer.append({"t": chunk["t"] + 3, "event": chunk["event"]})
+    assert len(PathReader(path)) == 6
+    PathWriter(path, events = ["e"], levels = []).append(chunk)
+    reader = PathReader(path)
+    assert len(reader) == 3
+    assert list(reader.read(["t"])["t"]) == [0., 1., 2.]